@@ -15,6 +15,18 @@ st.set_page_config(page_title="メインページ", page_icon='icon.png', layout
 # テーブル名
 financial_info_table = 'financial_info'
 metrics_table = 'metrics' 
+ratios_table = 'fundamental_ratios'
+market_stats_table = 'market_stats'
+
+# fundamental_ratiosの指標の列名と表示名
+ratio_names = {
+    "grossMargin": "売上高総利益率",
+    "operatingMargin": "営業利益率",
+    "netMargin": "当期純利益率",
+    "currentRatio": "流動比率",
+    "quickRatio": "当座比率",
+    "capitalAdequacyRatio": "自己資本比率",
+}
 
 # 条件入力UI
 st.sidebar.header("検索条件")
@@ -31,12 +43,12 @@ if st.sidebar.button("データを取得"): # SQLでは、テーブル名をバ
         SELECT *
         FROM {financial_info_table}
         WHERE symbol = :symbol
-        AND "asOfDate"::date BETWEEN :start_date AND :end_date
+        AND "asOfDate" >= :start_date AND "asOfDate" < :end_date
     """)
     financial_info_params = {
         "symbol": symbol,
         "start_date": start_date,
-        "end_date": end_date
+        "end_date": end_date + datetime.timedelta(days=1) # 終了日を含める（列をキャストせず、翌日未満で指定してインデックスを使う）
     }
 
     # SQLクエリとパラメータの定義
@@ -49,24 +61,35 @@ if st.sidebar.button("データを取得"): # SQLでは、テーブル名をバ
         "symbol": symbol
     }
 
+    # SQLクエリの定義（52週高値・安値、移動平均などは取得後にmarket_stats.pyで計算済み。最新の基準日の1行を取得）
+    market_stats_query = text(f"""
+        SELECT *
+        FROM {market_stats_table}
+        WHERE symbol = :symbol
+        ORDER BY "date" DESC
+        LIMIT 1
+    """)
+
+    # SQLクエリの定義（指標は取得後にfundamentals.pyで計算済み）
+    ratios_query = text(f"""
+        SELECT *
+        FROM {ratios_table}
+        WHERE symbol = :symbol
+        AND "asOfDate" >= :start_date AND "asOfDate" < :end_date
+    """)
+
     # データの取得
     try:
         financial_data = fetch_data(financial_info_query, financial_info_params)
         metrics_data = fetch_data(metrics_query, metrics_params)
+        ratios_data = fetch_data(ratios_query, financial_info_params).rename(columns=ratio_names)
+        market_stats_data = fetch_data(market_stats_query, metrics_params)
 
         if not financial_data.empty or metrics_data.empty:
-            # financial_infoデータの取得
-            financial_data["売上高総利益率"] = financial_data["GrossProfit"] / financial_data["TotalRevenue"]
-            financial_data["営業利益率"] = financial_data["OperatingIncome"] / financial_data["TotalRevenue"]
-            financial_data["当期純利益率"] = financial_data["NetIncomeCommonStockholders"] / financial_data["TotalRevenue"]
-            financial_data["流動比率"] = financial_data["CurrentAssets"] / financial_data["CurrentLiabilities"]
-            financial_data["当座比率"] = (financial_data["CurrentAssets"] - financial_data["Inventory"]) / financial_data["CurrentLiabilities"]
-            financial_data["自己資本比率"] = financial_data["StockholdersEquity"] / financial_data["TotalAssets"]
-
-            fin_3m = financial_data.query("periodType=='3M'").loc[:,["symbol","asOfDate","periodType","TotalRevenue","GrossProfit","OperatingIncome","NetIncomeCommonStockholders","NetIncome",
+            fin_3m = ratios_data.query("periodType=='3M'").loc[:,["symbol","asOfDate","periodType","TotalRevenue","GrossProfit","OperatingIncome","NetIncomeCommonStockholders","NetIncome",
                                                                     "売上高総利益率","営業利益率","当期純利益率","流動比率","当座比率","自己資本比率","TotalAssets","StockholdersEquity","TotalLiabilitiesNetMinorityInterest"]].dropna()
             fin_3m = fin_3m.sort_values('asOfDate')
-            fin_12m = financial_data.query("periodType=='12M'").loc[:,["symbol","asOfDate","periodType","TotalRevenue","GrossProfit","OperatingIncome","NetIncomeCommonStockholders","NetIncome",
+            fin_12m = ratios_data.query("periodType=='12M'").loc[:,["symbol","asOfDate","periodType","TotalRevenue","GrossProfit","OperatingIncome","NetIncomeCommonStockholders","NetIncome",
                                                                     "売上高総利益率","営業利益率","当期純利益率","流動比率","当座比率","自己資本比率","TotalAssets","StockholdersEquity","TotalLiabilitiesNetMinorityInterest"]].dropna()
             fin_12m = fin_12m.sort_values('asOfDate')
             latest_row_3m = fin_3m[fin_3m["asOfDate"] == fin_3m["asOfDate"].max()]
@@ -257,5 +280,7 @@ if 'financial_data' in locals() and 'metrics_data' in locals():
     st.success(f"{len(financial_data)}件のデータを取得しました。")
     st.dataframe(financial_data) 
     st.dataframe(metrics_data) 
+    if 'market_stats_data' in locals():
+        st.dataframe(market_stats_data)
 else:
     st.info("左側のサイドバーで条件を入力し、「データを取得」ボタンを押してください。")
\ No newline at end of file
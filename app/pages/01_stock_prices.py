@@ -6,7 +6,10 @@ import streamlit as st
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 from utils.function import *
+from get_data.config import snapshot_config
+from get_data.price_dataset import PriceDataset
 
 st.set_page_config(layout="wide")
 
@@ -14,7 +17,10 @@ st.set_page_config(layout="wide")
 conn_string = f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"
 engine = create_engine(conn_string)
 
+# 株式分割・併合を反映した株価のビュー（stock_prices × adjustment_factors）
 stock_table = 'adjusted_stock_prices'
+# 株価のローカルデータセット（year=/symbol_prefix=のParquet。DBに接続せずに読み込める）
+price_dataset = PriceDataset(snapshot_config['price_dataset_dir'])
 
 # 条件入力UI
 st.sidebar.header("検索条件")
@@ -22,6 +28,7 @@ raw_symbol = st.sidebar.text_input("シンボル", value="1301")
 symbol = raw_symbol + '.T'
 start_date = st.sidebar.date_input("開始日", (datetime.datetime.today() - datetime.timedelta(days=700)))
 end_date = st.sidebar.date_input("終了日", datetime.datetime.today())
+data_source = st.sidebar.radio("データソース", ["PostgreSQL", "ローカル（Parquet）"])
 
 # データベースからデータを取得
 if st.sidebar.button("データを取得"): # SQLでは、テーブル名をバインドパラメータとして扱うえない。→SQLの構文解析とクエリプランの生成が、実行前に行われる必要があるため
@@ -31,17 +38,22 @@ if st.sidebar.button("データを取得"): # SQLでは、テーブル名をバ
         SELECT *
         FROM {stock_table}
         WHERE symbol = :symbol
-        AND "date"::date BETWEEN :start_date AND :end_date
+        AND "date" >= :start_date AND "date" < :end_date
     """)
     stock_prices_params = {
         "symbol": symbol,
         "start_date": start_date,
-        "end_date": end_date
+        "end_date": end_date + datetime.timedelta(days=1) # 終了日を含める（列をキャストせず、翌日未満で指定してインデックスを使う）
     }
 
     # データの取得
     try:
-        stock_prices_data = fetch_data(stock_prices_query, stock_prices_params)
+        if data_source == "PostgreSQL":
+            stock_prices_data = fetch_data(stock_prices_query, stock_prices_params)
+        else:
+            # 対象の銘柄・期間のパーティションだけを読み込み、ビューと同じ計算で株式分割・併合を反映
+            stock_prices_data = price_dataset.read(symbols=[symbol], start=start_date, end=end_date,
+                                                   columns=['symbol', 'date', 'open', 'high', 'low', 'close', 'adjclose', 'volume'], adjusted=True)
         # データをセッション状態に保存
         st.session_state.stock_prices_data = stock_prices_data
     except Exception as e:
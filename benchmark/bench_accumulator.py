@@ -0,0 +1,48 @@
+"""
+取得ループの結合コストのベンチマーク
+    - 従来方式：ループ内で毎回pd.concat（それまでの結果全体をコピーするため銘柄数の2乗に比例）
+    - FrameAccumulator：リストに追加し、最後に1回だけ結合（銘柄数に比例）
+
+実行方法
+    python -m benchmark.bench_accumulator
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from get_data.accumulator import FrameAccumulator
+
+# 1銘柄あたりの財務情報（年次4期＋四半期5期、約200列）を模したDataframe
+def make_ticker_frame(i, n_rows=9, n_cols=200):
+    df = pd.DataFrame(np.random.rand(n_rows, n_cols), columns=[f'col_{c}' for c in range(n_cols)])
+    df.insert(0, 'symbol', f'{1000 + i}.T')
+    return df
+
+def bench_concat(frames):
+    start = time.perf_counter()
+    df_all = pd.DataFrame()
+    for df in frames:
+        df_all = pd.concat([df_all, df])
+    return time.perf_counter() - start
+
+def bench_accumulator(frames):
+    start = time.perf_counter()
+    acc = FrameAccumulator()
+    for df in frames:
+        acc.append(df)
+    acc.concat()
+    return time.perf_counter() - start
+
+def main():
+    print(f"{'銘柄数':>8} {'pd.concat(秒)':>14} {'FrameAccumulator(秒)':>22} {'1銘柄あたり(ミリ秒)':>20}")
+    for n in [250, 500, 1000, 2000, 4000]:
+        frames = [make_ticker_frame(i) for i in range(n)]
+        t_concat = bench_concat(frames)
+        t_acc = bench_accumulator(frames)
+        print(f"{n:>8} {t_concat:>14.2f} {t_acc:>22.3f} {t_acc / n * 1000:>20.3f}")
+
+if __name__ == '__main__':
+    main()
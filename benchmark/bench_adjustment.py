@@ -0,0 +1,62 @@
+"""
+株式分割・併合による株価修正のベンチマーク
+    - 従来方式：イベントごとにiterrowsでループし、株価全体に対するマスクで修正
+    - 累積修正係数：銘柄ごとの係数をcumprodで計算し、merge_asofで1回だけ適用
+    ※ 両方式の結果が一致することも確認
+
+実行方法
+    python -m benchmark.bench_adjustment
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from get_data.devide_union import adjust_stock_prices, price_columns
+
+# 銘柄数×営業日数の株価と、株式分割・併合のイベントを模したDataframe
+def make_data(n_symbols, n_days, n_events):
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range(end='2024-12-30', periods=n_days)
+    symbols = [f'{1000 + i}.T' for i in range(n_symbols)]
+    stock_df = pd.DataFrame({
+        'symbol': np.repeat(symbols, n_days),
+        'date': np.tile(dates, n_symbols),
+    })
+    for col in price_columns:
+        stock_df[col] = rng.random(len(stock_df)) * 1000
+    stock_df['volume'] = rng.integers(0, 1000000, len(stock_df)).astype(float)
+    devide_union_df = pd.DataFrame({
+        'symbol': rng.choice(symbols, n_events),
+        'company_name': '',
+        'ratio': rng.choice([0.5, 0.25, 0.2, 10.0], n_events),
+        'last_date_with_rights': rng.choice(dates, n_events),
+    }).drop_duplicates(subset=['symbol', 'last_date_with_rights'])
+    return stock_df, devide_union_df
+
+# 従来方式（イベントごとに株価全体のマスクを作成）
+def adjust_by_iterrows(stock_df, devide_union_df):
+    adjusted_df = stock_df.copy()
+    for _, row in devide_union_df.iterrows():
+        mask = (adjusted_df['symbol'] == row['symbol']) & (adjusted_df['date'] <= row['last_date_with_rights'])
+        adjusted_df.loc[mask, price_columns] *= row['ratio']
+        adjusted_df.loc[mask, 'volume'] /= row['ratio']
+    return adjusted_df
+
+def main():
+    print(f"{'行数':>10} {'イベント数':>10} {'iterrows(秒)':>13} {'累積修正係数(秒)':>16} {'結果の一致':>10}")
+    for n_symbols, n_days, n_events in [(500, 500, 100), (2000, 750, 300), (4000, 1250, 600)]:
+        stock_df, devide_union_df = make_data(n_symbols, n_days, n_events)
+        start = time.perf_counter()
+        expected = adjust_by_iterrows(stock_df, devide_union_df)
+        t_iterrows = time.perf_counter() - start
+        start = time.perf_counter()
+        adjusted_df, _ = adjust_stock_prices(stock_df, devide_union_df, as_of=stock_df['date'].max())
+        t_factor = time.perf_counter() - start
+        matched = np.allclose(adjusted_df[price_columns + ['volume']], expected[price_columns + ['volume']])
+        print(f"{len(stock_df):>10} {len(devide_union_df):>10} {t_iterrows:>13.2f} {t_factor:>16.2f} {str(matched):>10}")
+
+if __name__ == '__main__':
+    main()
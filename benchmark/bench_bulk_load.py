@@ -0,0 +1,64 @@
+"""
+DBへの書き込みのベンチマーク（ローカルのPostgreSQLを使用）
+    - 従来方式：DataFrame.to_sql（1行ずつのINSERT）
+    - bulk_load：COPY FROM STDIN（append、replace、upsert）
+
+実行方法
+    python -m benchmark.bench_bulk_load
+    ※ 接続先はget_data.configのdb_config（環境変数BENCH_DB_URLで上書き可）
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from get_data.bulk_load import bulk_load
+
+def create_bench_engine():
+    if 'BENCH_DB_URL' in os.environ:
+        return create_engine(os.environ['BENCH_DB_URL'])
+    from get_data.config import db_config
+    return create_engine(f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}")
+
+# stock_pricesテーブルを模したDataframe（1銘柄あたり250営業日）
+def make_stock_prices(n_rows, n_days=250):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'symbol': [f'{1000 + i // n_days}.T' for i in range(n_rows)],
+        'date': (pd.Timestamp('2024-01-01') + pd.to_timedelta(np.arange(n_rows) % n_days, unit='D')).date,
+        'open': rng.random(n_rows) * 1000,
+        'high': rng.random(n_rows) * 1000,
+        'low': rng.random(n_rows) * 1000,
+        'close': rng.random(n_rows) * 1000,
+        'volume': rng.integers(0, 1000000, n_rows),
+        'adjclose': rng.random(n_rows) * 1000,
+    })
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def main():
+    engine = create_bench_engine()
+    table = 'bench_stock_prices'
+    print(f"{'行数':>8} {'to_sql(秒)':>11} {'append(秒)':>11} {'replace(秒)':>12} {'upsert(秒)':>11}")
+    for n in [10000, 50000, 100000, 500000]:
+        df = make_stock_prices(n)
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+        t_to_sql = timed(lambda: df.to_sql(table, engine, if_exists="replace", index=False))
+        t_append = timed(lambda: bulk_load(df, table, engine))
+        t_replace = timed(lambda: bulk_load(df, table, engine, mode="replace"))
+        # 全行が既存のキーと重複する（すべて更新になる）場合
+        t_upsert = timed(lambda: bulk_load(df, table, engine, mode="upsert", key=['symbol', 'date']))
+        print(f"{n:>8} {t_to_sql:>11.2f} {t_append:>11.2f} {t_replace:>12.2f} {t_upsert:>11.2f}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+    engine.dispose()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+株価のローカルデータセットの読み込みのベンチマーク
+    - 全件読み込み：データセット全体を読み込んでからpandasで銘柄・期間を絞り込む
+    - プッシュダウン：PriceDataset.readで銘柄・期間・列の条件をpyarrowに渡し、対象のパーティション・行グループだけを読む
+
+実行方法
+    python -m benchmark.bench_price_dataset
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import pandas as pd
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from get_data.price_dataset import PriceDataset
+from benchmark.bench_adjustment import make_data
+
+def main():
+    print(f"{'行数':>10} {'全件読み込み(秒)':>16} {'プッシュダウン(秒)':>18} {'読み込んだ行数':>14}")
+    for n_symbols, n_days in [(500, 1250), (2000, 1250), (4000, 1250)]:
+        stock_df, _ = make_data(n_symbols, n_days, 0)
+        base_dir = tempfile.mkdtemp()
+        try:
+            price_dataset = PriceDataset(base_dir)
+            price_dataset.write(stock_df)
+            symbol = stock_df['symbol'].iloc[len(stock_df) // 2]
+            start, end = stock_df['date'].max() - pd.Timedelta(days=700), stock_df['date'].max()
+
+            t = time.perf_counter()
+            df = price_dataset.read()
+            df = df[(df['symbol'] == symbol) & (df['date'] >= start) & (df['date'] <= end)]
+            t_full = time.perf_counter() - t
+
+            t = time.perf_counter()
+            pushed = price_dataset.read(symbols=[symbol], start=start, end=end, columns=['date', 'open', 'high', 'low', 'close', 'volume'])
+            t_pushdown = time.perf_counter() - t
+            assert len(df) == len(pushed)
+            print(f"{len(stock_df):>10} {t_full:>16.2f} {t_pushdown:>18.3f} {len(pushed):>14}")
+        finally:
+            shutil.rmtree(base_dir)
+
+if __name__ == '__main__':
+    main()
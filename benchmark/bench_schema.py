@@ -0,0 +1,54 @@
+"""
+financial_infoのメモリ使用量のベンチマーク
+    - 従来方式：symbol、periodType、currencyCodeはobject（Pythonの文字列）、数値列はすべてfloat64
+    - schema.py：category、float32（1株当たりの値・比率）、float64（金額・株数）
+    - schema.py + to_sparse：欠損値が90%以上の列を疎な配列に変換（分析時）
+    ※ Parquetに保存した場合のファイルサイズも比較
+
+実行方法
+    python -m benchmark.bench_schema
+"""
+
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from get_data.schema import info_list, financial_info_dtypes, apply_schema, to_sparse
+
+# 全銘柄の年次・四半期の財務情報を模したDataframe（列ごとに欠損率が異なる）
+def make_financial_info(n_symbols, n_periods=9):
+    rng = np.random.default_rng(0)
+    n_rows = n_symbols * n_periods
+    df = pd.DataFrame({
+        'symbol': np.repeat([f'{1000 + i}.T' for i in range(n_symbols)], n_periods),
+        'asOfDate': np.tile(pd.date_range(end='2024-12-31', periods=n_periods, freq='QE').astype(str), n_symbols),
+        'periodType': np.tile(['12M'] * 4 + ['3M'] * 5, n_symbols),
+        'currencyCode': 'JPY',
+    })
+    missing_ratio = rng.uniform(0.3, 0.99, len(info_list) - 4)
+    values = rng.random((n_rows, len(info_list) - 4)) * 1e11
+    values[rng.random(values.shape) < missing_ratio] = np.nan
+    return pd.concat([df, pd.DataFrame(values, columns=info_list[4:])], axis=1)
+
+def parquet_size(df):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'df.parquet')
+        df.to_parquet(path, index=False)
+        return os.path.getsize(path)
+
+def main():
+    print(f"{'行数':>8} {'従来(MB)':>9} {'schema(MB)':>11} {'+sparse(MB)':>12} {'Parquet従来(MB)':>16} {'Parquet schema(MB)':>19}")
+    for n_symbols in [1000, 4000]:
+        raw = make_financial_info(n_symbols)
+        before = raw.copy()
+        before['asOfDate'] = pd.to_datetime(before['asOfDate'])
+        after = apply_schema(raw, financial_info_dtypes)
+        sparse = to_sparse(after)
+        mb = lambda df: df.memory_usage(deep=True).sum() / 1e6
+        print(f"{len(raw):>8} {mb(before):>9.1f} {mb(after):>11.1f} {mb(sparse):>12.1f} "
+              f"{parquet_size(before) / 1e6:>16.1f} {parquet_size(after) / 1e6:>19.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+銘柄ごとの取得結果（Dataframe）を溜めておき、まとめて結合するアキュムレータ
+    - ループ内でpd.concatを繰り返すと、毎回それまでの結果全体をコピーするため銘柄数の2乗に比例して遅くなる
+    - appendではリストに追加するだけにして、結合はconcat（最後に1回）またはflush（flush_rows行またはflush_frames件ごと）で行う
+    - flush時にon_flushを渡しておくと、結合したDataframeをon_flushに渡して手元からは破棄する
+"""
+
+import pandas as pd
+
+class FrameAccumulator:
+
+    def __init__(self, flush_rows=None, flush_frames=None, on_flush=None):
+        self.flush_rows = flush_rows
+        self.flush_frames = flush_frames
+        self.on_flush = on_flush
+        self.frames = []
+        self.n_rows = 0
+
+    def __len__(self):
+        return self.n_rows
+
+    # 取得結果を追加（flush_rows行またはflush_frames件に達したらflush）
+    # 引数:Dataframe
+    # 戻値:無し
+    def append(self, df):
+        if df is None:
+            return
+        self.frames.append(df)
+        self.n_rows += len(df)
+        if (self.flush_rows is not None and self.n_rows >= self.flush_rows) or \
+           (self.flush_frames is not None and len(self.frames) >= self.flush_frames):
+            self.flush()
+
+    # 溜めている取得結果を1回だけ結合
+    # 引数:無し
+    # 戻値:結合したDataframe
+    def concat(self):
+        if not self.frames:
+            return pd.DataFrame()
+        return pd.concat(self.frames)
+
+    # 溜めている取得結果を結合してon_flushに渡し、手元から破棄
+    # 引数:無し
+    # 戻値:結合したDataframe
+    def flush(self):
+        df = self.concat()
+        self.frames = []
+        self.n_rows = 0
+        if self.on_flush is not None and not df.empty:
+            self.on_flush(df)
+        return df
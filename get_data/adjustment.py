@@ -0,0 +1,44 @@
+"""
+株式分割・併合による株価の修正（累積修正係数の計算と適用）
+    - pandasだけで計算する関数のみを置き、DBへの接続やスクレイピングは行わない
+      （devide_union.pyはimport時にDBエンジンを作成し、selenium・bs4を読み込むため、アプリや分析からはこちらを使う）
+    - DBのadjusted_stock_pricesビュー、PriceDataset、MarketStatsが同じ係数で修正する
+"""
+
+import pandas as pd
+
+# 修正対象の価格列
+price_columns = ['open', 'high', 'low', 'close', 'adjclose']
+
+# 株式分割・併合情報から、銘柄ごとの累積修正係数を計算
+#   - 基準日（as_of）までに権利付き最終日を迎えたすべてのイベントが対象（実行しなかった日のイベントも漏れない）
+#   - 権利付き最終日以前の株価に掛ける係数を、新しいイベントから順に累積（cumprod）
+# 引数:株式分割・併合情報のDataframe、基準日
+# 戻値:銘柄、適用終了日（effective_date：この日以前の株価に適用）、累積修正係数のDataframe
+def compute_adjustment_factors(devide_union_df, as_of):
+    events = devide_union_df[['symbol', 'ratio', 'last_date_with_rights']].copy()
+    events['effective_date'] = pd.to_datetime(events['last_date_with_rights'])
+    # イベントがない場合（空のDataframeはobject型）でもcumprodできるよう数値に変換
+    events['ratio'] = events['ratio'].astype(float)
+    events = events[events['effective_date'] <= pd.Timestamp(as_of)]
+    # 同じイベントが毎日スクレイピングされて追記されるため重複を除き、同じ日の複数イベントは係数を掛け合わせる
+    events = events.drop_duplicates(subset=['symbol', 'effective_date', 'ratio'])
+    factors = events.groupby(['symbol', 'effective_date'], as_index=False)['ratio'].prod()
+    factors = factors.sort_values(['symbol', 'effective_date'], ascending=[True, False])
+    factors['cumulative_factor'] = factors.groupby('symbol')['ratio'].cumprod()
+    return factors[['symbol', 'effective_date', 'cumulative_factor']].sort_values('effective_date').reset_index(drop=True)
+
+# 株価に累積修正係数を適用（未修正の株価に適用するため、何度実行しても二重に修正されない）
+#   - 各行に、その日以降で最も早いイベントの累積修正係数をmerge_asof（forward）で対応付ける
+# 引数:未修正の株価のDataframe、compute_adjustment_factorsの戻値
+# 戻値:修正後の株価のDataframe
+def apply_adjustment_factors(stock_df, factors):
+    adjusted_df = stock_df.copy()
+    adjusted_df['date'] = pd.to_datetime(adjusted_df['date'])
+    adjusted_df = adjusted_df.sort_values('date', kind='stable')
+    merged = pd.merge_asof(adjusted_df[['date', 'symbol']], factors, left_on='date', right_on='effective_date',
+                           by='symbol', direction='forward')
+    factor = merged['cumulative_factor'].fillna(1.0).to_numpy()
+    adjusted_df[price_columns] = adjusted_df[price_columns].mul(factor, axis=0)
+    adjusted_df['volume'] = adjusted_df['volume'] / factor
+    return adjusted_df.sort_index()
@@ -0,0 +1,143 @@
+"""
+PostgreSQLへの一括書き込み（COPY FROM STDIN）
+    - DataFrame.to_sqlの既定の書き込みは1行ずつのINSERTのため、行数が多いテーブルでは書き込みに時間がかかる
+    - DataframeをCSV形式のバッファに書き出し、psycopg2のcopy_expertでCOPY FROM STDINにまとめて流し込む
+    - 書き込みモード
+        append：既存のテーブルに追記（テーブルがなければto_sqlと同じ列定義で作成）
+        replace：ステージングテーブルに書き込んでから、1つのトランザクション内で元のテーブルと入れ替える
+                 （書き込み中も読み出し側は入れ替え前のテーブルを参照できる）
+                 元のテーブルの主キー・一意制約・インデックス（migrationで作成したものを含む）は入れ替え後に作り直す
+                 ビューが参照しているテーブル（stock_pricesなど）は入れ替えられないため、ValueErrorとする（upsertを使用）
+        upsert：一時テーブルにCOPYしてから、INSERT ... ON CONFLICT (key) DO UPDATEで既存の行を更新
+                （keep_existing=Trueの場合は欠損値で既存の値を上書きしない。列の一部だけを取得した行を書き込むテーブル用）
+    - PostgreSQL以外のエンジンでは、append・replaceはto_sqlの既定の書き込みにフォールバック
+"""
+
+import io
+import csv
+
+# COPY 1回あたりの行数（バッファのメモリ使用量の上限）
+chunksize = 100000
+
+# 識別子をクォート（asOfDateのような大文字を含む列名に対応）
+def quote(conn, name):
+    return conn.dialect.identifier_preparer.quote(name)
+
+# 行のイテレータをCSV形式のバッファに書き出してCOPYで流し込む
+# 引数:DBAPIのカーソル、クォート済みのテーブル名、クォート済みの列名のリスト、行のイテレータ
+# 戻値:無し
+def copy_rows(cursor, table_name, columns, rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cursor.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+# DataFrame.to_sqlのmethodに渡す書き込み処理（pandasが列定義からテーブルを作成したうえでCOPYで書き込む）
+# 引数:pandasのSQLTable、SQLAlchemyのConnection、列名のリスト、行のイテレータ（欠損値はNone）
+# 戻値:無し
+def copy_from_stdin(table, conn, keys, data_iter):
+    table_name = quote(conn, table.name)
+    if table.schema:
+        table_name = f"{quote(conn, table.schema)}.{table_name}"
+    with conn.connection.cursor() as cur:
+        copy_rows(cur, table_name, [quote(conn, key) for key in keys], data_iter)
+
+# Dataframeをテーブルに一括で書き込む
+# 引数:Dataframe、テーブル名、SQLAlchemyのエンジン、書き込みモード（append、replace、upsert）、upsert時の一意キーの列名のリスト、
+#      テーブル作成時の列の型（省略時はpandasがdtypeから決める）、upsert時に欠損値で既存の値を上書きしないか
+# 戻値:無し
+def bulk_load(df, table, engine, mode="append", key=None, dtype=None, keep_existing=False):
+    method = copy_from_stdin if engine.dialect.name == "postgresql" else None
+    if mode == "append":
+        df.to_sql(table, engine, if_exists="append", index=False, method=method, chunksize=chunksize, dtype=dtype)
+    elif mode == "replace":
+        staging = f"{table}_staging"
+        with engine.begin() as conn:
+            if method is None:
+                df.to_sql(table, conn, if_exists="replace", index=False, chunksize=chunksize, dtype=dtype)
+                return
+            views = dependent_views(conn, table)
+            if views:
+                raise ValueError(f"{table}はビュー（{', '.join(views)}）が参照しているため、replaceでは書き込めません")
+            constraints, indexes = table_keys(conn, table)
+            df.to_sql(staging, conn, if_exists="replace", index=False, method=method, chunksize=chunksize, dtype=dtype)
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {quote(conn, table)}")
+            conn.exec_driver_sql(f"ALTER TABLE {quote(conn, staging)} RENAME TO {quote(conn, table)}")
+            # 元のテーブルと一緒に削除された制約・インデックスを、同じ名前・定義で作り直す
+            for name, definition in constraints:
+                conn.exec_driver_sql(f"ALTER TABLE {quote(conn, table)} ADD CONSTRAINT {quote(conn, name)} {definition}")
+            for definition in indexes:
+                conn.exec_driver_sql(definition)
+    elif mode == "upsert":
+        if method is None:
+            raise ValueError("upsertはPostgreSQLのエンジンでのみ使用できます")
+        if not key:
+            raise ValueError("upsertには一意キーの列名（key）を指定してください")
+        upsert(df, table, engine, key, dtype, keep_existing)
+    else:
+        raise ValueError(f"未対応の書き込みモードです: {mode}")
+
+# 一時テーブルにCOPYしてから、一意キーが重複する行は更新、それ以外は追加
+# 引数:Dataframe、テーブル名、SQLAlchemyのエンジン、一意キーの列名のリスト、テーブル作成時の列の型、
+#      欠損値で既存の値を上書きしないか（Falseの場合は欠損値も含めて取得した値で置き換える）
+# 戻値:無し
+def upsert(df, table, engine, key, dtype=None, keep_existing=False):
+    # 同じキーの行が複数あるとON CONFLICT DO UPDATEがエラーになるため、後に取得した行を残す
+    df = df.drop_duplicates(subset=key, keep="last")
+    with engine.begin() as conn:
+        # テーブルがなければto_sqlと同じ列定義で作成し、ON CONFLICTに必要な一意インデックスを作成
+        df.head(0).to_sql(table, conn, if_exists="append", index=False, dtype=dtype)
+        ensure_unique_key(conn, table, key)
+        staging = quote(conn, f"{table}_upsert")
+        target = quote(conn, table)
+        columns = [quote(conn, col) for col in df.columns]
+        key_columns = [quote(conn, col) for col in key]
+        conn.exec_driver_sql(f"CREATE TEMP TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP")
+        with conn.connection.cursor() as cur:
+            for start in range(0, len(df), chunksize):
+                chunk = df.iloc[start:start + chunksize]
+                copy_rows(cur, staging, columns, chunk.astype(object).where(chunk.notna(), None).itertuples(index=False))
+        if keep_existing:
+            updates = [f"{col} = COALESCE(EXCLUDED.{col}, {target}.{col})" for col in columns if col not in key_columns]
+        else:
+            updates = [f"{col} = EXCLUDED.{col}" for col in columns if col not in key_columns]
+        on_conflict = f"DO UPDATE SET {', '.join(updates)}" if updates else "DO NOTHING"
+        conn.exec_driver_sql(
+            f"INSERT INTO {target} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {staging} "
+            f"ON CONFLICT ({', '.join(key_columns)}) {on_conflict}")
+
+# テーブルを参照しているビューの一覧
+# 引数:SQLAlchemyのConnection、テーブル名
+# 戻値:ビュー名のリスト（テーブルがない場合は空のリスト）
+def dependent_views(conn, table):
+    rows = conn.exec_driver_sql(
+        "SELECT DISTINCT v.relname FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid JOIN pg_class v ON v.oid = r.ev_class "
+        "WHERE d.refobjid = to_regclass(%s) AND v.oid <> d.refobjid ORDER BY v.relname", (quote(conn, table),)).all()
+    return [row[0] for row in rows]
+
+# テーブルの主キー・一意制約と、それ以外のインデックスの定義
+# 引数:SQLAlchemyのConnection、テーブル名
+# 戻値:(制約名, 制約の定義)のリスト、CREATE INDEX文のリスト
+def table_keys(conn, table):
+    constraints = conn.exec_driver_sql(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'u') ORDER BY conname",
+        (quote(conn, table),)).all()
+    indexes = conn.exec_driver_sql(
+        "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = to_regclass(%s) AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid) ORDER BY c.relname",
+        (quote(conn, table),)).all()
+    return [tuple(row) for row in constraints], [row[0] for row in indexes]
+
+# ON CONFLICTの対象となる一意インデックスを作成（作成済みなら何もしない）
+# 引数:SQLAlchemyのConnection、テーブル名、一意キーの列名のリスト
+# 戻値:無し
+def ensure_unique_key(conn, table, key):
+    index_name = f"{table}_{'_'.join(key)}_key".lower()
+    if conn.exec_driver_sql("SELECT 1 FROM pg_indexes WHERE tablename = %s AND indexname = %s", (table, index_name)).first():
+        return
+    # 追記のみで書き込んでいた頃の重複行を削除（後から追加した行を残す）
+    target = quote(conn, table)
+    same_key = " AND ".join(f"a.{quote(conn, col)} = b.{quote(conn, col)}" for col in key)
+    conn.exec_driver_sql(f"DELETE FROM {target} a USING {target} b WHERE a.ctid < b.ctid AND {same_key}")
+    conn.exec_driver_sql(
+        f"CREATE UNIQUE INDEX {quote(conn, index_name)} ON {target} ({', '.join(quote(conn, col) for col in key)})")
@@ -7,4 +7,35 @@ db_config = {
     'host': 'localhost',          # ホスト（例: 'localhost'）
     'port': '5432',               # ポート番号（通常は5432）
     'database': 'finance'   # データベース名
-}
\ No newline at end of file
+}
+
+# 株価・財務情報取得の並列実行設定
+ingest_config = {
+    'max_workers': int(os.environ.get('INGEST_MAX_WORKERS', 4)),                 # 同時に処理する銘柄数
+    'requests_per_second': float(os.environ.get('INGEST_REQUESTS_PER_SEC', 2.0)), # 全ワーカーで共有する1秒あたりのリクエスト数の上限
+    'burst': int(os.environ.get('INGEST_BURST', 2)),                               # 待機せずに連続して送れるリクエスト数（requests_per_secondと同程度）
+    'batch_size': int(os.environ.get('INGEST_BATCH_SIZE', 20)),                    # 株価・財務情報を1つのTickerオブジェクトでまとめて取得する銘柄数
+    'flush_tickers': int(os.environ.get('INGEST_FLUSH_TICKERS', 200)),             # 取得中にDBへ書き込む間隔（銘柄数）
+    'flush_rows': int(os.environ.get('INGEST_FLUSH_ROWS', 50000)),                 # 取得中にDBへ書き込む間隔（行数）
+    'statement_lag_days': int(os.environ.get('INGEST_STATEMENT_LAG_DAYS', 30)),          # 決算期末から財務諸表が公開されるまでの日数
+    'statement_recheck_days': int(os.environ.get('INGEST_STATEMENT_RECHECK_DAYS', 7)),   # 公開が遅れている財務諸表を確認し直す間隔（日数）
+    'statement_refresh_days': int(os.environ.get('INGEST_STATEMENT_REFRESH_DAYS', 90))   # 更新がなくても財務諸表を取得し直す間隔（日数）
+}
+
+# EDINET APIへのアクセス設定
+edinet_config = {
+    'max_concurrency': int(os.environ.get('EDINET_MAX_CONCURRENCY', 4)),              # 同時に実行するリクエスト数
+    'requests_per_second': float(os.environ.get('EDINET_REQUESTS_PER_SEC', 2.0)),     # 全リクエストで共有する1秒あたりのリクエスト数の上限
+    'cache_revalidate_days': int(os.environ.get('EDINET_CACHE_REVALIDATE_DAYS', 3)),  # 書類一覧のキャッシュがあっても取得し直す直近の日数
+    'cache_retention_days': int(os.environ.get('EDINET_CACHE_RETENTION_DAYS', 3700)), # 書類一覧のキャッシュを保持する日数
+    'parse_workers': int(os.environ.get('EDINET_PARSE_WORKERS', os.cpu_count() or 1)), # 有価証券報告書のCSVを解析するプロセス数
+    'parse_chunksize': int(os.environ.get('EDINET_PARSE_CHUNKSIZE', 16))              # 1回に各プロセスへ渡すdocIDの件数
+}
+
+# 取得データのスナップショット（Parquet）の設定
+snapshot_config = {
+    'base_dir': os.environ.get('SNAPSHOT_DIR', './input/finance_data/snapshot'), # スナップショットの保存先
+    'price_dataset_dir': os.environ.get('PRICE_DATASET_DIR', './input/finance_data/price_dataset'), # 株価のローカルデータセットの保存先
+    'market_stats_dir': os.environ.get('MARKET_STATS_DIR', './input/finance_data/market_stats'),  # 市場統計の状態（直近の株価）の保存先
+    'export_csv': os.environ.get('SNAPSHOT_EXPORT_CSV', '0') == '1'               # 従来のcp932のCSVも出力するか
+}
@@ -9,9 +9,11 @@ import os
 import datetime
 from bs4 import BeautifulSoup
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
 from selenium import webdriver
 from get_data.config import db_config
+from get_data.bulk_load import bulk_load, copy_from_stdin, copy_rows, quote
+from get_data.adjustment import price_columns, compute_adjustment_factors, apply_adjustment_factors
 
 #  DBエンジンのインスタンスを作成
 conn_string = f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"
@@ -79,34 +81,131 @@ def fetch_merge_data():
 
     return union_df
 
-# 既存の株価データと株式分割情報を利用して修正
-def adjust_stock_prices(stock_df, devide_union_df):
-    devide_union_df['last_date_with_rights'] = pd.to_datetime(devide_union_df['last_date_with_rights'])
-    adjusted_df = stock_df.copy()
-    filtered_df = pd.DataFrame(columns=["symbol", "company_name", "ratio", "last_date_with_rights"])
-
-    today = datetime.datetime.now().date()
-    if today in devide_union_df['last_date_with_rights'].values:       
-        # 昨日の日付だけを抽出
-        filtered_df = devide_union_df[devide_union_df["last_date_with_rights"] == today]
-        for _, row in filtered_df.iterrows():
-            ticker = row["symbol"] 
-            # company_name = row["company_name"]
-            ratio = row["ratio"]
-            # 該当銘柄の分割日以前のデータを修正
-            mask = (adjusted_df['symbol'] == ticker) & (adjusted_df['date'] <= today)
-            adjusted_df.loc[mask, ['open', 'high', 'low', 'close', 'adjclose']] *= ratio
-            adjusted_df.loc[mask, 'volume'] /= ratio
-
+# 既存の株価データと株式分割・併合情報を利用して修正
+# 引数:未修正の株価のDataframe、株式分割・併合情報のDataframe、基準日（省略時は当日）
+# 戻値:修正後の株価のDataframe、適用したイベントのDataframe
+def adjust_stock_prices(stock_df, devide_union_df, as_of=None):
+    as_of = as_of or datetime.datetime.now().date()
+    factors = compute_adjustment_factors(devide_union_df, as_of)
+    adjusted_df = apply_adjustment_factors(stock_df, factors)
+    last_dates = pd.to_datetime(devide_union_df['last_date_with_rights'])
+    filtered_df = devide_union_df[last_dates <= pd.Timestamp(as_of)].drop_duplicates(subset=['symbol', 'ratio', 'last_date_with_rights'])
     return adjusted_df, filtered_df
 
+# まだ株価に反映していないイベントを抽出（適用済みのイベントはapplied_dataに記録）
+# 引数:株式分割・併合情報のDataframe、適用済みのイベントのDataframe、基準日
+# 戻値:未適用のイベントのDataframe
+def find_unapplied_events(devide_union_df, applied_df, as_of):
+    events = devide_union_df.drop_duplicates(subset=['symbol', 'ratio', 'last_date_with_rights'])
+    events = events[pd.to_datetime(events['last_date_with_rights']) <= pd.Timestamp(as_of)]
+    applied_keys = set(zip(applied_df['symbol'], pd.to_datetime(applied_df['last_date_with_rights'])))
+    is_applied = [key in applied_keys for key in zip(events['symbol'], pd.to_datetime(events['last_date_with_rights']))]
+    return events[~pd.Series(is_applied, index=events.index, dtype=bool)]
+
+# 累積修正係数をadjustment_factorsテーブルに保存（イベントの数だけの小さなテーブルのため、毎回すべて作り直す）
+# 引数:SQLAlchemyのエンジン、株式分割・併合情報のDataframe、基準日
+# 戻値:累積修正係数のDataframe
+def refresh_adjustment_factors(engine, devide_union_df, as_of):
+    factors = compute_adjustment_factors(devide_union_df, as_of)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("""
+            CREATE TABLE IF NOT EXISTS adjustment_factors (
+                symbol TEXT NOT NULL,
+                effective_date TIMESTAMP NOT NULL,
+                cumulative_factor DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (symbol, effective_date)
+            )""")
+        # 同じトランザクション内で入れ替えるため、読み出し側から空のテーブルは見えない
+        conn.exec_driver_sql("DELETE FROM adjustment_factors")
+        factors.to_sql("adjustment_factors", conn, if_exists="append", index=False, method=copy_from_stdin)
+    return factors
+
+# 以前の実体テーブルのadjusted_stock_prices（修正済みの株価）から未修正の株価を復元し、stock_pricesを置き換えてから実体テーブルを削除
+#   - 以前はstock_pricesにも修正済みの株価を書き戻していたため、そのままビューにすると適用済みのイベントが二重に適用される
+#   - applied_dataに記録された適用済みのイベントの累積修正係数で、価格は割り戻し、出来高は掛け戻す
+#   - 同じ日の行が複数ある場合は、先に書き込まれた行（その後に適用されたイベントがすべて反映されている行）を使う
+#   - 呼び出し元のトランザクション内で実行するため、途中で失敗した場合は実体テーブルもstock_pricesも元のまま残る
+# 引数:SQLAlchemyのConnection
+# 戻値:復元した行数
+def restore_unadjusted_prices(conn):
+    if inspect(conn).has_table('applied_data'):
+        applied_df = pd.read_sql("SELECT symbol, ratio, last_date_with_rights FROM applied_data", conn)
+    else:
+        applied_df = pd.DataFrame(columns=['symbol', 'ratio', 'last_date_with_rights'])
+    factors = compute_adjustment_factors(applied_df, today)
+    conn.exec_driver_sql("""
+        CREATE TEMP TABLE applied_factors (
+            symbol TEXT NOT NULL,
+            effective_date TIMESTAMP NOT NULL,
+            cumulative_factor DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (symbol, effective_date)
+        )""")
+    with conn.connection.cursor() as cur:
+        copy_rows(cur, "applied_factors", ["symbol", "effective_date", "cumulative_factor"], factors.itertuples(index=False))
+
+    if not inspect(conn).has_table('stock_prices'):
+        conn.exec_driver_sql("CREATE TABLE stock_prices (LIKE adjusted_stock_prices)")
+    target_columns = {col['name'] for col in inspect(conn).get_columns('stock_prices')}
+    columns = [col['name'] for col in inspect(conn).get_columns('adjusted_stock_prices') if col['name'] in target_columns]
+    restored = []
+    for col in columns:
+        if col in price_columns:
+            restored.append(f"p.{quote(conn, col)} / COALESCE(f.cumulative_factor, 1)")
+        elif col == 'volume':
+            restored.append(f"p.{quote(conn, col)} * COALESCE(f.cumulative_factor, 1)")
+        else:
+            restored.append(f"p.{quote(conn, col)}")
+    conn.exec_driver_sql("DELETE FROM stock_prices")
+    result = conn.exec_driver_sql(f"""
+        INSERT INTO stock_prices ({', '.join(quote(conn, col) for col in columns)})
+        SELECT DISTINCT ON (p.symbol, p.date) {', '.join(restored)}
+        FROM adjusted_stock_prices p
+        LEFT JOIN LATERAL (
+            SELECT a.cumulative_factor
+            FROM applied_factors a
+            WHERE a.symbol = p.symbol AND a.effective_date >= p.date
+            ORDER BY a.effective_date
+            LIMIT 1
+        ) f ON true
+        WHERE p.symbol IS NOT NULL AND p.date IS NOT NULL
+        ORDER BY p.symbol, p.date, p.ctid""")
+    conn.exec_driver_sql("DROP TABLE applied_factors")
+    conn.exec_driver_sql("DROP TABLE adjusted_stock_prices")
+    return result.rowcount
+
+# 未修正の株価（stock_prices）に累積修正係数を読み出し時に掛けるビュー（adjusted_stock_prices）を作成
+#   - 株式分割・併合があっても更新するのはadjustment_factorsだけで、株価を書き直さない
+#   - 各行には、その日以降で最も早いイベントの累積修正係数を対応付ける（apply_adjustment_factorsと同じ計算）
+#   - 以前の実体テーブルのadjusted_stock_pricesが残っている場合は、未修正の株価を復元してからビューに置き換える
+#     （復元・テーブルの削除・ビューの作成は1つのトランザクションで行い、失敗した場合は実体テーブルを残す）
+# 引数:SQLAlchemyのエンジン
+# 戻値:無し
+def create_adjusted_view(engine):
+    with engine.begin() as conn:
+        if 'adjusted_stock_prices' in inspect(conn).get_table_names(schema='public'):
+            restored = restore_unadjusted_prices(conn)
+            print(f"adjusted_stock_pricesから未修正の株価（{restored}行）をstock_pricesに復元しました")
+        conn.exec_driver_sql(f"""
+            CREATE OR REPLACE VIEW adjusted_stock_prices AS
+            SELECT p.symbol, p.date,
+                   {', '.join(f'p.{col} * COALESCE(f.cumulative_factor, 1) AS {col}' for col in price_columns)},
+                   p.volume / COALESCE(f.cumulative_factor, 1) AS volume
+            FROM stock_prices p
+            LEFT JOIN LATERAL (
+                SELECT a.cumulative_factor
+                FROM adjustment_factors a
+                WHERE a.symbol = p.symbol AND a.effective_date >= p.date
+                ORDER BY a.effective_date
+                LIMIT 1
+            ) f ON true""")
+
 
 def main():
     # 修正値が反映される日（split_date）の銘柄をピックアップして、前日（last_date_with_rights）以前のデータを修正
     devide_df = fetch_split_data()
     union_df = fetch_merge_data()
     devide_union_df = pd.concat([devide_df, union_df])
-    devide_union_df.to_sql("devide_union_data", engine, if_exists="append", index=False)
+    bulk_load(devide_union_df, "devide_union_data", engine)
     # プログラムの開始時に必要なディレクトリをすべて作成
     os.makedirs('./input/devide_union', exist_ok=True)
     devide_union_df.to_csv('./input/devide_union/devide_union_df.csv', index=False)
@@ -0,0 +1,78 @@
+"""
+EDINETの書類一覧（documents.json）のキャッシュ
+    - 過去の日付の書類一覧はほぼ変わらないため、(書類種別, 日付)ごとにgzip圧縮したJSONで保存し、再実行時はネットワークにアクセスしない
+    - 直近revalidate_days日分は書類が追加・取下げされることがあるため、キャッシュがあっても取得し直す
+    - retention_days日より古い日付のキャッシュは削除（evict）
+    - EDINETがエラーを返した応答（metadata.statusが200以外）はキャッシュしない
+
+input
+└── non-finance_data
+    └── docID
+        └── cache
+            └── type_2
+                └── 2024-01-01.json.gz
+"""
+
+import os
+import gzip
+import json
+import datetime
+
+class DocumentListCache:
+
+    def __init__(self, cache_dir='./input/non-finance_data/docID/cache', revalidate_days=3, retention_days=3700):
+        self.cache_dir = cache_dir
+        self.revalidate_days = revalidate_days
+        self.retention_days = retention_days
+
+    def path(self, day, doc_type):
+        return os.path.join(self.cache_dir, f"type_{doc_type}", f"{day.isoformat()}.json.gz")
+
+    # キャッシュ済みの書類一覧を取得
+    # 引数:日付、書類種別
+    # 戻値:書類一覧（JSON）。キャッシュがない、または再検証が必要な日付の場合はNone
+    def get(self, day, doc_type):
+        if day > datetime.date.today() - datetime.timedelta(days=self.revalidate_days):
+            return None
+        try:
+            with gzip.open(self.path(day, doc_type), 'rt', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # キャッシュがない、または書き込み途中で壊れている場合は取得し直す
+            return None
+
+    # 書類一覧を保存
+    # 引数:日付、書類種別、書類一覧（JSON）
+    # 戻値:無し
+    def put(self, day, doc_type, json_data):
+        if str(json_data.get("metadata", {}).get("status")) != "200":
+            return
+        path = self.path(day, doc_type)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 並列に書き込んでも読み出し側が書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(json_data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    # 保持期間を過ぎたキャッシュを削除
+    # 引数:無し
+    # 戻値:削除したファイル数
+    def evict(self):
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        oldest = datetime.date.today() - datetime.timedelta(days=self.retention_days)
+        n_removed = 0
+        for type_dir in os.listdir(self.cache_dir):
+            type_path = os.path.join(self.cache_dir, type_dir)
+            if not os.path.isdir(type_path):
+                continue
+            for file in os.listdir(type_path):
+                try:
+                    day = datetime.date.fromisoformat(file.split('.')[0])
+                except ValueError:
+                    continue
+                if day < oldest:
+                    os.remove(os.path.join(type_path, file))
+                    n_removed += 1
+        return n_removed
@@ -24,9 +24,11 @@ yahooqueryの取得明細情報
 
 input
 └── finance_data
-    ├── company_financial_info.csv
-    ├── company_metrics.csv
-    └── stock_prices.csv
+    ├── snapshot/origin：company_financial_info、company_metrics、stock_prices（Parquet、snapshot.py）
+    └── origin（snapshot_config['export_csv']が有効な場合のみ）
+        ├── company_financial_info.csv
+        ├── company_metrics.csv
+        └── stock_prices.csv
 
 # 東証上場銘柄一覧に記載された証券コードの企業の財務指標と財務情報を取得
 # 出力ファイルの一覧
@@ -45,7 +47,13 @@ import datetime
 from yahooquery import Ticker
 from requests.exceptions import ChunkedEncodingError
 from sqlalchemy import create_engine
-from get_data.config import db_config
+from get_data.config import db_config, snapshot_config
+from get_data.accumulator import FrameAccumulator
+from get_data.bulk_load import bulk_load
+from get_data.snapshot import SnapshotStore
+from get_data.schema import apply_schema, financial_info_dtypes, financial_info_sql_types, financial_info_key
+from get_data.fundamentals import refresh_fundamental_ratios
+from get_data.migration import migrate
 
 #  DBエンジンのインスタンスを作成
 conn_string = f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"
@@ -246,7 +254,15 @@ valuation_measures_columns = ['symbol', 'asOfDate', 'periodType', 'EnterpriseVal
 
 # テキストデータの名称とXBRL上のcodeを、keysという辞書で渡す
 class GetFinanceData:
-        
+    # get_company_metricsで参照するquoteSummaryのモジュール
+    metrics_modules = ['summaryDetail', 'financialData']
+
+    def __init__(self, rate_limiter=None):
+        # 銘柄ごとのquoteSummaryの取得結果（1銘柄につき1回だけリクエストする。取得に失敗した銘柄は保持しない）
+        self.module_cache = {}
+        # 取得処理の内部で追加のリクエストを行う場合に使うレート制限（IngestionEngineのRateLimiterを共有）
+        self.rate_limiter = rate_limiter
+
     def preprocess_stock_lists(self, raw_stock_lists):
         # ETF、ETNを除外
         stock_lists = raw_stock_lists[raw_stock_lists['市場・商品区分'] != 'ETF・ETN']
@@ -280,14 +296,32 @@ class GetFinanceData:
         return df_stock_prices, missed_stock_prices_data
 
 
+    # quoteSummaryのsummaryDetail、financialDataを1回のリクエストで取得し、銘柄ごとに保持
+    # 引数:証券コードのリスト、Tickerオブジェクト（複数銘柄可）
+    # 戻値:証券コードをキーとしたモジュールのdict
+    def fetch_modules(self, symbols, ticker_data):
+        modules = {symbol: self.module_cache[symbol] for symbol in symbols if symbol in self.module_cache}
+        if len(modules) < len(symbols):
+            data = ticker_data.get_modules(self.metrics_modules)
+            for symbol in ticker_data.symbols:
+                # 取得に失敗した銘柄はエラーメッセージ（str）が入る
+                # 失敗はキャッシュせず、リトライや銘柄ごとの取得ではリクエストし直す
+                modules[symbol] = data.get(symbol) if isinstance(data, dict) else data
+                if isinstance(modules[symbol], dict):
+                    self.module_cache[symbol] = modules[symbol]
+        return {symbol: modules.get(symbol) for symbol in symbols}
+
     # 企業の財務データを取得
     # 引数:証券コード、Tickerオブジェクト
     # 戻値:企業の財務指標:Dataframe
     def get_company_metrics(self, ticker_num, ticker_data):
         # 企業の財務指標を保存するリスト
         company_metrics = [ticker_num]
+        modules = self.fetch_modules([ticker_num], ticker_data)[ticker_num]
         missed_company_metrics = pd.DataFrame(columns=['symbol', 'ticker_data', 'summary_detail_key'])
 
+        # コメントアウトした株価・出来高の統計（52週高値・安値、移動平均、平均出来高など）は、
+        # 保存済みの株価からmarket_stats.pyで計算してmarket_statsテーブルに書き込む
         summary_detail_keys = [
             # 'previousClose',# 前日の終値
             # 'open', # 今日の開始値
@@ -323,7 +357,7 @@ class GetFinanceData:
             ]
         for summary_detail_key in summary_detail_keys:
             try:
-                company_metrics.append(ticker_data.summary_detail[ticker_num][summary_detail_key])
+                company_metrics.append(modules['summaryDetail'][summary_detail_key])
             except Exception as e:
                 print(f'証券コード:{ticker_num},未取得の属性:{summary_detail_key}')
                 company_metrics.append(np.nan)
@@ -353,11 +387,11 @@ class GetFinanceData:
                             ]
         for financial_data_key in financial_data_keys:
             try:
-                company_metrics.append(ticker_data.financial_data[ticker_num][financial_data_key])
+                company_metrics.append(modules['financialData'][financial_data_key])
             except Exception as e:
                 print(f'証券コード:{ticker_num},未取得の属性:{financial_data_key}')
                 company_metrics.append(np.nan)
-                missed_data = [{'symbol':ticker_num , 'ticker_data': ticker_data, 'summary_detail_key': summary_detail_key}]
+                missed_data = [{'symbol':ticker_num , 'ticker_data': ticker_data, 'summary_detail_key': financial_data_key}]
                 missed_data_df = pd.DataFrame(missed_data)
                 missed_company_metrics = pd.concat([missed_company_metrics, missed_data_df], ignore_index=True)  
 
@@ -448,6 +482,14 @@ class GetFinanceData:
 
             return pd.DataFrame(), missed_company_finacial_info
 
+        df_financial_info = self.combine_financial_info(income_statement, cash_flow, balance_sheet, valuation_measures)
+
+        return df_financial_info, missed_company_finacial_info
+
+    # 損益計算書、キャッシュフロー計算書、貸借対照表、企業価値評価を結合
+    # 引数:各財務諸表:Dataframe（複数銘柄を含んでもよい）
+    # 戻値:企業の財務状況:Dataframe
+    def combine_financial_info(self, income_statement, cash_flow, balance_sheet, valuation_measures):
         # データの型を確認して処理を分岐
         if not isinstance(income_statement, pd.DataFrame):
             # 取得データがDataFrameでない場合、空のDataFrameを作成
@@ -517,13 +559,126 @@ class GetFinanceData:
         # combined_df_2['asOfDate'] = combined_df_2['asOfDate'].astype('datetime64[ns]')        
         df_financial_info = pd.merge(combined_df_2, valuation_measures , on=['symbol', 'asOfDate', 'periodType'], how='outer')
 
+        # 企業価値評価だけを取得した場合など、計算に使う列がない場合は欠損値で補完
+        for col in ['StockholdersEquity', 'TotalAssets']:
+            if col not in df_financial_info.columns:
+                df_financial_info[col] = np.nan
+
         # 過去の自己資本比率を計算
         df_financial_info['capitalAdequacyRatio'] = df_financial_info['StockholdersEquity'] / df_financial_info['TotalAssets']
         # 過去の自己資本利益率を計算
         df_financial_info['ROE'] = df_financial_info['NetIncome'] / df_financial_info['StockholdersEquity']
 
+        return df_financial_info
+
+    # 複数銘柄の取得結果を1つのDataframeにまとめ、取得できなかった銘柄を抽出
+    # 引数:証券コードのリスト、Tickerオブジェクト、Tickerオブジェクトを受け取って取得処理を行う関数
+    # 戻値:取得結果:Dataframe（symbol列付き）、取得できなかった証券コードのリスト
+    def fetch_batch_frame(self, symbols, ticker_data, fetch):
+        data = fetch(ticker_data)
+        if isinstance(data, pd.DataFrame):
+            df = data.reset_index()
+            if 'symbol' not in df.columns:
+                return pd.DataFrame(), list(symbols)
+            df['symbol'] = df['symbol'].astype(str)
+            fetched = set(df['symbol'])
+            return df, [symbol for symbol in symbols if symbol not in fetched]
+
+        # 1銘柄でもエラーがあるとyahooqueryは銘柄ごとの生データ（dict）を返すため、エラー銘柄を除いて再取得
+        if isinstance(data, dict):
+            failed = [symbol for symbol in symbols if isinstance(data.get(symbol), str) or symbol not in data]
+            rest = [symbol for symbol in symbols if symbol not in failed]
+            if rest and len(rest) < len(symbols):
+                # 再取得のリクエストも共有のレート制限の対象にする
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire(len(rest))
+                df, missed = self.fetch_batch_frame(rest, Ticker(rest, asynchronous=True), fetch)
+                return df, failed + missed
+
+        return pd.DataFrame(), list(symbols)
+
+    # 複数銘柄の株価をまとめて取得
+    # 引数:証券コードのリスト、複数銘柄のTickerオブジェクト、取得開始日
+    # 戻値:株価:Dataframe、取得できなかった銘柄:Dataframe
+    def get_stock_prices_batch(self, symbols, ticker_data, start_day):
+        missed_stock_prices_data = pd.DataFrame(columns=["symbol", "ticker_data"])
+
+        try:
+            df_stock_prices, missed_symbols = self.fetch_batch_frame(
+                symbols, ticker_data, lambda t: t.history(start=start_day, interval='1d'))
+        except Exception as e:
+            print(f"{', '.join(symbols)} の株価取得中にエラー: {e}")
+            df_stock_prices, missed_symbols = pd.DataFrame(), list(symbols)
+
+        if missed_symbols:
+            print(f"株価を取得できなかった銘柄: {', '.join(missed_symbols)}")
+            missed_data_df = pd.DataFrame([{'symbol': symbol, 'ticker_data': ticker_data} for symbol in missed_symbols])
+            missed_stock_prices_data = pd.concat([missed_stock_prices_data, missed_data_df], ignore_index=True)
+
+        return df_stock_prices, missed_stock_prices_data
+
+    # 複数銘柄の過去の財務状況をまとめて取得
+    # 引数:証券コードのリスト、複数銘柄のTickerオブジェクト、企業価値評価だけを取得するか（財務諸表に更新がない銘柄）
+    # 戻値:企業の財務状況:Dataframe、取得できなかった銘柄:Dataframe
+    def get_company_finacial_info_batch(self, symbols, ticker_data, valuation_only=False):
+        missed_company_finacial_info = pd.DataFrame(columns=['symbol', 'ticker_data'])
+
+        statements = {
+            'income_statement_annual': (lambda t: t.income_statement(trailing=False, frequency='a'), income_statement_annual_columns),
+            'income_statement_quarterly': (lambda t: t.income_statement(trailing=False, frequency='q'), income_statement_quarterly_columns),
+            'cash_flow_annual': (lambda t: t.cash_flow(trailing=False, frequency='a'), cash_flow_annual_columns),
+            'cash_flow_quarterly': (lambda t: t.cash_flow(trailing=False, frequency='q'), cash_flow_quarterly_columns),
+            'balance_sheet_annual': (lambda t: t.balance_sheet(frequency='a'), balance_sheet_annual_columns),
+            'balance_sheet_quarterly': (lambda t: t.balance_sheet(frequency='q'), balance_sheet_quarterly_columns),
+            'valuation_measures': (lambda t: t.valuation_measures, valuation_measures_columns),
+        }
+
+        frames = {name: pd.DataFrame(columns=columns) for name, (_, columns) in statements.items()}
+        if valuation_only:
+            statements = {'valuation_measures': statements['valuation_measures']}
+        try:
+            for name, (fetch, columns) in statements.items():
+                df, _ = self.fetch_batch_frame(symbols, ticker_data, fetch)
+                frames[name] = df if not df.empty else pd.DataFrame(columns=columns)
+        except Exception as e:
+            print(f"{', '.join(symbols)}：エラー内容{e}")
+            missed_data_df = pd.DataFrame([{'symbol': symbol, 'ticker_data': ticker_data} for symbol in symbols])
+            missed_company_finacial_info = pd.concat([missed_company_finacial_info, missed_data_df], ignore_index=True)
+            time.sleep(10)
+
+            return pd.DataFrame(), missed_company_finacial_info
+
+        income_statement = pd.concat([frames['income_statement_annual'], frames['income_statement_quarterly']])
+        cash_flow = pd.concat([frames['cash_flow_annual'], frames['cash_flow_quarterly']])
+        balance_sheet = pd.concat([frames['balance_sheet_annual'], frames['balance_sheet_quarterly']])
+        df_financial_info = self.combine_financial_info(income_statement, cash_flow, balance_sheet, frames['valuation_measures'])
+
+        # どの財務諸表も取得できなかった銘柄をmissedとして記録
+        fetched = set(df_financial_info['symbol'].astype(str))
+        missed_symbols = [symbol for symbol in symbols if symbol not in fetched]
+        if missed_symbols:
+            print(f"財務情報を取得できなかった銘柄: {', '.join(missed_symbols)}")
+            missed_data_df = pd.DataFrame([{'symbol': symbol, 'ticker_data': ticker_data} for symbol in missed_symbols])
+            missed_company_finacial_info = pd.concat([missed_company_finacial_info, missed_data_df], ignore_index=True)
+
         return df_financial_info, missed_company_finacial_info
 
+    # 財務諸表（損益計算書・キャッシュフロー計算書・貸借対照表）の値を1つ以上取得できた銘柄
+    # 企業価値評価（valuation_measures）の行しかない銘柄は含めない
+    # 引数:財務情報:Dataframe
+    # 戻値:証券コードのset
+    def symbols_with_statements(self, df_financial_info):
+        if df_financial_info is None or df_financial_info.empty or 'symbol' not in df_financial_info.columns:
+            return set()
+        statement_columns = [col for col in dict.fromkeys(income_statement_annual_columns + income_statement_quarterly_columns
+                                                          + cash_flow_annual_columns + cash_flow_quarterly_columns
+                                                          + balance_sheet_annual_columns + balance_sheet_quarterly_columns)
+                             if col not in valuation_measures_columns and col != 'currencyCode' and col in df_financial_info.columns]
+        if not statement_columns:
+            return set()
+        has_values = df_financial_info[statement_columns].notna().any(axis=1)
+        return set(df_financial_info.loc[has_values, 'symbol'].astype(str))
+
     def preprocess_date(self, date_list):
         dates = pd.Series(date_list).astype(str)
         dates = dates.str.split(' ').str[0]
@@ -546,24 +701,18 @@ def main():
     gfd = GetFinanceData()
     stock_lists = gfd.preprocess_stock_lists(raw_stock_lists)
 
-    # 企業情報の指標、財務状況を保存するデータフレームの作成
-    df_all_stock_prices = pd.DataFrame()
-    missed_all_stock_prices = pd.DataFrame()
+    # 企業情報の指標、財務状況を溜めておくアキュムレータ（結合はループ後に1回だけ行う）
+    all_stock_prices = FrameAccumulator()
+    missed_all_stock_prices = FrameAccumulator()
 
-    df_all_company_metrics = pd.DataFrame()
-    missed_all_company_metrics = pd.DataFrame()
+    all_company_metrics = FrameAccumulator()
+    missed_all_company_metrics = FrameAccumulator()
 
-    df_all_company_financial_info = pd.DataFrame()
-    missed_all_company_financial_info = pd.DataFrame()
-
-    # 企業の銘柄名、市場・商品区分、33業種、17業種を保持
-    series_ticker_name = pd.Series()
-    series_market_product_category = pd.Series()
-    series_type_33 = pd.Series()
-    series_type_17 = pd.Series()
+    all_company_financial_info = FrameAccumulator()
+    missed_all_company_financial_info = FrameAccumulator()
 
     # tickerの企業情報の指標、財務状況を取得
-    for ticker in raw_stock_lists['コード']:
+    for ticker in stock_lists['コード']:
         time.sleep(3)
         # 証券コードに「.T」を追加
         jpx_filter_df = stock_lists[stock_lists['コード'] == ticker]
@@ -578,56 +727,77 @@ def main():
         except Exception as e:
             print(f"エラー: {e}")
 
-        series_ticker_name = pd.concat([series_ticker_name, jpx_filter_df['銘柄名']])
-        series_market_product_category = pd.concat([series_market_product_category, jpx_filter_df['市場・商品区分']])
-        series_type_33 = pd.concat([series_type_33, jpx_filter_df['33業種区分']])
-        series_type_17 = pd.concat([series_type_17, jpx_filter_df['17業種区分']])
-
         # 企業情報の取得
         df_stock_prices, missed_stock_prices = gfd.get_stock_prices(ticker_num, ticker_data, '2000-01-01')
-        df_all_stock_prices = pd.concat([df_all_stock_prices, df_stock_prices])
-        missed_all_stock_prices = pd.concat([missed_all_stock_prices, missed_stock_prices])
+        all_stock_prices.append(df_stock_prices)
+        missed_all_stock_prices.append(missed_stock_prices)
 
         df_company_metrics, missed_company_metrics = gfd.get_company_metrics(ticker_num, ticker_data)
-        df_all_company_metrics = pd.concat([df_all_company_metrics, df_company_metrics])
-        missed_all_company_metrics = pd.concat([missed_all_company_metrics, missed_company_metrics])
+        # 企業の銘柄名、市場・商品区分、33業種、17業種を付与
+        df_company_metrics['ticker_name'] = jpx_filter_df['銘柄名'].values[:1]
+        df_company_metrics['market_product_category'] = jpx_filter_df['市場・商品区分'].values[:1]
+        df_company_metrics['type_33'] = jpx_filter_df['33業種区分'].values[:1]
+        df_company_metrics['type_17'] = jpx_filter_df['17業種区分'].values[:1]
+        all_company_metrics.append(df_company_metrics)
+        missed_all_company_metrics.append(missed_company_metrics)
 
         df_company_financial_info, missed_company_financial_info = gfd.get_company_finacial_info(ticker_num, ticker_data)
-        df_all_company_financial_info = pd.concat([df_all_company_financial_info, df_company_financial_info])
-        missed_all_company_financial_info = pd.concat([missed_all_company_financial_info, missed_company_financial_info])
-
-    os.makedirs('./input/finance_data/origin', exist_ok=True)
-    # 不要な列の削除を行い、CSVファイルに保存
+        all_company_financial_info.append(df_company_financial_info)
+        missed_all_company_financial_info.append(missed_company_financial_info)
+
+    df_all_stock_prices = all_stock_prices.concat()
+    missed_all_stock_prices = missed_all_stock_prices.concat()
+    df_all_company_metrics = all_company_metrics.concat()
+    missed_all_company_metrics = missed_all_company_metrics.concat()
+    df_all_company_financial_info = all_company_financial_info.concat()
+    missed_all_company_financial_info = missed_all_company_financial_info.concat()
+
+    # 過去データはスナップショット（snapshot/origin）に保存し、CSVはexport_csvが有効な場合のみ出力
+    store = SnapshotStore(snapshot_config['base_dir'])
+    run_date = datetime.date.today().strftime('%Y%m%d')
+    def save_origin(name, df, encoding=None):
+        store.clear('origin', name, run_date)
+        store.write('origin', name, df, run_date)
+        if snapshot_config['export_csv']:
+            os.makedirs('./input/finance_data/origin', exist_ok=True)
+            df.to_csv(f'./input/finance_data/origin/{name}.csv', encoding=encoding, index=False, errors='ignore')
+
+    # 不要な列の削除を行い、スナップショットに保存
     # df_all_stock_prices['date'] = pd.to_datetime(df_all_stock_prices['date'], errors='coerce')
     df_all_stock_prices = df_all_stock_prices.drop('index', axis=1)
     df_all_stock_prices = df_all_stock_prices.drop_duplicates()
     df_all_stock_prices['date'] = gfd.preprocess_date(df_all_stock_prices['date'])
-    df_all_stock_prices.to_csv('./input/finance_data/origin/stock_prices.csv', encoding='cp932', index=False, errors='ignore')
-    df_all_stock_prices.to_sql("stock_prices", engine, if_exists="append", index=False)    
-    missed_all_stock_prices.to_csv('./input/finance_data/origin/missed_stock_prices.csv', index=False)
-
-    # 列の追加、削除を行いCSVファイルに保存
-    df_all_company_metrics['ticker_name'] = series_ticker_name.values
-    df_all_company_metrics['market_product_category'] = series_market_product_category.values
-    df_all_company_metrics['type_33'] = series_type_33.values
-    df_all_company_metrics['type_17'] = series_type_17.values
+    save_origin('stock_prices', df_all_stock_prices, 'cp932')
+    bulk_load(df_all_stock_prices, "stock_prices", engine, mode="upsert", key=['symbol', 'date'])
+    save_origin('missed_stock_prices', missed_all_stock_prices)
+
+    # 列の追加、削除を行いスナップショットに保存
     # df_all_company_metrics['recommendMean'] = None
     # df_all_company_metrics['QuickRatio'] = None
     # df_all_company_metrics = df_all_company_metrics.drop(columns=['recommendMean', 'QuickRatio'])
     df_all_company_metrics['exDividendDate'] = pd.to_datetime(df_all_company_metrics['exDividendDate'], errors='coerce').dt.date # datetime64に変換
     df_all_company_metrics = df_all_company_metrics.drop_duplicates()
-    df_all_company_metrics.to_csv('./input/finance_data/origin/company_metrics.csv', encoding='cp932', index=False, errors='ignore')
-    df_all_company_metrics.to_sql("metrics", engine, if_exists="append", index=False)    
-    missed_all_company_metrics.to_csv('./input/finance_data/origin/missed_company_metrics.csv', index=False)
+    save_origin('company_metrics', df_all_company_metrics, 'cp932')
+    bulk_load(df_all_company_metrics, "metrics", engine)    
+    save_origin('missed_company_metrics', missed_all_company_metrics)
 
-    # 欠損率の計算と95%以上の欠損がある列を特定し削除した後にCSVファイルに保存
+    # 欠損率の計算と95%以上の欠損がある列を特定
     missing_ratio = df_all_company_financial_info.isnull().mean()
     high_missing_columns = missing_ratio[missing_ratio >= 0.95].index
-    df_all_company_financial_info = df_all_company_financial_info.drop(columns=high_missing_columns)
-    df_all_company_financial_info = df_all_company_financial_info.drop_duplicates()
-    df_all_company_financial_info.to_csv('./input/finance_data/origin/company_financial_info.csv', encoding='cp932', index=False, errors='ignore')
-    df_all_company_financial_info.to_sql("financial_info", engine, if_exists="append", index=False)    
-    missed_all_company_financial_info.to_csv('./input/finance_data/origin/missed_company_financial_info.csv', index=False)
+    print(f"欠損率が95%以上の列: {', '.join(high_missing_columns)}")
+    # 日次実行と列・型がそろうよう、schema.pyの定義（欠損率95%以上の列を除外したinfo_list）を適用してスナップショットに保存
+    # 主キー（銘柄、決算期、期間）が欠損した行（取得できなかった財務諸表の空の行）は除外
+    df_all_company_financial_info = apply_schema(df_all_company_financial_info, financial_info_dtypes)
+    df_all_company_financial_info = df_all_company_financial_info.drop_duplicates().dropna(subset=financial_info_key)
+    save_origin('company_financial_info', df_all_company_financial_info, 'cp932')
+    bulk_load(df_all_company_financial_info, "financial_info", engine, mode="upsert", key=financial_info_key, dtype=financial_info_sql_types,
+              keep_existing=True)
+    # 財務諸表から直近12か月（TTM）と指標を計算してfundamental_ratiosに保存
+    refresh_fundamental_ratios(engine)
+    save_origin('missed_company_financial_info', missed_all_company_financial_info)
+
+    # テーブルの列の型・主キー・インデックスを定義（migration.py）に合わせる
+    migrate(engine)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
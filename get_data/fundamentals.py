@@ -0,0 +1,102 @@
+"""
+財務諸表から計算する指標（fundamental_ratiosテーブル）
+    - 取得後に1回だけ、financial_infoの財務諸表の行から全銘柄分をまとめて計算（アプリでボタンを押すたびに計算しない）
+    - 直近12か月（TTM）：連続する4四半期（3M）の売上高・利益を合計し、貸借対照表は最新の四半期の値を使用
+    - 指標：売上高総利益率、営業利益率、当期純利益率、流動比率、当座比率、自己資本比率、ROE
+    - 計算に使う列と指標だけの列の少ないテーブルに、(symbol, asOfDate, periodType)の一意インデックスを付けて保存
+    - 2回目以降は財務諸表を取得し直した銘柄（StatementTracker）だけを計算し直してupsert
+
+fundamental_ratios
+    symbol、asOfDate、periodType（3M、12M、TTM）、flow_columns、stock_columns、ratio_columns
+"""
+
+import pandas as pd
+from sqlalchemy import inspect
+from get_data.bulk_load import bulk_load
+
+# 期間の合計を取る損益計算書の列
+flow_columns = ['TotalRevenue', 'GrossProfit', 'OperatingIncome', 'NetIncomeCommonStockholders', 'NetIncome']
+
+# 期末時点の値を使う貸借対照表の列
+stock_columns = ['CurrentAssets', 'CurrentLiabilities', 'Inventory', 'TotalAssets', 'StockholdersEquity', 'TotalLiabilitiesNetMinorityInterest']
+
+ratio_columns = ['grossMargin', 'operatingMargin', 'netMargin', 'currentRatio', 'quickRatio', 'capitalAdequacyRatio', 'ROE']
+
+key_columns = ['symbol', 'asOfDate', 'periodType']
+
+ratios_table = 'fundamental_ratios'
+
+# 4四半期が連続しているとみなす、最新の四半期と3期前の四半期の期末日の差（日数）
+ttm_span_days = (250, 300)
+
+# financial_infoから計算に使う列だけを読み込み、決算期ごとに1行にまとめる
+# 引数:SQLAlchemyのエンジン、読み込む銘柄のリスト（省略時は全銘柄）
+# 戻値:Dataframe（key_columns、flow_columns、stock_columns）
+def load_statements(engine, symbols=None):
+    existing = {col['name'] for col in inspect(engine).get_columns('financial_info')}
+    columns = [col for col in key_columns + flow_columns + stock_columns if col in existing]
+    query = f"""SELECT {', '.join(f'"{col}"' for col in columns)} FROM financial_info WHERE "periodType" IN ('3M', '12M')"""
+    params = {}
+    if symbols is not None:
+        query += " AND symbol = ANY(%(symbols)s)"
+        params['symbols'] = list(symbols)
+    df = pd.read_sql(query, engine, params=params).reindex(columns=key_columns + flow_columns + stock_columns)
+    df['asOfDate'] = pd.to_datetime(df['asOfDate'])
+    # 企業価値評価だけの行を除き、日次の取得で重複した行は決算期ごとに後から取得した値を優先して1行にまとめる
+    df = df[df[flow_columns + stock_columns].notna().any(axis=1)]
+    return df.groupby(key_columns, as_index=False, sort=True).last()
+
+# 四半期（3M）の行から直近12か月（TTM）の行を作成
+# 引数:load_statementsの戻値
+# 戻値:Dataframe（periodType='TTM'）
+def compute_ttm(df):
+    quarterly = df[df['periodType'] == '3M'].sort_values(['symbol', 'asOfDate']).reset_index(drop=True)
+    if quarterly.empty:
+        return quarterly.assign(periodType='TTM')
+    grouped = quarterly.groupby('symbol')
+    # 4四半期の合計（1四半期でも欠損があれば欠損）
+    ttm = grouped[flow_columns].rolling(4, min_periods=4).sum().reset_index(level=0, drop=True)
+    span = (quarterly['asOfDate'] - grouped['asOfDate'].shift(3)).dt.days
+    is_consecutive = span.between(*ttm_span_days)
+    ttm = pd.concat([quarterly[['symbol', 'asOfDate']], ttm, quarterly[stock_columns]], axis=1)[is_consecutive]
+    ttm.insert(2, 'periodType', 'TTM')
+    return ttm.reset_index(drop=True)
+
+# 指標を計算（分母が0の場合は欠損）
+# 引数:Dataframe（flow_columns、stock_columns）
+# 戻値:ratio_columnsを追加したDataframe
+def compute_ratios(df):
+    df = df.copy()
+    revenue = df['TotalRevenue'].where(df['TotalRevenue'] != 0)
+    current_liabilities = df['CurrentLiabilities'].where(df['CurrentLiabilities'] != 0)
+    df['grossMargin'] = df['GrossProfit'] / revenue
+    df['operatingMargin'] = df['OperatingIncome'] / revenue
+    df['netMargin'] = df['NetIncomeCommonStockholders'] / revenue
+    df['currentRatio'] = df['CurrentAssets'] / current_liabilities
+    df['quickRatio'] = (df['CurrentAssets'] - df['Inventory']) / current_liabilities
+    df['capitalAdequacyRatio'] = df['StockholdersEquity'] / df['TotalAssets'].where(df['TotalAssets'] != 0)
+    df['ROE'] = df['NetIncome'] / df['StockholdersEquity'].where(df['StockholdersEquity'] != 0)
+    return df
+
+# 3M・12M・TTMの行の指標を計算
+# 引数:load_statementsの戻値
+# 戻値:Dataframe（fundamental_ratiosの列）
+def compute_fundamental_ratios(df):
+    df = pd.concat([df, compute_ttm(df)], ignore_index=True)
+    return compute_ratios(df)[key_columns + flow_columns + stock_columns + ratio_columns]
+
+# 指標を計算してfundamental_ratiosに保存
+# テーブルがない場合は全銘柄、ある場合は指定した銘柄（財務諸表を取得し直した銘柄）だけを計算し直す
+# 引数:SQLAlchemyのエンジン、計算し直す銘柄のリスト（省略時は全銘柄）
+# 戻値:保存した行数
+def refresh_fundamental_ratios(engine, symbols=None):
+    if not inspect(engine).has_table('financial_info'):
+        return 0
+    if not inspect(engine).has_table(ratios_table):
+        symbols = None
+    elif symbols is not None and not symbols:
+        return 0
+    ratios = compute_fundamental_ratios(load_statements(engine, symbols))
+    bulk_load(ratios, ratios_table, engine, mode="upsert", key=key_columns)
+    print(f"{ratios['symbol'].nunique()}銘柄の財務指標（{len(ratios)}行）を{ratios_table}に保存しました")
+    return len(ratios)
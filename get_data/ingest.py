@@ -0,0 +1,304 @@
+"""
+株価・財務指標・財務情報を複数銘柄同時に取得するエンジン
+    - ワーカースレッドをmax_workers本起動し、銘柄単位で並列に取得
+    - 全ワーカーで1つのRateLimiterを共有し、Yahoo Financeへのリクエスト数を1秒あたりrequests_per_second以下に制限
+      （連続して送れるリクエスト数はburst。省略時はrequests_per_secondと同じ数）
+    - 各銘柄の取得失敗はこれまで通りmissed_*のデータフレームに記録
+      （まとめて取得する処理自体が失敗した場合は、対象の全銘柄をエラー内容（error列）とともに記録）
+    - batch_size > 1 の場合、株価と財務情報はbatch_size銘柄ずつ複数銘柄のTickerオブジェクトでまとめて取得
+    - journal（IngestionJournal）を渡すと、完了した取得処理を銘柄ごとに記録し、再開時は完了済みの取得処理をスキップ
+    - watermarks（PriceWatermarks）を渡すと、株価は銘柄ごとの取得済み最終日から取得し、最新まで取得済みの銘柄はリクエストしない
+      （渡さない場合は全銘柄をstock_periodから取得）
+    - statements（StatementTracker）を渡すと、財務諸表に更新がありそうな銘柄だけ財務諸表を取得し、
+      それ以外の銘柄は企業価値評価（valuation_measures）だけを取得（渡さない場合は全銘柄の財務諸表を取得）
+    - 処理終了時にスループット（銘柄/分）を表示
+
+取得結果（get_stock_prices、get_company_metrics、get_company_finacial_info）は銘柄一覧の順序のまま返す
+"""
+
+import time
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from yahooquery import Ticker
+from get_data.accumulator import FrameAccumulator
+from get_data.throttle import RateLimiter, retry_with_timeout
+
+class IngestionEngine:
+    # 各取得処理1回あたりのYahoo Financeへのリクエスト数
+    stage_costs = {
+        'stock_prices': 1,            # history
+        'company_metrics': 1,         # get_modules(summaryDetail、financialData)
+        'company_financial_info': 7,  # income_statement・cash_flow・balance_sheet(年次・四半期)、valuation_measures
+    }
+    # 企業価値評価だけを取得する場合のリクエスト数（valuation_measures）
+    valuation_cost = 1
+
+    def __init__(self, gfd, stock_period, max_workers=4, requests_per_second=2.0, batch_size=1, journal=None, watermarks=None, statements=None, burst=None):
+        self.gfd = gfd
+        self.stock_period = stock_period
+        self.journal = journal
+        self.watermarks = watermarks
+        self.statements = statements
+        # 財務諸表を取得できた銘柄（処理終了後にStatementTrackerの更新に使う）
+        self.statement_symbols = set()
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.rate_limiter = RateLimiter(requests_per_second, burst=burst or max(1, round(requests_per_second)))
+        # GetFinanceData内部の再取得（エラー銘柄を除いた再リクエスト）にも同じレート制限を適用
+        if gfd.rate_limiter is None:
+            gfd.rate_limiter = self.rate_limiter
+
+    # 株価の取得開始日（Noneの場合は取得済みのためリクエストしない）
+    def stock_start(self, symbol):
+        if self.watermarks is None:
+            return self.stock_period
+        return self.watermarks.start_date(symbol)
+
+    # 財務諸表を取得するか（Falseの場合は企業価値評価だけを取得）
+    def needs_statements(self, symbol):
+        if self.statements is None:
+            return True
+        return self.statements.needs_statements(symbol)
+
+    # 取得処理をレート制限とリトライ付きで実行
+    # 引数:取得処理の種類、取得処理、対象銘柄数、1銘柄あたりのリクエスト数（省略時はstage_costs）
+    def call_stage(self, stage, func, n_symbols=1, cost=None):
+        def limited():
+            self.rate_limiter.acquire((cost or self.stage_costs[stage]) * n_symbols)
+            return func()
+        return retry_with_timeout(limited)
+
+    # 銘柄名、市場・商品区分、33業種、17業種を財務指標に付与
+    def add_ticker_info(self, df_company_metrics, jpx_filter_df):
+        df_company_metrics['ticker_name'] = jpx_filter_df['銘柄名'].values[:1]
+        df_company_metrics['market_product_category'] = jpx_filter_df['市場・商品区分'].values[:1]
+        df_company_metrics['type_33'] = jpx_filter_df['33業種区分'].values[:1]
+        df_company_metrics['type_17'] = jpx_filter_df['17業種区分'].values[:1]
+        return df_company_metrics
+
+    # ジャーナルから完了済みの取得処理の結果を復元
+    # 財務諸表を取得済みの銘柄は、取得した場合と同じく財務諸表の行があればstatement_symbolsに追加する
+    # 引数:証券コード、取得結果:dict
+    # 戻値:完了済みの取得処理名のset
+    def restore(self, ticker_num, result):
+        if self.journal is None:
+            return set()
+        done = self.journal.completed(ticker_num)
+        for frames in done.values():
+            result.update(frames)
+        if 'company_financial_info' in done and self.needs_statements(ticker_num):
+            self.statement_symbols |= self.gfd.symbols_with_statements(result.get('company_financial_info'))
+        return set(done)
+
+    # 取得処理の結果をジャーナルに記録
+    def record(self, ticker_num, stage, result, keys):
+        if self.journal is not None:
+            self.journal.record(ticker_num, stage, {key: result[key] for key in keys if key in result})
+
+    # まとめて取得する処理自体が失敗した場合、対象の全銘柄をmissed_*に記録（エラー内容はerror列）
+    # ジャーナルには記録しないため、再開時は再取得する
+    # 引数:証券コードのリスト、銘柄ごとの取得結果:dict、missed_*のキー、発生した例外
+    # 戻値:無し
+    def record_missed(self, symbols, results, key, error):
+        for symbol in symbols:
+            results[symbol][key] = pd.DataFrame([{'symbol': symbol, 'ticker_data': None, 'error': str(error)}])
+
+    # 1銘柄分の株価、財務指標、財務情報を取得
+    # 引数:証券コード、東証上場銘柄一覧の該当行
+    # 戻値:取得結果:dict
+    def fetch_ticker(self, ticker, jpx_filter_df):
+        ticker_num = str(ticker) + '.T'
+        result = {'ticker_num': ticker_num}
+        done = self.restore(ticker_num, result)
+        if done >= set(self.stage_costs):
+            return result
+
+        try:
+            ticker_data = Ticker(ticker_num)
+            print(f"{ticker_num}の処理開始")
+        except Exception as e:
+            print(f"{ticker_num}のTickerオブジェクト作成中にエラーが発生しました: {e}")
+            return result
+
+        if 'stock_prices' not in done:
+            try:
+                start_day = self.stock_start(ticker_num)
+                if start_day is None:
+                    # 最新の株価まで保存済みのため、株価はリクエストせずに財務指標・財務情報の取得へ進む
+                    result['stock_prices'] = pd.DataFrame()
+                else:
+                    result['stock_prices'], result['missed_stock_prices'] = self.call_stage(
+                        'stock_prices', lambda: self.gfd.get_stock_prices(ticker_num, ticker_data, start_day))
+                self.record(ticker_num, 'stock_prices', result, ['stock_prices', 'missed_stock_prices'])
+            except Exception as e:
+                print(f"{ticker_num}の株価情報取得中にエラーが発生しました: {e}")
+                return result
+
+        if 'company_metrics' not in done:
+            try:
+                df_company_metrics, result['missed_company_metrics'] = self.call_stage(
+                    'company_metrics', lambda: self.gfd.get_company_metrics(ticker_num, ticker_data))
+                result['company_metrics'] = self.add_ticker_info(df_company_metrics, jpx_filter_df)
+                self.record(ticker_num, 'company_metrics', result, ['company_metrics', 'missed_company_metrics'])
+            except Exception as e:
+                print(f"{ticker_num}の財務指標取得中にエラーが発生しました: {e}")
+                return result
+
+        if 'company_financial_info' not in done:
+            try:
+                if self.needs_statements(ticker_num):
+                    result['company_financial_info'], result['missed_company_financial_info'] = self.call_stage(
+                        'company_financial_info', lambda: self.gfd.get_company_finacial_info(ticker_num, ticker_data))
+                    self.statement_symbols |= self.gfd.symbols_with_statements(result['company_financial_info'])
+                else:
+                    result['company_financial_info'], result['missed_company_financial_info'] = self.call_stage(
+                        'company_financial_info',
+                        lambda: self.gfd.get_company_finacial_info_batch([ticker_num], ticker_data, valuation_only=True),
+                        cost=self.valuation_cost)
+                self.record(ticker_num, 'company_financial_info', result, ['company_financial_info', 'missed_company_financial_info'])
+            except Exception as e:
+                print(f"{ticker_num}の財務情報取得中にエラーが発生しました: {e}")
+
+        return result
+
+    # batch_size銘柄分の株価、財務指標、財務情報をまとめて取得
+    # 引数:証券コードのリスト、東証上場銘柄一覧の該当行のリスト
+    # 戻値:銘柄ごとの取得結果:dictのリスト
+    def fetch_batch(self, tickers, jpx_rows):
+        symbols = [str(ticker) + '.T' for ticker in tickers]
+        results = {symbol: {'ticker_num': symbol} for symbol in symbols}
+        done = {symbol: self.restore(symbol, results[symbol]) for symbol in symbols}
+        pending = [symbol for symbol in symbols if 'stock_prices' not in done[symbol]]
+        if all(done[symbol] >= set(self.stage_costs) for symbol in symbols):
+            return list(results.values())
+        print(f"{symbols[0]}〜{symbols[-1]}（{len(symbols)}銘柄）の処理開始")
+
+        # 取得開始日が同じ銘柄ごとにまとめて株価を取得（最新の株価まで保存済みの銘柄はリクエストしない）
+        groups = {}
+        for symbol in pending:
+            start_day = self.stock_start(symbol)
+            if start_day is None:
+                results[symbol]['stock_prices'] = pd.DataFrame()
+                self.record(symbol, 'stock_prices', results[symbol], ['stock_prices'])
+            else:
+                groups.setdefault(start_day, []).append(symbol)
+        for start_day, group in groups.items():
+            self.fetch_stock_prices_batch(group, start_day, results)
+        fetched = [symbol for symbol in symbols if 'stock_prices' in results[symbol]]
+
+        # 財務指標のモジュールをまとめて取得し、各銘柄はキャッシュから読み出す
+        pending = [symbol for symbol in fetched if 'company_metrics' not in done[symbol]]
+        metrics_data = None
+        if pending:
+            try:
+                metrics_data = Ticker(pending, asynchronous=True)
+                self.call_stage('company_metrics', lambda: self.gfd.fetch_modules(pending, metrics_data), len(pending))
+            except Exception as e:
+                print(f"{pending[0]}〜{pending[-1]}の財務指標取得中にエラーが発生しました: {e}")
+
+        for symbol, jpx_filter_df in zip(symbols, jpx_rows):
+            if symbol not in pending:
+                continue
+            try:
+                if symbol in self.gfd.module_cache:
+                    df_company_metrics, results[symbol]['missed_company_metrics'] = self.gfd.get_company_metrics(symbol, metrics_data)
+                else:
+                    # まとめて取得できなかった場合は銘柄ごとに取得
+                    ticker_data = Ticker(symbol)
+                    df_company_metrics, results[symbol]['missed_company_metrics'] = self.call_stage(
+                        'company_metrics', lambda: self.gfd.get_company_metrics(symbol, ticker_data))
+                results[symbol]['company_metrics'] = self.add_ticker_info(df_company_metrics, jpx_filter_df)
+                self.record(symbol, 'company_metrics', results[symbol], ['company_metrics', 'missed_company_metrics'])
+            except Exception as e:
+                print(f"{symbol}の財務指標取得中にエラーが発生しました: {e}")
+                self.record_missed([symbol], results, 'missed_company_metrics', e)
+                fetched.remove(symbol)
+
+        # 財務諸表に更新がありそうな銘柄と、企業価値評価だけを取得する銘柄に分けてまとめて取得
+        pending = [symbol for symbol in fetched if 'company_financial_info' not in done[symbol]]
+        full = [symbol for symbol in pending if self.needs_statements(symbol)]
+        valuation = [symbol for symbol in pending if symbol not in full]
+        if full:
+            self.fetch_financial_info_batch(full, results)
+        if valuation:
+            self.fetch_financial_info_batch(valuation, results, valuation_only=True)
+
+        return list(results.values())
+
+    # 複数銘柄の財務情報をまとめて取得し、銘柄ごとの取得結果に格納
+    # 引数:証券コードのリスト、銘柄ごとの取得結果:dict、企業価値評価だけを取得するか
+    # 戻値:無し
+    def fetch_financial_info_batch(self, symbols, results, valuation_only=False):
+        try:
+            fetched_data = Ticker(symbols, asynchronous=True)
+            df_financial_info, missed_financial_info = self.call_stage(
+                'company_financial_info', lambda: self.gfd.get_company_finacial_info_batch(symbols, fetched_data, valuation_only),
+                len(symbols), self.valuation_cost if valuation_only else None)
+        except Exception as e:
+            print(f"{symbols[0]}〜{symbols[-1]}の財務情報取得中にエラーが発生しました: {e}")
+            self.record_missed(symbols, results, 'missed_company_financial_info', e)
+            return
+
+        # 財務諸表の行を取得できた銘柄だけを、財務諸表を取得した銘柄とする（企業価値評価の行だけの銘柄は含めない）
+        if not valuation_only:
+            self.statement_symbols |= self.gfd.symbols_with_statements(df_financial_info) & set(symbols)
+        for symbol in symbols:
+            if not df_financial_info.empty:
+                results[symbol]['company_financial_info'] = df_financial_info[df_financial_info['symbol'] == symbol]
+            results[symbol]['missed_company_financial_info'] = missed_financial_info[missed_financial_info['symbol'] == symbol]
+            self.record(symbol, 'company_financial_info', results[symbol], ['company_financial_info', 'missed_company_financial_info'])
+
+    # 取得開始日が同じ銘柄の株価をまとめて取得し、銘柄ごとの取得結果に格納
+    # 引数:証券コードのリスト、取得開始日、銘柄ごとの取得結果:dict
+    # 戻値:無し
+    def fetch_stock_prices_batch(self, symbols, start_day, results):
+        try:
+            batch_data = Ticker(symbols, asynchronous=True)
+            df_stock_prices, missed_stock_prices = self.call_stage(
+                'stock_prices', lambda: self.gfd.get_stock_prices_batch(symbols, batch_data, start_day), len(symbols))
+        except Exception as e:
+            print(f"{symbols[0]}〜{symbols[-1]}の株価情報取得中にエラーが発生しました: {e}")
+            self.record_missed(symbols, results, 'missed_stock_prices', e)
+            return
+
+        # 株価を取得できなかった銘柄は以降の取得を行わない
+        missed_symbols = set(missed_stock_prices['symbol'])
+        for symbol in symbols:
+            if symbol in missed_symbols:
+                results[symbol]['missed_stock_prices'] = missed_stock_prices[missed_stock_prices['symbol'] == symbol]
+            else:
+                results[symbol]['stock_prices'] = df_stock_prices[df_stock_prices['symbol'] == symbol]
+            self.record(symbol, 'stock_prices', results[symbol], ['stock_prices', 'missed_stock_prices'])
+
+    # 全銘柄を並列に取得し、データ種別ごとに結合
+    # 引数:前処理済みの東証上場銘柄一覧、データ種別をキーとしたFrameAccumulatorのdict（省略時は新規作成）
+    # 戻値:データ種別をキーとしたDataframeのdict
+    def run(self, stock_lists, accumulators=None):
+        keys = ['stock_prices', 'missed_stock_prices', 'company_metrics', 'missed_company_metrics',
+                'company_financial_info', 'missed_company_financial_info']
+        accumulators = accumulators or {}
+        for key in keys:
+            accumulators.setdefault(key, FrameAccumulator())
+
+        start = time.perf_counter()
+        tickers = stock_lists['コード'].tolist()
+        jpx_rows = [stock_lists[stock_lists['コード'] == ticker] for ticker in tickers]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # mapは銘柄一覧の順序で結果を返す
+            if self.batch_size > 1:
+                batches = [(tickers[i:i + self.batch_size], jpx_rows[i:i + self.batch_size]) for i in range(0, len(tickers), self.batch_size)]
+                results = (result for batch in executor.map(lambda b: self.fetch_batch(*b), batches) for result in batch)
+            else:
+                results = executor.map(self.fetch_ticker, tickers, jpx_rows)
+            for result in results:
+                for key in keys:
+                    accumulators[key].append(result.get(key))
+        # 書き込み先が設定されたアキュムレータは残りをflush
+        for accumulator in accumulators.values():
+            if accumulator.on_flush is not None:
+                accumulator.flush()
+        elapsed = (time.perf_counter() - start) / 60
+
+        print(f"{len(tickers)}銘柄を{elapsed:.2f}分で処理しました（{len(tickers) / max(elapsed, 1e-9):.1f}銘柄/分）")
+
+        return {key: accumulators[key].concat() for key in keys}
@@ -0,0 +1,128 @@
+"""
+株価・財務情報取得の進捗ジャーナル（SQLite）
+    - 実行（run）ごとに、銘柄×取得処理（stock_prices、company_metrics、company_financial_info）の完了を記録
+    - 完了した取得処理の結果（Dataframe）もあわせて保存し、再開時にはネットワークへアクセスせずに復元
+    - schedule.pyを--resume付きで実行すると、最後に完了しなかった実行を引き継ぐ
+    - DBへの書き込みが完了した銘柄もテーブルごとに記録し、再開時の二重書き込みを防ぐ
+    - 実行が完了したら（すべての保存が完了した後のfinish）、完了済みの実行の取得結果と書き込み済みの銘柄を削除
+      （再開に使うのは未完了の実行だけのため。runsには実行の履歴だけを残す）
+
+input
+└── finance_data
+    └── journal.sqlite3
+"""
+
+import os
+import pickle
+import sqlite3
+import datetime
+import threading
+
+class IngestionJournal:
+
+    def __init__(self, path='./input/finance_data/journal.sqlite3', resume=False, stock_period=None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # ワーカースレッドから書き込むため、接続を共有してロックで排他制御
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at TEXT NOT NULL,
+                    stock_period TEXT,
+                    finished_at TEXT
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS progress (
+                    run_id INTEGER NOT NULL,
+                    symbol TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    finished_at TEXT NOT NULL,
+                    payload BLOB,
+                    PRIMARY KEY (run_id, symbol, stage)
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS written (
+                    run_id INTEGER NOT NULL,
+                    table_name TEXT NOT NULL,
+                    symbol TEXT NOT NULL,
+                    PRIMARY KEY (run_id, table_name, symbol)
+                )""")
+        # テーブルごとの書き込み済み銘柄
+        self.written_symbols = {}
+
+        row = None
+        if resume:
+            row = self.conn.execute(
+                "SELECT run_id, stock_period FROM runs WHERE finished_at IS NULL ORDER BY run_id DESC LIMIT 1").fetchone()
+        if row:
+            self.run_id, self.stock_period = row
+            n_done = self.conn.execute("SELECT COUNT(*) FROM progress WHERE run_id = ?", (self.run_id,)).fetchone()[0]
+            print(f"実行ID {self.run_id} を再開します（完了済みの取得処理：{n_done}件）")
+        else:
+            self.stock_period = stock_period
+            with self.lock, self.conn:
+                cur = self.conn.execute("INSERT INTO runs (started_at, stock_period) VALUES (?, ?)",
+                                        (datetime.datetime.now().isoformat(), stock_period))
+            self.run_id = cur.lastrowid
+
+    # 銘柄の完了済み取得処理と、その結果を取得
+    # 引数:証券コード
+    # 戻値:取得処理名をキーとした取得結果（dict）のdict
+    def completed(self, symbol):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT stage, payload FROM progress WHERE run_id = ? AND symbol = ?", (self.run_id, symbol)).fetchall()
+        return {stage: pickle.loads(payload) for stage, payload in rows}
+
+    # 取得処理の完了と結果を記録
+    # 引数:証券コード、取得処理名、取得結果（キー:データ種別、値:Dataframe）
+    # 戻値:無し
+    def record(self, symbol, stage, frames):
+        frames = {key: self.to_picklable(df) for key, df in frames.items()}
+        payload = pickle.dumps(frames, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO progress (run_id, symbol, stage, finished_at, payload) VALUES (?, ?, ?, ?, ?)",
+                (self.run_id, symbol, stage, datetime.datetime.now().isoformat(), payload))
+
+    # DBへの書き込みが完了した銘柄を記録
+    # 引数:テーブル名、証券コードのリスト
+    # 戻値:無し
+    def mark_written(self, table, symbols):
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO written (run_id, table_name, symbol) VALUES (?, ?, ?)",
+                                  [(self.run_id, table, symbol) for symbol in symbols])
+        # 他スレッドが参照中のsetを変更しないよう、新しいsetに置き換える
+        self.written_symbols[table] = self.written(table) | set(symbols)
+
+    # DBへの書き込みが完了した銘柄を取得
+    # 引数:テーブル名
+    # 戻値:証券コードのset
+    def written(self, table):
+        if table not in self.written_symbols:
+            with self.lock:
+                rows = self.conn.execute("SELECT symbol FROM written WHERE run_id = ? AND table_name = ?",
+                                         (self.run_id, table)).fetchall()
+            self.written_symbols[table] = {symbol for symbol, in rows}
+        return self.written_symbols[table]
+
+    # missed_*のticker_data列（Tickerオブジェクト）はpickleできないため文字列に変換
+    def to_picklable(self, df):
+        if 'ticker_data' in df.columns:
+            df = df.assign(ticker_data=df['ticker_data'].astype(str))
+        return df
+
+    # 実行の完了を記録し（以降の--resumeでは新しい実行を開始）、完了済みの実行の取得結果・書き込み済みの銘柄を削除
+    # 以前の実行で削除されずに残った分もあわせて削除し、削除した領域を解放してファイルを縮小
+    def finish(self):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?",
+                              (datetime.datetime.now().isoformat(), self.run_id))
+            finished = "SELECT run_id FROM runs WHERE finished_at IS NOT NULL"
+            self.conn.execute(f"DELETE FROM progress WHERE run_id IN ({finished})")
+            self.conn.execute(f"DELETE FROM written WHERE run_id IN ({finished})")
+        with self.lock:
+            self.conn.execute("VACUUM")
+        self.conn.close()
@@ -0,0 +1,131 @@
+"""
+株価から計算する市場統計（summaryDetailのリクエストを使わずに、保存済みの株価から計算）
+    - 52週高値・安値、50日・200日移動平均、平均出来高（3か月・10日）、前日終値・当日の四本値・出来高
+    - 銘柄ごとに直近max_rows行の未修正の株価を状態（state.parquet）として保存し、毎日取得した株価を追加して更新
+      （全期間の株価を読み直さない。状態がない場合はstock_pricesの直近の株価から作成）
+    - 計算時に累積修正係数（adjustment_factors）を適用するため、adjusted_stock_pricesと同じ修正後の株価で計算され、
+      株式分割・併合があっても状態を作り直す必要がない
+    - 全銘柄を1回のgroupbyで計算し、統計の基準日（銘柄ごとの最終日）とともにmarket_statsテーブルに(symbol, date)をキーにupsert
+      （metricsには日付の列がないため書き込まない。途中で中断した日があっても、統計は計算に使った株価の日付に対応付けられる）
+
+input/finance_data/market_stats
+└── state.parquet：銘柄ごとの直近max_rows行の未修正の株価
+
+market_stats
+    symbol、date（統計の基準日）、stat_columns
+"""
+
+import os
+import datetime
+import pandas as pd
+from sqlalchemy import inspect
+from sqlalchemy.types import Date
+from get_data.bulk_load import bulk_load
+from get_data.adjustment import apply_adjustment_factors
+
+# 統計の列名（summaryDetailのキー）と、計算に使う列・集計方法・対象期間（営業日数、Noneは52週）
+stat_windows = {
+    'fiftyTwoWeekHigh': ('high', 'max', None),       # 過去52週間の最高値
+    'fiftyTwoWeekLow': ('low', 'min', None),         # 過去52週間の最安値
+    'fiftyDayAverage': ('close', 'mean', 50),        # 過去50日間の平均株価
+    'twoHundredDayAverage': ('close', 'mean', 200),  # 過去200日間の平均株価
+    'averageVolume': ('volume', 'mean', 63),         # 平均取引量（3か月）
+    'averageVolume10days': ('volume', 'mean', 10),   # 過去10日間の平均取引量
+}
+
+# 最終日の値をそのまま使う統計
+last_values = {
+    'open': 'open',      # 最終日の始値
+    'dayLow': 'low',     # 最終日の最安値
+    'dayHigh': 'high',   # 最終日の最高値
+    'volume': 'volume',  # 最終日の取引量
+}
+
+stat_columns = list(stat_windows) + ['previousClose'] + list(last_values)
+
+state_columns = ['symbol', 'date', 'open', 'high', 'low', 'close', 'volume', 'adjclose']
+
+key_columns = ['symbol', 'date']
+
+stats_table = 'market_stats'
+
+class MarketStats:
+
+    def __init__(self, base_dir='./input/finance_data/market_stats', max_rows=260):
+        self.base_dir = base_dir
+        self.state_path = os.path.join(base_dir, 'state.parquet')
+        # 52週（約245営業日）と最長の移動平均（200日）を計算できる行数
+        self.max_rows = max_rows
+
+    # 状態（銘柄ごとの直近の未修正の株価）を読み込む（ない場合はstock_pricesの直近の株価から作成）
+    # 引数:SQLAlchemyのエンジン、基準日（省略時は当日）
+    # 戻値:Dataframe
+    def load_state(self, engine, as_of=None):
+        if os.path.exists(self.state_path):
+            return pd.read_parquet(self.state_path)
+        if not inspect(engine).has_table('stock_prices'):
+            return pd.DataFrame(columns=state_columns)
+        print("市場統計の状態をstock_pricesから作成します")
+        # max_rows営業日分を含む期間だけを読み込む（日付の範囲条件でインデックスを使えるようにする）
+        start = pd.Timestamp(as_of or datetime.date.today()) - pd.Timedelta(days=self.max_rows * 7 // 5 + 30)
+        query = f"SELECT {', '.join(state_columns)} FROM stock_prices WHERE date >= %(start)s"
+        return pd.read_sql(query, engine, params={'start': start.to_pydatetime()})
+
+    # 取得した株価を状態に追加し、銘柄ごとに直近max_rows行だけを残して保存
+    # 引数:状態のDataframe、当日取得した未修正の株価のDataframe
+    # 戻値:更新後の状態のDataframe
+    def update_state(self, state, df):
+        df = df.reindex(columns=state_columns)
+        state = pd.concat([state, df], ignore_index=True) if not state.empty else df
+        state['symbol'] = state['symbol'].astype(str)
+        state['date'] = pd.to_datetime(state['date'])
+        # 取得期間が重なる日は新しい値で上書き
+        state = state.dropna(subset=['date']).drop_duplicates(subset=['symbol', 'date'], keep='last')
+        state = state.sort_values(['symbol', 'date'], kind='stable')
+        state = state[state.groupby('symbol').cumcount(ascending=False) < self.max_rows].reset_index(drop=True)
+        os.makedirs(self.base_dir, exist_ok=True)
+        state.to_parquet(self.state_path + '.tmp', index=False)
+        os.replace(self.state_path + '.tmp', self.state_path)
+        return state
+
+    # 修正後の株価から銘柄ごとの統計を計算（全銘柄を1回のgroupbyで集計）
+    # 引数:状態のDataframe、累積修正係数のDataframe（compute_adjustment_factorsの戻値）
+    # 戻値:銘柄ごとの統計のDataframe（symbol、date、stat_columns）
+    def compute(self, state, factors):
+        if state.empty:
+            return pd.DataFrame(columns=key_columns + stat_columns)
+        df = apply_adjustment_factors(state, factors).sort_values(['symbol', 'date'], kind='stable').reset_index(drop=True)
+        grouped = df.groupby('symbol', sort=False)
+        # 最終日からの行数（0が最終日）と、最終日から52週以内か
+        rank = grouped.cumcount(ascending=False)
+        within_year = df['date'] > grouped['date'].transform('max') - pd.Timedelta(weeks=52)
+
+        stats = {}
+        for name, (column, how, window) in stat_windows.items():
+            mask = within_year if window is None else rank < window
+            stats[name] = df[column].where(mask).groupby(df['symbol'], sort=False).agg(how)
+        stats['previousClose'] = df['close'].where(rank == 1).groupby(df['symbol'], sort=False).max()
+        last = df[rank == 0].set_index('symbol')
+        stats['date'] = last['date'].dt.date
+        for name, column in last_values.items():
+            stats[name] = last[column]
+        return pd.DataFrame(stats).rename_axis('symbol').reset_index().reindex(columns=key_columns + stat_columns)
+
+    # 統計をmarket_statsテーブルに(symbol, date)をキーにupsert（同じ基準日の統計は計算し直した値で置き換える）
+    # 引数:銘柄ごとの統計のDataframe、SQLAlchemyのエンジン、書き込み先のテーブル
+    # 戻値:書き込んだ行数
+    def write_stats(self, stats, engine, table=stats_table):
+        if stats.empty:
+            return 0
+        bulk_load(stats, table, engine, mode="upsert", key=key_columns, dtype={'date': Date()})
+        return len(stats)
+
+    # 当日取得した株価で状態を更新し、統計を計算してmarket_statsテーブルに書き込む
+    # 引数:当日取得した未修正の株価のDataframe、累積修正係数のDataframe、SQLAlchemyのエンジン
+    # 戻値:銘柄ごとの統計のDataframe
+    def refresh(self, df, factors, engine):
+        state = self.update_state(self.load_state(engine), df)
+        stats = self.compute(state, factors)
+        written = self.write_stats(stats, engine)
+        print(f"{len(stats)}銘柄の市場統計を計算し、{stats_table}に{written}行を書き込みました")
+        return stats
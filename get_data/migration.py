@@ -0,0 +1,209 @@
+"""
+テーブルの定義（DDL）とマイグレーション
+    - to_sqlが暗黙に作成していたテーブルの列の型・主キー・インデックスをこのモジュールで定義する
+    - migrate()は何度実行してもよく、テーブルがなければ作成し、あれば定義との差分だけを変更する
+        日付の列：timestamp・文字列からdateに変更（依存するビューadjusted_stock_pricesは作り直す）
+        主キー：キーが欠損した行を削除し、重複した行は列ごとに後から書き込んだ欠損でない値を残して1行にまとめてから追加
+        インデックス：btreeのインデックスを追加
+    - 主キーの制約名はbulk_loadのupsertが使う一意インデックスと同じ名前（{table}_{key}_key）にし、upsertでそのまま使う
+    - アプリのクエリは列をキャストせず（"date"::dateなど）、日付の範囲を「開始日以上、終了日の翌日未満」で指定する
+      （キャストした列にはインデックスを使えないため）
+    - explain_index_usage()でアプリのクエリの実行計画（EXPLAIN）を確認し、インデックスを使っていることを検証する
+      （tests/test_migration.pyでテスト用のデータベースに対して確認）
+
+実行方法
+    python -m get_data.migration
+    TEST_DB_URL=postgresql+psycopg2://... python -m pytest tests
+"""
+
+import json
+import datetime
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.types import Text, Date, DOUBLE_PRECISION
+from get_data.config import db_config
+from get_data.schema import financial_info_sql_types, financial_info_key
+from get_data.devide_union import create_adjusted_view
+
+# テーブルの定義
+#   columns：列の型（create=Trueのテーブルは作成時にすべての列を定義。既存のテーブルは日付の列だけを変更）
+#   primary_key：主キーの列名のリスト
+#   indexes：インデックスの列名のリストのリスト（列がないテーブルでは作成しない）
+#   create：テーブルがない場合に作成するか（列が取得データによって変わるテーブルは、最初の書き込み時にto_sqlで作成）
+table_schemas = {
+    'stock_prices': {
+        'columns': {'symbol': Text(), 'date': Date(), 'open': DOUBLE_PRECISION(), 'high': DOUBLE_PRECISION(), 'low': DOUBLE_PRECISION(),
+                    'close': DOUBLE_PRECISION(), 'volume': DOUBLE_PRECISION(), 'adjclose': DOUBLE_PRECISION(),
+                    'dividends': DOUBLE_PRECISION(), 'splits': DOUBLE_PRECISION()},
+        'primary_key': ['symbol', 'date'],  # 銘柄・期間の絞り込み（adjusted_stock_pricesも同じインデックスを使う）
+        'indexes': [['date']],              # 全銘柄の日付での絞り込み（市場統計の初回作成など）
+        'create': True,
+    },
+    'financial_info': {
+        'columns': financial_info_sql_types,
+        'primary_key': financial_info_key,
+        'indexes': [],
+        'create': True,
+    },
+    'metrics': {
+        'columns': {'symbol': Text(), 'exDividendDate': Date()},
+        'primary_key': None,  # 日付の列がなく、実行ごとに追記するため主キーは持たない
+        'indexes': [['symbol']],
+        'create': False,
+    },
+    'market_stats': {
+        'columns': {'symbol': Text(), 'date': Date()},
+        'primary_key': ['symbol', 'date'],  # 銘柄の最新の統計の読み出し（アプリ）
+        'indexes': [],
+        'create': False,
+    },
+    'devide_union_data': {
+        'columns': {'symbol': Text(), 'company_name': Text(), 'ratio': DOUBLE_PRECISION(), 'last_date_with_rights': Date()},
+        'primary_key': None,  # 同じイベントを毎日追記するため主キーは持たない（compute_adjustment_factorsで重複を除く）
+        'indexes': [['symbol', 'last_date_with_rights']],
+        'create': False,
+    },
+    'non_financial_data': {
+        'columns': {'docID': Text()},
+        'primary_key': ['docID'],
+        'indexes': [['symbol']],
+        'create': False,
+    },
+}
+
+# 識別子をクォート
+def quote(conn, name):
+    return conn.dialect.identifier_preparer.quote(name)
+
+# インデックス名（主キーはbulk_loadのensure_unique_keyと同じ名前）
+def index_name(table, columns, suffix):
+    return f"{table}_{'_'.join(columns)}_{suffix}".lower()
+
+# テーブルを作成
+# 引数:SQLAlchemyのConnection、テーブル名、テーブルの定義
+# 戻値:無し
+def create_table(conn, table, schema):
+    columns = [f"{quote(conn, col)} {col_type.compile(dialect=conn.dialect)}" for col, col_type in schema['columns'].items()]
+    if schema['primary_key']:
+        key = schema['primary_key']
+        columns.append(f"CONSTRAINT {quote(conn, index_name(table, key, 'key'))} PRIMARY KEY ({', '.join(quote(conn, col) for col in key)})")
+    conn.exec_driver_sql(f"CREATE TABLE {quote(conn, table)} ({', '.join(columns)})")
+    print(f"{table}を作成しました")
+
+# 日付の列の型をdateに変更（adjusted_stock_pricesが依存するstock_pricesの列は、ビューを削除してから変更）
+# 引数:SQLAlchemyのConnection、テーブル名、テーブルの定義、既存の列名をキーとした型のdict
+# 戻値:ビューを削除した場合はTrue
+def migrate_date_columns(conn, table, schema, existing):
+    columns = [col for col, col_type in schema['columns'].items()
+               if isinstance(col_type, Date) and col in existing and not isinstance(existing[col], Date)]
+    if not columns:
+        return False
+    dropped_view = table == 'stock_prices' and 'adjusted_stock_prices' in inspect(conn).get_view_names()
+    if dropped_view:
+        conn.exec_driver_sql("DROP VIEW adjusted_stock_prices")
+    for col in columns:
+        conn.exec_driver_sql(f"ALTER TABLE {quote(conn, table)} ALTER COLUMN {quote(conn, col)} TYPE DATE USING {quote(conn, col)}::date")
+        print(f"{table}.{col}をdate型に変更しました")
+    return dropped_view
+
+# 主キーを追加（キーが欠損した行を削除し、重複した行を1行にまとめてから追加）
+# 引数:SQLAlchemyのConnection、テーブル名、主キーの列名のリスト
+# 戻値:無し
+def add_primary_key(conn, table, key):
+    target = quote(conn, table)
+    name = quote(conn, index_name(table, key, 'key'))
+    key_columns = [quote(conn, col) for col in key]
+    conn.exec_driver_sql(f"DELETE FROM {target} WHERE {' OR '.join(f'{col} IS NULL' for col in key_columns)}")
+
+    # 重複した行は、列ごとに後から書き込んだ欠損でない値を残して1行にまとめる（DataFrameのgroupby().last()と同じ）
+    columns = [quote(conn, col['name']) for col in inspect(conn).get_columns(table) if col['name'] not in key]
+    merged = ', '.join(key_columns + [f"(array_agg({col} ORDER BY ctid DESC) FILTER (WHERE {col} IS NOT NULL))[1] AS {col}" for col in columns])
+    conn.exec_driver_sql(f"""
+        CREATE TEMP TABLE migration_merged AS
+        SELECT {merged} FROM {target} GROUP BY {', '.join(key_columns)} HAVING count(*) > 1""")
+    same_key = " AND ".join(f"{target}.{col} = m.{col}" for col in key_columns)
+    conn.exec_driver_sql(f"DELETE FROM {target} USING migration_merged m WHERE {same_key}")
+    conn.exec_driver_sql(f"INSERT INTO {target} ({', '.join(key_columns + columns)}) SELECT {', '.join(key_columns + columns)} FROM migration_merged")
+    conn.exec_driver_sql("DROP TABLE migration_merged")
+
+    # upsertで作成済みの一意インデックスがあれば、そのまま主キーにする
+    if not conn.exec_driver_sql("SELECT 1 FROM pg_indexes WHERE tablename = %s AND indexname = %s", (table, index_name(table, key, 'key'))).first():
+        conn.exec_driver_sql(f"CREATE UNIQUE INDEX {name} ON {target} ({', '.join(key_columns)})")
+    conn.exec_driver_sql(f"ALTER TABLE {target} ADD CONSTRAINT {name} PRIMARY KEY USING INDEX {name}")
+    print(f"{table}に主キー({', '.join(key)})を追加しました")
+
+# テーブルの定義を適用（何度実行してもよい）
+# 引数:SQLAlchemyのエンジン
+# 戻値:無し
+def migrate(engine):
+    recreate_view = False
+    with engine.begin() as conn:
+        for table, schema in table_schemas.items():
+            if not inspect(conn).has_table(table):
+                if schema['create']:
+                    create_table(conn, table, schema)
+                else:
+                    continue
+            existing = {col['name']: col['type'] for col in inspect(conn).get_columns(table)}
+            recreate_view |= migrate_date_columns(conn, table, schema, existing)
+            if schema['primary_key'] and not inspect(conn).get_pk_constraint(table)['constrained_columns']:
+                add_primary_key(conn, table, schema['primary_key'])
+            for columns in schema['indexes']:
+                if all(col in existing for col in columns):
+                    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {quote(conn, index_name(table, columns, 'idx'))} "
+                                         f"ON {quote(conn, table)} ({', '.join(quote(conn, col) for col in columns)})")
+    if recreate_view:
+        create_adjusted_view(engine)
+
+# アプリのクエリ（app/app.py、app/pages/01_stock_prices.py）と同じ条件のクエリと、インデックスの検索条件に含まれるべき列
+hot_queries = {
+    'stock_prices': ("""SELECT * FROM stock_prices WHERE symbol = %(symbol)s AND "date" >= %(start_date)s AND "date" < %(end_date)s""",
+                     ['symbol', 'date']),
+    'adjusted_stock_prices': ("""SELECT * FROM adjusted_stock_prices WHERE symbol = %(symbol)s AND "date" >= %(start_date)s AND "date" < %(end_date)s""",
+                              ['symbol', 'date']),
+    'financial_info': ("""SELECT * FROM financial_info WHERE symbol = %(symbol)s AND "asOfDate" >= %(start_date)s AND "asOfDate" < %(end_date)s""",
+                       ['symbol', 'asOfDate']),
+    'metrics': ("""SELECT * FROM metrics WHERE symbol = %(symbol)s""", ['symbol']),
+    'market_stats': ("""SELECT * FROM market_stats WHERE symbol = %(symbol)s ORDER BY "date" DESC LIMIT 1""", ['symbol']),
+}
+
+# 実行計画のノードをすべて列挙
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+# アプリのクエリの実行計画（EXPLAIN）で、各テーブルをインデックスで読み、絞り込みの列がすべてインデックスの検索条件（Index Cond）に
+# 含まれているかを確認（列をキャストした条件はIndex Condに含まれず、Filterでの絞り込みになる）
+# 行数の少ないテーブルではシーケンシャルスキャンの方が安いと判断されるため、enable_seqscanを無効にして
+# 条件がインデックスを使える形（sargable）になっているかを確認する
+# 引数:SQLAlchemyのエンジン、クエリのパラメータ（省略時は任意の銘柄・直近1年）
+# 戻値:クエリ名をキーとした、インデックスを使っているか（bool）のdict（テーブルがないクエリは除く）
+def explain_index_usage(engine, params=None):
+    today = datetime.date.today()
+    params = params or {'symbol': '1301.T', 'start_date': today - datetime.timedelta(days=365), 'end_date': today + datetime.timedelta(days=1)}
+    results = {}
+    with engine.begin() as conn:
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        for name, (query, columns) in hot_queries.items():
+            if not inspect(conn).has_table(name) and name not in inspect(conn).get_view_names():
+                continue
+            plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {query}", params).scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            nodes = list(plan_nodes(plan[0]['Plan']))
+            node_types = [node['Node Type'] for node in nodes]
+            index_conds = ' '.join(node.get('Index Cond', '') for node in nodes)
+            results[name] = 'Seq Scan' not in node_types and all(col in index_conds for col in columns)
+            print(f"{name}: {'インデックスで絞り込み' if results[name] else 'インデックスで絞り込めない条件があります'}（{' > '.join(node_types)}）")
+    return results
+
+def main():
+    conn_string = f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"
+    engine = create_engine(conn_string)
+    migrate(engine)
+    results = explain_index_usage(engine)
+    engine.dispose()
+    if not all(results.values()):
+        raise SystemExit("インデックスで絞り込めないクエリがあります")
+
+if __name__ == '__main__':
+    main()
@@ -7,21 +7,38 @@ EDINETからdocID（書類管理番号）を取得
 non-finance_data    
 └── docID
    ├── edinet_df.csv：EdinetReport.csvとEdinetcodeDlInfo.csvの結合ファイル
-   └── raw_data
-       ├── EdinetReport.csv：(会社名、書類名、docID、証券コード、ＥＤＩＮＥＴコード、決算期、提出日)のdf
-       ├── Edinetcode.zip：EdinetcodeDlInfo.csvの圧縮されたzipファイル
-       └── EdinetcodeDlInfo.csv："ＥＤＩＮＥＴコード","資本金", "決算日", "提出者業種"のdf
+   ├── raw_data
+   │   └── EdinetReport.csv：(会社名、書類名、docID、証券コード、ＥＤＩＮＥＴコード、決算期、提出日)のdf
+   ├── Edinetcode.zip：EdinetcodeDlInfo.csvの圧縮されたzipファイル
+   ├── edinet_code_master.parquet：EdinetcodeDlInfo.csvの"ＥＤＩＮＥＴコード","資本金", "決算日", "提出者業種"のdf
+   ├── edinet_code_master.json：Edinetcode.zipのETag、Last-Modified、SHA-256
+   └── failed_days.json：書類一覧を取得できなかった日付（次回のcreate_docid_dfで取得し直す）
 
 EdinetReport,edinet_dfは一時データも保存
+
+書類一覧（documents.json）は日付ごとにasyncioで並列に取得
+    - 同時リクエスト数をmax_concurrencyで制限し、全リクエストで1つのRateLimiterを共有
+    - 取得結果は日付順に並べて返し、失敗した日付は1回だけ再取得したうえでfailed_daysに記録
+    - failed_daysはfailed_days.jsonに保存し、次回の実行で取得期間外の日付も含めて取得し直す
+    - 取得した書類一覧はdocID/cacheにキャッシュし、直近の数日分以外はネットワークにアクセスしない（edinet_cache.py）
+
+EDINETコード一覧（Edinetcode.zip）は条件付きリクエスト（If-None-Match、If-Modified-Since）で取得
+    - 更新がなければ（304、またはzipのSHA-256が前回と同じ）、前回解析したedinet_code_master.parquetをそのまま使用
 """
 
 import os
 import requests
 import datetime
 import pandas as pd
-import time
+import io
+import json
+import hashlib
 import zipfile
+import asyncio
 import warnings
+from get_data.throttle import RateLimiter, retry_with_timeout
+from get_data.config import edinet_config
+from get_data.edinet_cache import DocumentListCache
 
 # EDINETAPIのトークンを取得
 edinet_api_key = os.environ['EDINET_API_KEY']
@@ -34,10 +51,18 @@ warnings.filterwarnings('ignore', category=DeprecationWarning)
 # DocIDのリストを取得
 class GetDocid:
     # 1 コンストラクタ・日付リストの作成
-    def __init__(self, start_date, end_date):
+    # cache_dirにNoneを渡すとキャッシュを使用しない
+    def __init__(self, start_date, end_date, max_concurrency=None, requests_per_second=None, cache_dir='./input/non-finance_data/docID/cache'):
         self.start_date = start_date
         self.end_date = end_date
         self.day_list = self.create_day_list()
+        self.max_concurrency = max_concurrency or edinet_config['max_concurrency']
+        self.rate_limiter = RateLimiter(requests_per_second or edinet_config['requests_per_second'])
+        # 再取得しても書類一覧を取得できなかった日付
+        self.failed_days = []
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = DocumentListCache(cache_dir, edinet_config['cache_revalidate_days'], edinet_config['cache_retention_days'])
 
     def create_day_list(self):
         day_list = []
@@ -48,20 +73,27 @@ class GetDocid:
         return day_list
 
     # 2 レポートリストの作成
-    def create_report_list(self):
+    # 引数:対象の日付リスト（省略時はday_list。failed_daysを渡すと失敗した日付だけを再取得）
+    # 戻値:有価証券報告書の一覧（提出日順）
+    def create_report_list(self, day_list=None):
+        day_list = self.day_list if day_list is None else day_list
+        json_list = asyncio.run(self.crawl(day_list))
+        # 失敗した日付は1回だけまとめて再取得
+        retry_index = [i for i, json_data in enumerate(json_list) if json_data is None]
+        if retry_index:
+            print(f"書類一覧の取得に失敗した{len(retry_index)}日分を再取得します")
+            for i, json_data in zip(retry_index, asyncio.run(self.crawl([day_list[i] for i in retry_index]))):
+                json_list[i] = json_data
+        self.failed_days = [day for day, json_data in zip(day_list, json_list) if json_data is None]
+        if self.failed_days:
+            print(f"書類一覧を取得できなかった日付（次回の実行で再取得）: {self.failed_days}")
+        if self.cache is not None:
+            self.cache.evict()
+
         report_list = []
-        for day in self.day_list:
-            url = "https://api.edinet-fsa.go.jp/api/v2/documents.json" # HTTPリクエスト（EDINETのAPIエンドポイントへのURLを指定）
-            params = {"date": day, "type": 2, "Subscription-Key": edinet_api_key} # type(1:書類、2:PDF)
-            try:
-                res = requests.get(url, params=params)
-                res.raise_for_status() # HTTPステータスコードが200番台であれば「try」実行、200番台以外であれば「except」実行
-                json_data = res.json() # HTTP応答から取得したJSON形式のデータを解析
-                time.sleep(2)  
-            except requests.RequestException as e:
-                print(f"リクエストに失敗しました: {e}")
+        for day, json_data in zip(day_list, json_list):
+            if json_data is None:
                 continue
-
             for result in json_data.get("results", []): # json_dataから"results"キーに関連する値を取得。"results"が存在しない場合は、エラーを発生させる代わりに空のリスト([])を返す
                 if result["ordinanceCode"] == "010" and result["formCode"] == "030000": # formCode= 030000：有報, 030001:訂正有報,050000:半報, 043000:四半期報告書, 043001:訂正四半期報告書 
                     report_list.append({
@@ -75,38 +107,132 @@ class GetDocid:
                     })
         return report_list
 
+    # 日付ごとの書類一覧を並列に取得
+    # 引数:日付リスト
+    # 戻値:日付リストと同じ順序の書類一覧（JSON）のリスト（失敗した日付はNone）
+    async def crawl(self, day_list):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch(day):
+            async with semaphore:
+                try:
+                    return await asyncio.to_thread(retry_with_timeout, lambda: self.fetch_document_list(day))
+                except Exception as e:
+                    print(f"リクエストに失敗しました {day}: {e}")
+                    return None
+
+        return await asyncio.gather(*(fetch(day) for day in day_list))
+
+    # 1日分の書類一覧を取得（キャッシュがあればキャッシュから、なければレート制限付きでAPIから）
+    # 引数:日付
+    # 戻値:書類一覧（JSON）
+    def fetch_document_list(self, day, doc_type=2):
+        if self.cache is not None:
+            json_data = self.cache.get(day, doc_type)
+            if json_data is not None:
+                return json_data
+        url = "https://api.edinet-fsa.go.jp/api/v2/documents.json" # HTTPリクエスト（EDINETのAPIエンドポイントへのURLを指定）
+        params = {"date": day, "type": doc_type, "Subscription-Key": edinet_api_key} # type(1:書類、2:PDF)
+        self.rate_limiter.acquire()
+        res = requests.get(url, params=params)
+        res.raise_for_status() # HTTPステータスコードが200番台であれば「try」実行、200番台以外であれば「except」実行
+        json_data = res.json() # HTTP応答から取得したJSON形式のデータを解析
+        if self.cache is not None:
+            self.cache.put(day, doc_type, json_data)
+        return json_data
+
+    # EDINETコード一覧（"ＥＤＩＮＥＴコード","資本金", "決算日", "提出者業種"）を取得
+    #   - 前回の応答のETag、Last-Modifiedで条件付きリクエストを送り、更新がなければ解析済みのParquetを読み込む
+    #   - ETag等に対応していない場合に備えて、zipのSHA-256が前回と同じ場合も解析を省略
+    # 引数:保存先のディレクトリ
+    # 戻値:EDINETコード一覧のDataframe（取得・解析に失敗し、解析済みのデータもない場合はNone）
+    def load_edinet_code_master(self, extract_path):
+        url = 'https://disclosure2dl.edinet-fsa.go.jp/searchdocument/codelist/Edinetcode.zip'
+        master_path = f"{extract_path}/edinet_code_master.parquet"
+        meta_path = f"{extract_path}/edinet_code_master.json"
+        meta = {}
+        if os.path.exists(master_path) and os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            response = requests.get(url, headers=headers)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"EDINETコード一覧の取得に失敗しました: {e}")
+            return pd.read_parquet(master_path) if meta else None
+        if response.status_code == 304:
+            print("EDINETコード一覧は更新されていないため、解析済みのデータを使用します")
+            return pd.read_parquet(master_path)
+
+        sha256 = hashlib.sha256(response.content).hexdigest()
+        if meta.get('sha256') == sha256:
+            print("EDINETコード一覧は更新されていないため、解析済みのデータを使用します")
+            df_info = pd.read_parquet(master_path)
+        else:
+            with open(f"{extract_path}/Edinetcode.zip", 'wb') as f:
+                f.write(response.content)
+            # zipファイルを展開せずにメモリ上で読み込み、必要な列だけを解析
+            try:
+                with zipfile.ZipFile(io.BytesIO(response.content)) as zip_f:
+                    with zip_f.open("EdinetcodeDlInfo.csv") as f:
+                        df_info = pd.read_csv(f, encoding="cp932", skiprows=[0], usecols=["ＥＤＩＮＥＴコード","資本金", "決算日", "提出者業種"])
+            except (zipfile.BadZipFile, KeyError):
+                print("ファイルの解凍に失敗しました")
+                return pd.read_parquet(master_path) if meta else None
+            df_info.to_parquet(master_path, index=False)
+
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'), 'sha256': sha256}, f)
+        return df_info
+
+    # 前回までに書類一覧を取得できなかった日付を読み込む
+    # 引数:failed_days.jsonのパス
+    # 戻値:日付のリスト（ファイルがない場合は空のリスト）
+    def load_failed_days(self, failed_days_path):
+        if not os.path.exists(failed_days_path):
+            return []
+        with open(failed_days_path, encoding='utf-8') as f:
+            return [datetime.date.fromisoformat(day) for day in json.load(f)]
+
+    # 今回も書類一覧を取得できなかった日付を保存（すべて取得できた場合は空のリスト）
+    # 引数:failed_days.jsonのパス
+    # 戻値:無し
+    def save_failed_days(self, failed_days_path):
+        with open(failed_days_path, 'w', encoding='utf-8') as f:
+            json.dump([day.isoformat() for day in self.failed_days], f)
+
     # 3 データフレームの作成と保存
+    # 前回までに書類一覧を取得できなかった日付も合わせて取得し、今回も取得できなかった日付をfailed_days.jsonに保存
     def create_docid_df(self, ID_base_dir):
         # ファイルパスを設定
         # extract_path = f"{ID_base_dir}"
         extract_path = ID_base_dir
-        zip_file_path = f"{extract_path}/Edinetcode.zip"
 
         # 出力ディレクトリを作成（存在しない場合のみ）
         os.makedirs(extract_path, exist_ok=True)     
         
-        # edinetcode.zipを取得
+        # edinetcode.zipを取得（更新がなければ解析済みのデータを使用）
         # !wget -P {extract_path} https://disclosure2dl.edinet-fsa.go.jp/searchdocument/codelist/Edinetcode.zip
-        response = requests.get('https://disclosure2dl.edinet-fsa.go.jp/searchdocument/codelist/Edinetcode.zip')
-        with open(f"{extract_path}/Edinetcode.zip", 'wb') as f:
-            f.write(response.content)
-
-        # zipファイルのダウンロードと展開
-        try:
-            with zipfile.ZipFile(zip_file_path) as zip_f:
-                zip_f.extractall(extract_path)
-        except zipfile.BadZipFile:
-            print("ファイルの解凍に失敗しました")
+        df_info = self.load_edinet_code_master(extract_path)
+        if df_info is None:
             return None
 
         # EdinetReport.csvの作成
-        df_info = pd.read_csv(f"{extract_path}/EdinetcodeDlInfo.csv", encoding="cp932", skiprows=[0])
-        df_report = pd.DataFrame(self.create_report_list())
+        failed_days_path = f"{extract_path}/failed_days.json"
+        day_list = sorted(set(self.day_list) | set(self.load_failed_days(failed_days_path)))
+        # 期間中に提出がなかった場合も、列を持つ空のDataframeを返す
+        df_report = pd.DataFrame(self.create_report_list(day_list), columns=['会社名', '書類名', 'docID', '証券コード', 'ＥＤＩＮＥＴコード', '決算期', '提出日'])
+        self.save_failed_days(failed_days_path)
         df_report['symbol'] = df_report['証券コード'].fillna('0').astype(str).str[:4]
         # df_report.to_csv(f"{extract_path}/origin/EdinetReport.csv", encoding="cp932")
 
         # edinet_df.csvの作成
-        df_info = df_info[["ＥＤＩＮＥＴコード","資本金", "決算日", "提出者業種"]]
         merged_df = pd.merge(df_report, df_info, how="inner", on="ＥＤＩＮＥＴコード")
         # merged_df.to_csv(f"{ID_base_dir}/origin/edinet_df.csv",index=False)
 
@@ -23,8 +23,12 @@ import pandas as pd
 import time
 import glob
 import re
+import csv
 from sqlalchemy import create_engine
-from get_data.config import db_config
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from get_data.config import db_config, edinet_config
+from get_data.bulk_load import bulk_load
 
 #  DBエンジンのインスタンスを作成
 conn_string = f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"
@@ -49,6 +53,12 @@ keys = {
 # print(f"カレントディレクトリ: {os.getcwd()}") # 現在の作業ディレクトリ: /finance/Company_Analysis
 # print(f"スクリプトのディレクトリ: {os.path.dirname(os.path.abspath(__file__))}") # /finance/Company_Analysis/get_data
 
+# 「サステナビリティに関する考え方及び取組」の要素IDの末尾（先頭は提出者のEDINETコードごとに異なる）
+sustainability_suffix = "DisclosureOfSustainabilityRelatedFinancialInformationTextBlock"
+
+# テキストにはタブ区切りの1項目に長文が入るため、csvモジュールの1項目の上限を引き上げる
+csv.field_size_limit(2**31 - 1)
+
 # テキストデータの名称とXBRL上のcodeを、keysという辞書で渡す
 class GetCsvFromEdinet:
 
@@ -106,44 +116,123 @@ class GetCsvFromEdinet:
             return None
 
 
-    def get_text_data(self):
-        data = []
+    # 有価証券報告書のCSV（UTF-16のタブ区切り）からkeysのテキストデータを抽出
+    #   - Dataframeを作らずに1行ずつ読み、要素IDを辞書で引いて必要な行の値だけを取り出す
+    #   - 「サステナビリティに関する考え方及び取組」の要素ID（jpcrp030000-asr_E#####-000:...）はファイル名のEDINETコードから作成し、
+    #     ファイル名から取得できない場合は要素IDの末尾で判定
+    #   - すべての要素IDが見つかった時点で読み込みを終了
+    # 引数:CSVのテキストストリーム（newline=''で開いたもの）、CSVのファイル名（EDINETコードの取得に使用）
+    # 戻値:keysの順に並べたテキストデータと、サステナビリティ方針のリスト（見つからない要素はNone）
+    def extract_text(self, f, csv_name):
+        wanted = {value: i for i, value in enumerate(self.keys.values())}
+        sustainability_index = len(wanted)
+        dynamic_code = self.extract_dynamic_code(csv_name)
+        if dynamic_code is not None:
+            wanted[f"jpcrp030000-asr_{dynamic_code}-000:{sustainability_suffix}"] = sustainability_index
+        values = [None] * (sustainability_index + 1)
+        found = [False] * (sustainability_index + 1)
+        n_remaining = sustainability_index + 1
+
+        reader = csv.reader(f, delimiter="\t")
+        header = next(reader, [])
+        id_col, value_col = header.index("要素ID"), header.index("値")
+        for row in reader:
+            element_id = row[id_col]
+            i = wanted.get(element_id)
+            if i is None and dynamic_code is None and element_id.startswith("jpcrp030000-asr_E") and element_id.endswith(sustainability_suffix):
+                i = sustainability_index
+            # 同じ要素IDが複数行ある場合は最初の行の値を使う
+            if i is None or found[i]:
+                continue
+            values[i] = row[value_col] or None
+            found[i] = True
+            n_remaining -= 1
+            if n_remaining == 0:
+                break
+        return values
+
+    # 展開済みのCSV（doc/tmp/{docid}/XBRL_TO_CSV/）から1書類分のテキストデータを抽出
+    # 引数:docID
+    # 戻値:docIDとテキストデータのリスト
+    def parse_doc(self, docid):
+        print(docid)
+        csv_path = f'./input/non-finance_data/doc/tmp/{docid}/XBRL_TO_CSV/*.csv'
+        doc_data = [docid]
+        try:
+            csv_file = glob.glob(csv_path)[0]
+            with open(csv_file, encoding="utf-16", newline="") as f:
+                doc_data += self.extract_text(f, csv_file)
+
+        except IndexError:
+            print(f"{docid} のCSVファイルが見つかりませんでした")
+            doc_data += ["File Not Found"] * (len(self.keys)+1)
+        except Exception as e:
+            print(f"エラー処理 {docid}: {e}")
+            doc_data += ["Error"]*(len(self.keys)+1)
+        return doc_data
+
+    # 展開済みのCSVからテキストデータを抽出
+    #   - workersが2以上の場合はdocIDをプロセスプールに分配して並列に解析（結果はdocid_listの順序のまま）
+    #   - 各プロセスにはchunksize件ずつ渡し、結果は完了した順ではなく順番どおりに1件ずつ受け取る
+    # 引数:プロセス数（省略時はedinet_config['parse_workers']）、1回に各プロセスへ渡すdocIDの件数
+    # 戻値:テキストデータのDataframe
+    def get_text_data(self, workers=None, chunksize=None):
+        workers = workers or edinet_config['parse_workers']
+        chunksize = chunksize or edinet_config['parse_chunksize']
+        if workers > 1 and len(self.docid_list) > chunksize:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # selfを渡すとdocid_list全体がタスクごとにpickleされるため、keysだけを渡す
+                data = list(executor.map(partial(parse_doc, self.keys), self.docid_list, chunksize=chunksize))
+        else:
+            data = [self.parse_doc(docid) for docid in self.docid_list]
+            
+        text_df = pd.DataFrame(data, columns=["docID"] + list(self.keys.keys())+["サステナビリティ方針"])
+
+        return text_df
+
+    # ディスクに展開せずに、zipから必要なCSVだけを読み込んでテキストデータを抽出（get_csv_file＋get_text_dataの代わり）
+    #   - 応答のバイト列をそのままzipとして開き、XBRL_TO_CSV/jpcrp*.csvのメンバーだけを解凍（testzipによる全体のCRC検査は行わない）
+    #   - 必要な要素がそろった時点でメンバーの読み込みを終了し、読み込んだ範囲が壊れていれば"Error"として記録
+    # 引数:無し
+    # 戻値:docIDとテキストデータのリストを1書類ずつ返すジェネレータ
+    def iter_text_data(self):
         for docid in self.docid_list:
             print(docid)
-            csv_path = f'./input/non-finance_data/doc/tmp/{docid}/XBRL_TO_CSV/*.csv'
             doc_data = [docid]
+            url = f"https://api.edinet-fsa.go.jp/api/v2/documents/{docid}"
+            params = {"type": 5, "Subscription-Key": edinet_api_key} # 5:CSVを取得
             try:
-                csv_file = glob.glob(csv_path)[0]
-                df = pd.read_csv(csv_file, encoding="utf-16",sep="\t")
-                for value in self.keys.values():
-                    matching_row = df[df["要素ID"]==value]
-                    if not matching_row.empty:
-                        doc_data.append(matching_row["値"].values[0])
+                res = requests.get(url, params=params)
+                res.raise_for_status() # ステータスコードが200以外の場合に例外を発生させる
+                with zipfile.ZipFile(io.BytesIO(res.content)) as z:
+                    members = [file for file in z.namelist() if file.startswith("XBRL_TO_CSV/jpcrp") and file.endswith(".csv")]
+                    if not members:
+                        print(f"{docid} のCSVファイルが見つかりませんでした")
+                        doc_data += ["File Not Found"] * (len(self.keys)+1)
                     else:
-                        doc_data.append(None)
-                        
-                # 「サステナビリティに関する考え方及び取組」だけ、codeが特殊なので別途渡す
-                dynamic_code = self.extract_dynamic_code(csv_file)
-                key_text = f"jpcrp030000-asr_{dynamic_code}-000:DisclosureOfSustainabilityRelatedFinancialInformationTextBlock"
-                matching_row = df[df["要素ID"]==key_text]
-                if not matching_row.empty:
-                    doc_data.append(matching_row["値"].values[0])
-                else:
-                    doc_data.append(None)
-
-            except IndexError:
-                print(f"{docid} のCSVファイルが見つかりませんでした")
+                        with io.TextIOWrapper(z.open(members[0]), encoding="utf-16", newline="") as f:
+                            doc_data += self.extract_text(f, members[0])
+                time.sleep(3)
+            except (requests.RequestException, zipfile.BadZipFile) as e:
+                print(f"リクエストが失敗しました {docid}: {e}")
                 doc_data += ["File Not Found"] * (len(self.keys)+1)
             except Exception as e:
                 print(f"エラー処理 {docid}: {e}")
                 doc_data += ["Error"]*(len(self.keys)+1)
-                
-            data.append(doc_data)
-            
-        text_df = pd.DataFrame(data, columns=["docID"] + list(keys.keys())+["サステナビリティ方針"])
+            yield doc_data
 
-        return text_df
+    # iter_text_dataの結果をget_text_dataと同じ形式のDataframeにまとめる
+    # 引数:無し
+    # 戻値:テキストデータのDataframe
+    def get_text_data_streaming(self):
+        return pd.DataFrame(list(self.iter_text_data()), columns=["docID"] + list(self.keys.keys())+["サステナビリティ方針"])
     
+# プロセスプールのワーカーで実行する解析処理（モジュールの関数でないとpickleできないため）
+# 引数:keys、docID
+# 戻値:docIDとテキストデータのリスト
+def parse_doc(keys, docid):
+    return GetCsvFromEdinet(keys, []).parse_doc(docid)
+
 
 def main():
     # 有価証券報告書のXBRLファイル等の取得のためにdocid_listを作成
@@ -161,7 +250,7 @@ def main():
     merge_df = pd.merge(edinet_df, text_data, on='docID', how='outer')
     merge_df = merge_df.drop_duplicates()
     merge_df.to_csv('./input/non-finance_data/origin/' + now.strftime('%Y%m%d') + '_text_data', index=False)
-    merge_df.to_sql("non_financial_data", engine, if_exists="append", index=False)    
+    bulk_load(merge_df, "non_financial_data", engine)    
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+株価のローカルデータセット（Hiveパーティション形式のParquet）
+    - stock_pricesを年（year）と証券コードの先頭2桁（symbol_prefix）で分割して保存
+    - 読み込み時は銘柄・期間の条件から対象のパーティションだけを開き（述語のプッシュダウン）、
+      パーティション内も銘柄・日付順に並べた行グループの統計情報で読み飛ばす。必要な列だけを読む（列のプッシュダウン）
+    - 累積修正係数（adjustment_factors）も保存し、adjusted=Trueでadjusted_stock_pricesビューと同じ修正後の株価を返す
+    - PostgreSQLに接続せずに、オフラインの分析・バックテストで株価を読み込める
+
+input/finance_data/price_dataset
+├── adjustment_factors.parquet：累積修正係数
+├── _SYNCED：DBからの全件の作成（sync_from_db）が完了したことを示すファイル（途中で中断した場合は次回に作成し直す）
+└── year=2024
+    ├── symbol_prefix=13
+    │   └── part-0.parquet
+    └── symbol_prefix=14
+        └── part-0.parquet
+
+実行方法（DBのstock_prices、adjustment_factorsからデータセットを作成）
+    python -m get_data.price_dataset
+"""
+
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, inspect
+from get_data.config import db_config, snapshot_config
+from get_data.adjustment import apply_adjustment_factors, price_columns
+
+# データセットに保存する列（yahooqueryのhistoryの列）
+dataset_columns = ['symbol', 'date', 'open', 'high', 'low', 'close', 'volume', 'adjclose', 'dividends', 'splits']
+dataset_schema = pa.schema([('symbol', pa.string()), ('date', pa.timestamp('ns'))] + [(col, pa.float64()) for col in dataset_columns[2:]])
+partition_schema = pa.schema([('year', pa.int32()), ('symbol_prefix', pa.string())])
+
+# 行グループの行数（銘柄・日付順に並べるため、行グループごとの銘柄の範囲が狭くなり読み飛ばしやすい）
+row_group_size = 20000
+
+class PriceDataset:
+
+    def __init__(self, base_dir='./input/finance_data/price_dataset'):
+        self.base_dir = base_dir
+        self.factors_path = os.path.join(base_dir, 'adjustment_factors.parquet')
+        self.synced_path = os.path.join(base_dir, '_SYNCED')
+
+    def partition_path(self, year, symbol_prefix):
+        return os.path.join(self.base_dir, f"year={year}", f"symbol_prefix={symbol_prefix}", "part-0.parquet")
+
+    # 株価をデータセットに書き込む（同じ銘柄・日付の行は後から書き込んだ行で置き換える）
+    # 引数:株価のDataframe（symbol、dateと価格の列）
+    # 戻値:書き込んだパーティションの数
+    def write(self, df):
+        if df.empty:
+            return 0
+        df = df.reindex(columns=dataset_columns)
+        df['symbol'] = df['symbol'].astype(str)
+        df['date'] = pd.to_datetime(df['date'])
+        df[dataset_columns[2:]] = df[dataset_columns[2:]].astype('float64')
+        partitions = df.groupby([df['date'].dt.year, df['symbol'].str[:2]])
+        for (year, symbol_prefix), part in partitions:
+            path = self.partition_path(year, symbol_prefix)
+            if os.path.exists(path):
+                existing = pq.read_table(path, schema=dataset_schema).to_pandas()
+                part = pd.concat([existing, part], ignore_index=True).drop_duplicates(subset=['symbol', 'date'], keep='last')
+            part = part.sort_values(['symbol', 'date'])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 書き込み途中のファイルを読み込まないよう、一時ファイル（.で始まるファイルは読み込み対象外）に書いてから置き換える
+            tmp_path = os.path.join(os.path.dirname(path), ".part-0.parquet.tmp")
+            pq.write_table(pa.Table.from_pandas(part, schema=dataset_schema, preserve_index=False), tmp_path, row_group_size=row_group_size)
+            os.replace(tmp_path, path)
+        return partitions.ngroups
+
+    # 累積修正係数を保存（compute_adjustment_factors、refresh_adjustment_factorsの戻値）
+    def write_factors(self, factors):
+        os.makedirs(self.base_dir, exist_ok=True)
+        tmp_path = os.path.join(self.base_dir, ".adjustment_factors.parquet.tmp")
+        factors[['symbol', 'effective_date', 'cumulative_factor']].to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.factors_path)
+
+    def read_factors(self, symbols=None):
+        if not os.path.exists(self.factors_path):
+            return pd.DataFrame({'symbol': pd.Series(dtype=str), 'effective_date': pd.Series(dtype='datetime64[ns]'), 'cumulative_factor': pd.Series(dtype=float)})
+        filters = [('symbol', 'in', list(symbols))] if symbols is not None else None
+        factors = pd.read_parquet(self.factors_path, filters=filters)
+        factors['effective_date'] = pd.to_datetime(factors['effective_date'])
+        return factors
+
+    # 株価を読み込む
+    # 引数:銘柄のリスト（省略時は全銘柄）、開始日、終了日（終了日を含む）、読み込む列のリスト、株式分割・併合を反映するか
+    # 戻値:株価のDataframe（銘柄・日付順）
+    def read(self, symbols=None, start=None, end=None, columns=None, adjusted=False):
+        output_columns = columns or dataset_columns
+        # 並べ替え（銘柄・日付）と修正に必要な列は、指定がなくても読み込む
+        required = ['symbol', 'date'] + (price_columns + ['volume'] if adjusted else [])
+        read_columns = list(output_columns) + [col for col in required if col not in output_columns]
+        if not os.path.isdir(self.base_dir):
+            return pd.DataFrame({col: pd.Series(dtype=dataset_schema.field(col).type.to_pandas_dtype()) for col in output_columns})
+
+        dataset = ds.dataset(self.base_dir, format='parquet', schema=pa.unify_schemas([dataset_schema, partition_schema]),
+                             partitioning=ds.partitioning(partition_schema, flavor='hive'),
+                             exclude_invalid_files=False, ignore_prefixes=['.', '_', 'adjustment_factors'])
+        table = dataset.to_table(columns=read_columns, filter=build_filter(symbols, start, end))
+        df = table.to_pandas()
+        if adjusted:
+            df = apply_adjustment_factors(df, self.read_factors(df['symbol'].unique()))
+        return df.sort_values(['symbol', 'date'], kind='stable').reset_index(drop=True)[output_columns]
+
+    # DBからの全件の作成が完了しているか（Falseの場合は、日次の株価を追加する前にsync_from_dbで作成する）
+    def is_synced(self):
+        return os.path.exists(self.synced_path)
+
+    # DBの株価・累積修正係数からデータセットを作成（start以降の株価のみを書き込む場合は開始日を指定）
+    # 全件を書き込み終えた場合のみ、完了を示すファイル（_SYNCED）を作成する
+    # 引数:SQLAlchemyのエンジン、開始日、1回に読み込む行数
+    # 戻値:書き込んだ行数
+    def sync_from_db(self, engine, start=None, chunksize=500000):
+        query = "SELECT * FROM stock_prices"
+        params = None
+        if start is not None:
+            query += " WHERE date >= %(start)s"
+            params = {'start': pd.Timestamp(start).to_pydatetime()}
+        n_rows = 0
+        for chunk in pd.read_sql(query, engine, params=params, chunksize=chunksize):
+            self.write(chunk)
+            n_rows += len(chunk)
+        if inspect(engine).has_table('adjustment_factors'):
+            self.write_factors(pd.read_sql("SELECT * FROM adjustment_factors", engine))
+        if start is None:
+            os.makedirs(self.base_dir, exist_ok=True)
+            with open(self.synced_path, 'w', encoding='utf-8') as f:
+                f.write(pd.Timestamp.now().isoformat())
+        return n_rows
+
+# 銘柄・期間の条件をデータセットのフィルタ（パーティションの列、ファイル内の列）に変換
+# 引数:銘柄のリスト、開始日、終了日
+# 戻値:pyarrow.datasetのExpression（条件がなければNone）
+def build_filter(symbols=None, start=None, end=None):
+    conditions = []
+    if symbols is not None:
+        symbols = [str(symbol) for symbol in symbols]
+        conditions.append(ds.field('symbol_prefix').isin(sorted({symbol[:2] for symbol in symbols})))
+        conditions.append(ds.field('symbol').isin(symbols))
+    if start is not None:
+        start = pd.Timestamp(start)
+        conditions.append(ds.field('year') >= start.year)
+        conditions.append(ds.field('date') >= pa.scalar(start, type=pa.timestamp('ns')))
+    if end is not None:
+        end = pd.Timestamp(end)
+        conditions.append(ds.field('year') <= end.year)
+        conditions.append(ds.field('date') < pa.scalar(end.normalize() + pd.Timedelta(days=1), type=pa.timestamp('ns')))
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+def main():
+    #  DBエンジンのインスタンスを作成（import時にはDBエンジンを作成しない）
+    conn_string = f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"
+    engine = create_engine(conn_string)
+    price_dataset = PriceDataset(snapshot_config['price_dataset_dir'])
+    n_rows = price_dataset.sync_from_db(engine)
+    print(f"{n_rows}行の株価を{price_dataset.base_dir}に保存しました")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+テーブルごとの列の型（dtype）の定義
+    - 取得時（前処理）にDataframeへ適用し、同じ定義からPostgreSQLの列の型も決める
+    - financial_info
+        symbol、periodType、currencyCode：値の種類が少ないためcategory（文字列を1回だけ保持し、各行は整数のコード）
+        asOfDate：datetime64
+        1株当たりの値・比率（EPS、PER、PBRなど）：float32（有効桁数7桁で十分な列）
+        金額・株数：float64（兆円単位の金額を円単位まで保持するため）
+    - 欠損値がほとんどの列は、分析時にto_sparseで疎な配列（SparseDtype）に変換するとメモリ使用量を抑えられる
+      （ParquetとCOPYは疎な配列に対応していないため、書き込み時は通常の配列のまま扱う）
+"""
+
+import pandas as pd
+from sqlalchemy.types import REAL, DOUBLE_PRECISION, Text, DateTime, Date
+
+# financial_infoテーブルに保存する列（欠損率が95%以上の列は除外済み）
+info_list = ['symbol','asOfDate','periodType','currencyCode','BasicAverageShares','BasicEPS','CostOfRevenue','DilutedAverageShares',
+        'DilutedEPS','DilutedNIAvailtoComStockholders','EBIT','EBITDA','GeneralAndAdministrativeExpense','GrossProfit',
+        'InterestExpense','InterestExpenseNonOperating','InterestIncome','InterestIncomeNonOperating','MinorityInterests',
+        'NetIncome','NetIncomeCommonStockholders','NetIncomeContinuousOperations','NetIncomeFromContinuingAndDiscontinuedOperation',
+        'NetIncomeFromContinuingOperationNetMinorityInterest','NetIncomeIncludingNoncontrollingInterests','NetInterestIncome',
+        'NetNonOperatingInterestIncomeExpense','NormalizedEBITDA','NormalizedIncome','OperatingExpense','OperatingIncome',
+        'OperatingRevenue','OtherNonOperatingIncomeExpenses','OtherSpecialCharges','OtherunderPreferredStockDividend',
+        'PretaxIncome','ReconciledCostOfRevenue','ReconciledDepreciation','SellingGeneralAndAdministration','SpecialIncomeCharges',
+        'TaxEffectOfUnusualItems','TaxProvision','TaxRateForCalcs','TotalExpenses','TotalOperatingIncomeAsReported','TotalRevenue',
+        'TotalUnusualItems','TotalUnusualItemsExcludingGoodwill','WriteOff','BeginningCashPosition','CashDividendsPaid',
+        'ChangeInCashSupplementalAsReported','ChangeInInventory','ChangeInOtherCurrentAssets','ChangeInOtherCurrentLiabilities',
+        'ChangeInPayable','ChangeInReceivables','ChangeInWorkingCapital','ChangesInCash','CommonStockDividendPaid','Depreciation',
+        'DepreciationAndAmortization','EffectOfExchangeRateChanges','EndCashPosition','FinancingCashFlow','FreeCashFlow',
+        'GainLossOnInvestmentSecurities','InterestPaidCFO','InterestReceivedCFO','InvestingCashFlow','IssuanceOfDebt',
+        'LongTermDebtIssuance','LongTermDebtPayments','NetBusinessPurchaseAndSale','NetCommonStockIssuance','NetIncomeFromContinuingOperations',
+        'NetInvestmentPurchaseAndSale','NetIssuancePaymentsOfDebt','NetLongTermDebtIssuance','NetOtherFinancingCharges','NetOtherInvestingChanges',
+        'NetShortTermDebtIssuance','OperatingCashFlow','OtherCashAdjustmentOutsideChangeinCash','OtherNonCashItems','PurchaseOfInvestment',
+        'RepaymentOfDebt','SaleOfBusiness','SaleOfInvestment','TaxesRefundPaid','AccountsPayable','AccountsReceivable',
+        'AdditionalPaidInCapital','AvailableForSaleSecurities','BuildingsAndImprovements','CapitalLeaseObligations','CapitalStock',
+        'CashAndCashEquivalents','CashCashEquivalentsAndShortTermInvestments','CommonStock','CommonStockEquity','ConstructionInProgress',
+        'CurrentAssets','CurrentCapitalLeaseObligation','CurrentDebt','CurrentDebtAndCapitalLeaseObligation','CurrentLiabilities','FinishedGoods',
+        'Goodwill','GoodwillAndOtherIntangibleAssets','GrossAccountsReceivable','GrossPPE','Inventory','InvestedCapital',
+        'InvestmentinFinancialAssets','LandAndImprovements','LongTermCapitalLeaseObligation','LongTermDebt','LongTermDebtAndCapitalLeaseObligation',
+        'LongTermProvisions','MachineryFurnitureEquipment','MinorityInterest','NetDebt','NetPPE','NetTangibleAssets','NonCurrentDeferredTaxesAssets',
+         'NonCurrentDeferredTaxesLiabilities','NonCurrentPensionAndOtherPostretirementBenefitPlans','OrdinarySharesNumber','OtherCurrentAssets',
+        'OtherCurrentLiabilities','OtherIntangibleAssets','OtherNonCurrentAssets','OtherNonCurrentLiabilities','OtherPayable','OtherProperties',
+        'Payables','PensionandOtherPostRetirementBenefitPlansCurrent','Properties','RawMaterials','RetainedEarnings','ShareIssued','StockholdersEquity',
+        'TangibleBookValue','TotalAssets','TotalCapitalization','TotalDebt','TotalEquityGrossMinorityInterest','TotalLiabilitiesNetMinorityInterest',
+        'TotalNonCurrentAssets','TotalNonCurrentLiabilitiesNetMinorityInterest','TotalTaxPayable','TradeandOtherPayablesNonCurrent','TreasurySharesNumber',
+        'TreasuryStock','WorkInProcess','WorkingCapital','CurrentProvisions','EnterpriseValue','EnterprisesValueEBITDARatio','EnterprisesValueRevenueRatio',
+        'MarketCap','PbRatio','PeRatio','PsRatio','capitalAdequacyRatio','ROE','CapitalExpenditure','ChangeInPrepaidAssets','CommonStockIssuance',
+        'GainLossOnSaleOfPPE','IssuanceOfCapitalStock','NetIntangiblesPurchaseAndSale','NetPPEPurchaseAndSale','PurchaseOfIntangibles','PurchaseOfPPE',
+        'PrepaidAssets','DepreciationAndAmortizationInIncomeStatement','DepreciationIncomeStatement','OtherOperatingExpenses','RestructuringAndMergernAcquisition',
+        'AmortizationCashFlow','PurchaseOfBusiness','SaleOfPPE','AccumulatedDepreciation','DefinedPensionBenefit','LongTermEquityInvestment','OtherShortTermInvestments',
+        'CommonStockPayments','RepurchaseOfCapitalStock','NonCurrentPrepaidAssets','OtherEquityInterest','TaxesReceivable','OtherReceivables',
+        'NetForeignCurrencyExchangeGainLoss','FixedAssetsRevaluationReserve']
+
+# 値の種類が少ないキーの列（category）
+financial_info_category_columns = ['symbol', 'periodType', 'currencyCode']
+# 1株当たりの値・比率の列（float32）
+financial_info_float32_columns = ['BasicEPS', 'DilutedEPS', 'TaxRateForCalcs', 'EnterprisesValueEBITDARatio', 'EnterprisesValueRevenueRatio',
+                                  'PbRatio', 'PeRatio', 'PsRatio', 'capitalAdequacyRatio', 'ROE']
+
+# financial_infoの列の型
+financial_info_dtypes = {col: 'category' for col in financial_info_category_columns}
+financial_info_dtypes['asOfDate'] = 'datetime64[ns]'
+financial_info_dtypes.update({col: 'float32' if col in financial_info_float32_columns else 'float64' for col in info_list[4:]})
+
+# dtypeに対応するPostgreSQLの列の型
+sql_types = {'category': Text(), 'datetime64[ns]': DateTime(), 'float32': REAL(), 'float64': DOUBLE_PRECISION()}
+
+# DataFrame.to_sqlのdtypeに渡す列の型
+# 引数:列名をキーとしたdtypeのdict
+# 戻値:列名をキーとしたSQLAlchemyの型のdict
+def to_sql_types(dtypes):
+    return {col: sql_types[dtype] for col, dtype in dtypes.items()}
+
+financial_info_sql_types = to_sql_types(financial_info_dtypes)
+# 決算期（asOfDate）は時刻を持たないため日付型で保存（日付の範囲条件で主キーのインデックスを使えるようにする）
+financial_info_sql_types['asOfDate'] = Date()
+
+# financial_infoの主キー（銘柄、決算期、期間）
+financial_info_key = ['symbol', 'asOfDate', 'periodType']
+
+# Dataframeに列の型を適用（列の並びも定義に揃え、ない列は欠損値で追加）
+# 引数:Dataframe、列名をキーとしたdtypeのdict
+# 戻値:型を適用したDataframe
+def apply_schema(df, dtypes):
+    df = df.reindex(columns=list(dtypes))
+    for col, dtype in dtypes.items():
+        if dtype == 'datetime64[ns]':
+            # タイムゾーン付きの日時・文字列が混在していても日付部分だけで変換
+            df[col] = pd.to_datetime(df[col].astype(str).str.split(' ').str[0], errors='coerce')
+        elif dtype == 'category':
+            # 欠損以外の値を文字列にしてからcategoryに変換（全行欠損の列がfloat64のカテゴリにならないようにする）
+            values = df[col].astype(object)
+            df[col] = values.where(values.isna(), values.astype(str)).astype('category')
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+# 欠損値の割合がthreshold以上の数値列を疎な配列（SparseDtype）に変換
+# 引数:Dataframe、欠損値の割合のしきい値
+# 戻値:Dataframe
+def to_sparse(df, threshold=0.9):
+    df = df.copy()
+    for col in df.columns[df.dtypes.map(lambda dtype: pd.api.types.is_float_dtype(dtype))]:
+        if df[col].isna().mean() >= threshold:
+            df[col] = df[col].astype(pd.SparseDtype(df[col].dtype, float('nan')))
+    return df
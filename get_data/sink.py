@@ -0,0 +1,77 @@
+"""
+取得中のデータをPostgreSQLへ少しずつ書き込むストリーミングシンク
+    - FrameAccumulatorのon_flushにtable_writerを渡すと、flushのたびに書き込み処理をキューに積む
+    - 書き込みはバックグラウンドのスレッドで行うため、Yahoo Financeからの取得とDBへの書き込みが並行して進む
+    - キューの長さに上限を設け、書き込みが追いつかない場合は取得側を待たせる（メモリ使用量の上限）
+    - journal（IngestionJournal）を渡すと、書き込み済みの銘柄を記録し、--resume時に同じ行を二重に書き込まない
+    - key（一意キーの列名）を指定したテーブルはupsertで書き込み、取得期間が前回と重なっても行が重複しない
+      （keep_existing=Trueの場合は欠損値で既存の値を上書きしない）
+    - snapshot（SnapshotStore.writer）を渡すと、flushのたびにParquetのスナップショットにも追記する
+"""
+
+import os
+import queue
+import threading
+from get_data.bulk_load import bulk_load
+
+class StreamingSink:
+
+    def __init__(self, engine, journal=None, max_pending=4):
+        self.engine = engine
+        self.journal = journal
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.failed = []
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    # バックグラウンドでキューのDataframeをDBに書き込む
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.write(*item)
+            except Exception as e:
+                print(f"{item[0]}への書き込み中にエラーが発生しました（終了時に再試行します）: {e}")
+                self.failed.append(item)
+
+    def write(self, table, df, key=None, dtype=None, keep_existing=False):
+        if key:
+            bulk_load(df, table, self.engine, mode="upsert", key=key, dtype=dtype, keep_existing=keep_existing)
+        else:
+            bulk_load(df, table, self.engine, dtype=dtype)
+        if self.journal is not None and 'symbol' in df.columns:
+            self.journal.mark_written(table, df['symbol'].unique())
+
+    # FrameAccumulatorのon_flushに渡す書き込み処理を作成
+    # 引数:テーブル名、書き込み前の前処理、追記するCSVファイルのパス、CSVのエンコーディング、upsert時の一意キーの列名のリスト、
+    #      スナップショットへの書き込み処理、テーブル作成時の列の型（schema.pyのto_sql_typesの戻値）、
+    #      upsert時に欠損値で既存の値を上書きしないか
+    # 戻値:Dataframeを受け取る関数
+    def table_writer(self, table, preprocess=None, csv_path=None, encoding=None, key=None, snapshot=None, dtype=None, keep_existing=False):
+        def on_flush(df):
+            if preprocess is not None:
+                df = preprocess(df)
+            if self.journal is not None and 'symbol' in df.columns:
+                # 中断前の実行で書き込み済みの銘柄は除外
+                df = df[~df['symbol'].isin(self.journal.written(table))]
+            if df.empty:
+                return
+            if snapshot is not None:
+                snapshot(df)
+            if csv_path is not None:
+                df.to_csv(csv_path, mode='a', header=not os.path.exists(csv_path), encoding=encoding, index=False, errors='ignore')
+            self.queue.put((table, df, key, dtype, keep_existing))
+        return on_flush
+
+    # キューに残った書き込みを完了させてスレッドを終了
+    # 引数:無し
+    # 戻値:無し
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        # 失敗した書き込みを1回だけ再試行
+        failed, self.failed = self.failed, []
+        for item in failed:
+            self.write(*item)
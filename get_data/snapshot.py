@@ -0,0 +1,135 @@
+"""
+取得データのスナップショット（Parquet）
+    - 取得結果をcp932のCSVではなくParquetで保存し、dtype（日付・数値）を保ったまま読み書きする
+    - 実行日（run_date）ごとにディレクトリを分け、flushのたびに新しいpartファイルを追加する
+    - 読み込み時は必要な列・実行日のファイルだけを読む（列の射影、パーティションの絞り込み）
+    - チャンクごとに列の型が異なる場合（欠損のみの列など）は、読み込み時にスキーマを統合する
+    - CSVはconfig.snapshot_config['export_csv']を有効にした場合のみ出力する
+
+input/finance_data/snapshot
+├── origin：初回実行（finance.py）で取得した過去データ
+│   └── stock_prices、company_metrics、company_financial_info、missed_*
+│       └── run_date=YYYYMMDD
+│           └── part-00000.parquet
+└── tmp：日次実行（schedule.py）で取得したデータ
+    └── stock_prices、company_metrics、company_financial_info、missed_*、applied_data
+        └── run_date=YYYYMMDD
+            ├── part-00000.parquet
+            └── part-00001.parquet
+"""
+
+import os
+import glob
+import shutil
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+class SnapshotStore:
+
+    def __init__(self, base_dir='./input/finance_data/snapshot'):
+        self.base_dir = base_dir
+        # 同じパーティションへの同時書き込みでpartファイルの番号が重ならないようにする
+        self.lock = threading.Lock()
+
+    def path(self, layer, name, run_date=None):
+        path = os.path.join(self.base_dir, layer, name)
+        if run_date is not None:
+            path = os.path.join(path, f"run_date={run_date}")
+        return path
+
+    # スナップショットのpartファイルの一覧
+    # 引数:レイヤー（origin、tmp）、データ名、読み込む実行日のリスト（省略時はすべて）
+    # 戻値:partファイルのパスのリスト（実行日、書き込み順）
+    def files(self, layer, name, run_dates=None):
+        if run_dates is None:
+            return sorted(glob.glob(os.path.join(self.path(layer, name), "run_date=*", "part-*.parquet")))
+        return [f for run_date in sorted(run_dates) for f in sorted(glob.glob(os.path.join(self.path(layer, name, run_date), "part-*.parquet")))]
+
+    def exists(self, layer, name):
+        return bool(self.files(layer, name))
+
+    # 実行日のパーティションを削除（同日に新規実行する場合に作り直す）
+    def clear(self, layer, name, run_date):
+        shutil.rmtree(self.path(layer, name, run_date), ignore_errors=True)
+
+    # Dataframeを実行日のパーティションにpartファイルとして追加
+    # 引数:レイヤー、データ名、Dataframe、実行日（YYYYMMDD）
+    # 戻値:書き込んだファイルのパス（空のDataframeの場合はNone）
+    def write(self, layer, name, df, run_date):
+        if df.empty:
+            return None
+        table = to_arrow_table(df)
+        partition = self.path(layer, name, run_date)
+        os.makedirs(partition, exist_ok=True)
+        with self.lock:
+            part_path = os.path.join(partition, f"part-{len(glob.glob(os.path.join(partition, 'part-*.parquet'))):05d}.parquet")
+            # 書き込み途中のファイルを読み込まないよう、一時ファイルに書いてから置き換える
+            pq.write_table(table, part_path + ".tmp")
+            os.replace(part_path + ".tmp", part_path)
+        return part_path
+
+    # FrameAccumulator（StreamingSink.table_writer）から呼び出す書き込み処理を作成
+    # 引数:レイヤー、データ名、実行日
+    # 戻値:Dataframeを受け取る関数
+    def writer(self, layer, name, run_date):
+        return lambda df: self.write(layer, name, df, run_date)
+
+    # スナップショットを読み込む
+    # 引数:レイヤー（複数のレイヤーを1つのデータとして読む場合はリスト）、データ名、読み込む列のリスト、読み込む実行日のリスト
+    # 戻値:Dataframe（スナップショットがない場合は空のDataframe）
+    def read(self, layer, name, columns=None, run_dates=None):
+        layers = [layer] if isinstance(layer, str) else layer
+        files = [f for l in layers for f in self.files(l, name, run_dates)]
+        if not files:
+            return pd.DataFrame(columns=columns)
+        # partファイルごとのスキーマを統合（全行欠損でnull型になった列などを他のファイルの型に合わせる）
+        # category（dictionary）の列はファイルごとに辞書が異なるため、文字列として統合してから読み込み後にcategoryに戻す
+        # （全行欠損のチャンクでは辞書の値の型がnullやdoubleになるため、値の型ではなく文字列に揃える）
+        schemas = [pq.read_schema(f) for f in files]
+        dictionary_columns = list(dict.fromkeys(field.name for s in schemas for field in s if pa.types.is_dictionary(field.type)))
+        category_columns = [col for col in dictionary_columns if columns is None or col in columns]
+        schemas = [pa.schema([pa.field(field.name, pa.string()) if field.name in dictionary_columns else field for field in s])
+                   for s in schemas]
+        schema = pa.unify_schemas(schemas, promote_options="permissive")
+        dataset = ds.dataset(files, schema=schema, format="parquet")
+        df = dataset.to_table(columns=columns).to_pandas()
+        for col in category_columns:
+            df[col] = df[col].astype('category')
+        return df
+
+    # 過去データ（origin）を読み込む
+    # スナップショットがなく、従来のCSVがある場合はCSVを1回だけ読み込んでスナップショットに変換する
+    # 引数:データ名、従来のCSVのパス、CSVのエンコーディング、読み込む列のリスト、CSVを変換する際の前処理、変換時の実行日
+    # 戻値:Dataframe（スナップショットもCSVもない場合は空のDataframe）
+    def load_baseline(self, name, csv_path=None, encoding=None, columns=None, preprocess=None, run_date=None):
+        if not self.exists("origin", name) and csv_path is not None and os.path.exists(csv_path):
+            print(f"{csv_path}をスナップショットに変換します")
+            df = pd.read_csv(csv_path, encoding=encoding, low_memory=False)
+            if preprocess is not None:
+                df = preprocess(df)
+            self.write("origin", name, df, run_date or pd.Timestamp.today().strftime('%Y%m%d'))
+        return self.read("origin", name, columns=columns)
+
+    # スナップショットをCSVに出力
+    # 引数:レイヤー、データ名、出力先のパス、エンコーディング、読み込む実行日のリスト
+    # 戻値:無し
+    def export_csv(self, layer, name, csv_path, encoding=None, run_dates=None):
+        df = self.read(layer, name, run_dates=run_dates)
+        os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+        df.to_csv(csv_path, encoding=encoding, index=False, errors='ignore')
+
+# DataframeをArrowのテーブルに変換
+# Parquetに保存できない値（yahooqueryのTickerオブジェクトなど）を含むobject列は文字列に変換する
+# 引数:Dataframe
+# 戻値:pyarrow.Table
+def to_arrow_table(df):
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].map(str).where(df[col].notna(), None)
+        return pa.Table.from_pandas(df, preserve_index=False)
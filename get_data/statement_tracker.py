@@ -0,0 +1,111 @@
+"""
+財務諸表の更新の検知
+    - statement_watermarksテーブルに、銘柄×期間（periodType）ごとに保存済みの財務諸表の最新の決算期（asOfDate）と、
+      財務諸表を最後に取得した日時（checked_at）を記録
+    - 財務諸表（損益計算書・キャッシュフロー計算書・貸借対照表の年次・四半期：6リクエスト）を取得し直す銘柄
+        記録がない銘柄（新規上場など）
+        EDINETに新たに有価証券報告書が提出された銘柄（GetDocidで取得した書類一覧）
+        次の決算期末からlag_days日以上経過し、まだ新しい決算期の財務諸表がない銘柄（recheck_days日ごとに確認）
+        最後の取得からrefresh_days日以上経過した銘柄（訂正などの反映）
+    - それ以外の銘柄は企業価値評価（valuation_measures：1リクエスト）だけを取得
+    - 初回はfinancial_infoの財務諸表の行から作成し、以降は取得した財務情報の書き込み後に更新
+"""
+
+import datetime
+import pandas as pd
+from sqlalchemy import inspect
+
+# 財務諸表の行かどうかを判定する列（企業価値評価だけの行はこれらの列が欠損）
+statement_columns = ['TotalRevenue', 'TotalAssets', 'NetIncome', 'OperatingCashFlow']
+
+# 期間ごとの決算期の間隔（月数）
+period_months = {'3M': 3, '12M': 12}
+
+class StatementTracker:
+
+    def __init__(self, engine, table='statement_watermarks', lag_days=30, recheck_days=7, refresh_days=90):
+        self.engine = engine
+        self.table = table
+        self.lag_days = lag_days
+        self.recheck_days = recheck_days
+        self.refresh_days = refresh_days
+        self.marks = {}
+        self.checked = {}
+        self.filed_symbols = set()
+        self.today = None
+
+    # 銘柄×期間ごとの最新の決算期を読み込む（テーブルがなければ作成し、financial_infoから初期値を設定）
+    # 引数:基準日（省略時は当日）
+    # 戻値:無し
+    def load(self, today=None):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    symbol TEXT NOT NULL,
+                    "periodType" TEXT NOT NULL,
+                    last_as_of_date TIMESTAMP,
+                    checked_at TIMESTAMP NOT NULL DEFAULT now(),
+                    PRIMARY KEY (symbol, "periodType")
+                )""")
+            is_empty = conn.exec_driver_sql(f"SELECT 1 FROM {self.table} LIMIT 1").first() is None
+            if is_empty and inspect(conn).has_table('financial_info'):
+                columns = [col['name'] for col in inspect(conn).get_columns('financial_info')]
+                is_statement = " OR ".join(f'"{col}" IS NOT NULL' for col in statement_columns if col in columns) or "false"
+                conn.exec_driver_sql(f"""
+                    INSERT INTO {self.table} (symbol, "periodType", last_as_of_date)
+                    SELECT symbol, "periodType", MAX("asOfDate") FROM financial_info
+                    WHERE "periodType" IN ('3M', '12M') AND ({is_statement})
+                    GROUP BY symbol, "periodType" """)
+        df = pd.read_sql(f'SELECT symbol, "periodType", last_as_of_date, checked_at FROM {self.table}', self.engine)
+        self.marks = {(symbol, period_type): pd.Timestamp(last_as_of_date)
+                      for symbol, period_type, last_as_of_date in zip(df['symbol'], df['periodType'], df['last_as_of_date'])}
+        self.checked = df.groupby('symbol')['checked_at'].min().to_dict()
+        self.today = pd.Timestamp(today or datetime.date.today())
+
+    # EDINETに新たに提出された書類の銘柄を登録（GetDocid.create_docid_dfの戻値のsymbol列：証券コードの先頭4桁）
+    # 引数:証券コード（4桁）のリスト
+    # 戻値:無し
+    def add_filings(self, symbols):
+        self.filed_symbols |= {f"{symbol}.T" for symbol in symbols if symbol and symbol != '0'}
+
+    # 財務諸表を取得し直す必要があるか
+    # 引数:証券コード（.T付き）
+    # 戻値:bool
+    def needs_statements(self, symbol):
+        if symbol in self.filed_symbols or symbol not in self.checked:
+            return True
+        days_since_check = (self.today - pd.Timestamp(self.checked[symbol])).days
+        if days_since_check >= self.refresh_days:
+            return True
+        for period_type, months in period_months.items():
+            last_as_of_date = self.marks.get((symbol, period_type))
+            if last_as_of_date is None or pd.isna(last_as_of_date):
+                continue
+            # 次の決算期末からlag_days日経過しても新しい財務諸表がなければ、recheck_days日ごとに確認
+            next_period_end = last_as_of_date + pd.DateOffset(months=months)
+            if self.today >= next_period_end + pd.Timedelta(days=self.lag_days) and days_since_check >= self.recheck_days:
+                return True
+        return False
+
+    # 財務諸表を取得した銘柄の最新の決算期と取得日時を更新（既存の決算期より前の日付では更新しない）
+    # 引数:書き込んだ財務情報のDataframe（symbol、asOfDate、periodTypeと財務諸表の列）、財務諸表を取得した銘柄のリスト
+    # 戻値:無し
+    def update(self, df, symbols):
+        symbols = set(symbols)
+        if not symbols:
+            return
+        rows = {(symbol, period_type): None for symbol in symbols for period_type in period_months}
+        if not df.empty:
+            is_statement = df.reindex(columns=statement_columns).notna().any(axis=1)
+            df = df[is_statement & df['symbol'].astype(str).isin(symbols) & df['periodType'].astype(str).isin(list(period_months))]
+            marks = df.groupby([df['symbol'].astype(str), df['periodType'].astype(str)])['asOfDate'].max()
+            for key, last_as_of_date in marks.items():
+                rows[key] = pd.Timestamp(last_as_of_date).to_pydatetime()
+        params = [{'symbol': symbol, 'period_type': period_type, 'last_as_of_date': last_as_of_date}
+                  for (symbol, period_type), last_as_of_date in rows.items()]
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(f"""
+                INSERT INTO {self.table} (symbol, "periodType", last_as_of_date, checked_at)
+                VALUES (%(symbol)s, %(period_type)s, %(last_as_of_date)s, now())
+                ON CONFLICT (symbol, "periodType") DO UPDATE
+                SET last_as_of_date = GREATEST({self.table}.last_as_of_date, EXCLUDED.last_as_of_date), checked_at = now()""", params)
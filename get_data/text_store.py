@@ -0,0 +1,71 @@
+"""
+非財務情報（有価証券報告書のテキストデータ）の追記専用ストア
+    - docIDをキーに、まだ保存していない書類だけをParquet（SnapshotStore）とDB（non_financial_data）に書き込む
+    - 過去データ（origin）と日次の追加分（tmp/run_date=YYYYMMDD）は、read()で1つのテーブルとして読み込める
+    - CSVから変換した過去データと日次の追加分で列の型が揃うよう、Parquetには文字列で保存する
+    - DBへはdocIDをキーにupsertするため、以前の全件追記で重複した行も最初の書き込み時に1行にまとめられる
+    - ダウンロード・解析に失敗した書類（テキストの列が"File Not Found"、"Error"の行）は保存せず、次回の実行で取得し直す
+      （以前に保存した失敗の行も保存済みとはみなさず、取得できた時点で後から書き込んだ行で置き換える）
+
+input/non-finance_data/text_data/snapshot
+├── origin/non_financial_data/run_date=YYYYMMDD：従来のCSV（latest_text_data.csv、20241007_text_data.csv）から変換した過去データ
+└── tmp/non_financial_data/run_date=YYYYMMDD：日次実行で新たに見つかった書類
+"""
+
+import os
+import pandas as pd
+from get_data.snapshot import SnapshotStore
+from get_data.bulk_load import bulk_load
+
+# 取得に失敗した書類のテキストの列に入る値（non_finance_2.GetCsvFromEdinet）
+failed_values = ["File Not Found", "Error"]
+
+# 失敗した書類かを判定する列（失敗した書類はテキストのすべての列が失敗の値になる）
+status_column = "サステナビリティ方針"
+
+class TextDataStore:
+
+    def __init__(self, base_dir='./input/non-finance_data/text_data/snapshot', table='non_financial_data'):
+        self.snapshot = SnapshotStore(base_dir)
+        self.table = table
+
+    # 保存済みのdocID（docIDと判定用の列だけを読み込み、取得に失敗した書類は除く）
+    def docids(self):
+        df = self.snapshot.read(['origin', 'tmp'], self.table, columns=['docID', status_column])
+        return set(df.loc[~df[status_column].isin(failed_values), 'docID'].dropna())
+
+    # 従来のCSVを過去データとして1回だけ取り込む（取り込み済み、またはCSVがない場合は何もしない）
+    # 引数:CSVのパス、SQLAlchemyのエンジン、実行日
+    # 戻値:取り込んだ書類の件数
+    def load_baseline(self, csv_path, engine, run_date):
+        if self.snapshot.exists('origin', self.table) or not os.path.exists(csv_path):
+            return 0
+        print(f"{csv_path}を非財務情報のストアに取り込みます")
+        df = pd.read_csv(csv_path, low_memory=False)
+        df = df.dropna(subset=['docID']).drop_duplicates(subset=['docID'], keep='last')
+        bulk_load(df, self.table, engine, mode="upsert", key=['docID'])
+        self.snapshot.write('origin', self.table, df.astype('string'), run_date)
+        return len(df)
+
+    # まだ保存していない書類だけをDBとストアに書き込む
+    # DBへの書き込みに失敗した場合はストアにも書き込まず、次回の実行で再度書き込む
+    # 引数:非財務情報のDataframe、SQLAlchemyのエンジン、実行日
+    # 戻値:新たに書き込んだ書類のDataframe
+    def append(self, df, engine, run_date):
+        df = df.dropna(subset=['docID']).drop_duplicates(subset=['docID'], keep='last')
+        df = df[~df.isin(failed_values).any(axis=1)]
+        new_df = df[~df['docID'].isin(self.docids())]
+        if new_df.empty:
+            return new_df
+        bulk_load(new_df, self.table, engine, mode="upsert", key=['docID'])
+        self.snapshot.write('tmp', self.table, new_df.astype('string'), run_date)
+        return new_df
+
+    # 過去データと日次の追加分を1つのテーブルとして読み込む（同じdocIDの行は後から書き込んだ行を残す）
+    # 引数:読み込む列のリスト
+    # 戻値:Dataframe
+    def read(self, columns=None):
+        df = self.snapshot.read(['origin', 'tmp'], self.table, columns=columns)
+        if 'docID' in df.columns:
+            df = df.drop_duplicates(subset=['docID'], keep='last').reset_index(drop=True)
+        return df
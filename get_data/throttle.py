@@ -0,0 +1,46 @@
+"""
+リクエストのレート制限とリトライ（Yahoo Finance、EDINETの取得で共通）
+    - RateLimiter：トークンバケット方式で1秒あたりのリクエスト数を制限（全スレッドで1つを共有）
+    - retry_with_timeout：失敗した処理を待機時間を徐々に増やしながら再実行
+"""
+
+import time
+import threading
+
+def retry_with_timeout(func, max_retries=3, delay=5):
+    for attempt in range(max_retries):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == max_retries - 1:
+                raise e
+            print(f"リトライ {attempt + 1}/{max_retries}: {e}")
+            time.sleep(delay * (attempt + 1)) # 遅延時間を徐々に増やす
+
+# トークンバケット方式のリクエストレート制限（全スレッドで共有）
+# burstは連続して送れるリクエスト数の上限。burstを超えるcostは、トークンが満杯になるまで待ってから前借りし、
+# 前借りした分だけ後続のリクエストを待たせる（平均のリクエスト数はrequests_per_second以下に保つ）
+class RateLimiter:
+
+    def __init__(self, requests_per_second, burst=1):
+        self.interval = 1.0 / requests_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    # トークンをcost個消費できるまで待機
+    # 引数:消費するリクエスト数
+    # 戻値:無し
+    def acquire(self, cost=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) / self.interval)
+                self.last = now
+                need = min(cost, self.burst)
+                if self.tokens >= need:
+                    self.tokens -= cost
+                    return
+                wait = (need - self.tokens) * self.interval
+            time.sleep(wait)
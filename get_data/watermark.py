@@ -0,0 +1,83 @@
+"""
+銘柄ごとの株価の取得済み最終日（ハイウォーターマーク）
+    - price_watermarksテーブルに、銘柄ごとにstock_pricesへ保存済みの最終日を記録
+    - 株価は最終日から取得する（最終日の足も取り直し、取得時点で確定していなかった値を上書き）
+        最終日がない銘柄（新規上場など）：backfill_startからすべて取得
+        最終日が直近の営業日以降の銘柄：リクエストしない
+    - 実行しなかった日があっても、最終日から取得するため株価が欠けない
+    - 初回はstock_pricesの銘柄ごとの最終日から作成し、以降は取得した株価の書き込み後に更新
+"""
+
+import datetime
+import pandas as pd
+from sqlalchemy import inspect
+
+# 株価が確定する時刻（東証の大引け）
+market_close = datetime.time(15, 30)
+
+class PriceWatermarks:
+
+    def __init__(self, engine, table='price_watermarks', backfill_start='2000-01-01'):
+        self.engine = engine
+        self.table = table
+        self.backfill_start = backfill_start
+        self.marks = {}
+        self.latest = None
+
+    # 銘柄ごとの最終日を読み込む（テーブルがなければ作成し、stock_pricesから初期値を設定）
+    # 引数:基準日時（省略時は現在時刻）
+    # 戻値:証券コードをキーとした最終日のdict
+    def load(self, now=None):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    symbol TEXT PRIMARY KEY,
+                    last_date TIMESTAMP NOT NULL,
+                    updated_at TIMESTAMP NOT NULL DEFAULT now()
+                )""")
+            is_empty = conn.exec_driver_sql(f"SELECT 1 FROM {self.table} LIMIT 1").first() is None
+            if is_empty and inspect(conn).has_table('stock_prices'):
+                conn.exec_driver_sql(f"""
+                    INSERT INTO {self.table} (symbol, last_date)
+                    SELECT symbol, MAX(date) FROM stock_prices WHERE date IS NOT NULL GROUP BY symbol""")
+        df = pd.read_sql(f"SELECT symbol, last_date FROM {self.table}", self.engine)
+        self.marks = dict(zip(df['symbol'], pd.to_datetime(df['last_date'])))
+        self.latest = latest_trading_day(now)
+        return self.marks
+
+    # 株価の取得開始日
+    # 引数:証券コード（.T付き）
+    # 戻値:取得開始日（YYYY-MM-DD）、直近の営業日まで取得済みの場合はNone
+    def start_date(self, symbol):
+        mark = self.marks.get(symbol)
+        if mark is None:
+            return self.backfill_start
+        if mark >= self.latest:
+            return None
+        return mark.strftime('%Y-%m-%d')
+
+    # 書き込んだ株価から銘柄ごとの最終日を更新（既存の最終日より前の日付では更新しない）
+    # 引数:株価のDataframe（symbol、date）
+    # 戻値:無し
+    def update(self, df):
+        if df.empty:
+            return
+        marks = df.dropna(subset=['date']).groupby('symbol', observed=True)['date'].max()
+        rows = [{'symbol': str(symbol), 'last_date': pd.Timestamp(last_date).to_pydatetime()} for symbol, last_date in marks.items()]
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(f"""
+                INSERT INTO {self.table} (symbol, last_date) VALUES (%(symbol)s, %(last_date)s)
+                ON CONFLICT (symbol) DO UPDATE
+                SET last_date = GREATEST({self.table}.last_date, EXCLUDED.last_date), updated_at = now()""", rows)
+        for row in rows:
+            self.marks[row['symbol']] = max(self.marks.get(row['symbol'], pd.Timestamp.min), pd.Timestamp(row['last_date']))
+
+# 直近の営業日（大引け前は前営業日。祝日は考慮しないため、祝日の夕方は全銘柄を取得する）
+# 引数:基準日時（省略時は現在時刻）
+# 戻値:Timestamp
+def latest_trading_day(now=None):
+    now = now or datetime.datetime.now()
+    today = pd.Timestamp(now.date())
+    if today.dayofweek < 5 and now.time() >= market_close:
+        return today
+    return today - pd.offsets.BDay(1)
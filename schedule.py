@@ -1,5 +1,6 @@
 import os
 import time
+import argparse
 import warnings
 import datetime
 import pandas as pd
@@ -8,7 +9,21 @@ from get_data.finance import *
 from get_data.non_finance import *
 from get_data.non_finance_2 import *
 from get_data.devide_union import *
-from get_data.config import db_config
+from get_data.ingest import IngestionEngine
+from get_data.journal import IngestionJournal
+from get_data.sink import StreamingSink
+from get_data.accumulator import FrameAccumulator
+from get_data.bulk_load import bulk_load
+from get_data.snapshot import SnapshotStore
+from get_data.price_dataset import PriceDataset
+from get_data.text_store import TextDataStore
+from get_data.watermark import PriceWatermarks
+from get_data.statement_tracker import StatementTracker
+from get_data.market_stats import MarketStats
+from get_data.fundamentals import refresh_fundamental_ratios
+from get_data.schema import apply_schema, financial_info_dtypes, financial_info_sql_types, financial_info_key
+from get_data.migration import migrate
+from get_data.config import db_config, ingest_config, snapshot_config
 from sqlalchemy import inspect # , Table, MetaData
 
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -26,23 +41,16 @@ stock_table = "stock_prices"
 now = datetime.date.today().strftime('%Y%m%d')
 # yesterday = (datetime.datetime.now().date() - datetime.timedelta(days=1))
 
-# stock_pricesの取得開始期間の設定
+# stock_pricesの取得開始期間の設定（銘柄ごとの取得済み最終日（price_watermarks）を使用しない場合）
 stock_period = (datetime.date.today() - datetime.timedelta(days=5)).strftime('%Y%m%d') # '2024-11-20'
 
+# stock_prices、adjusted_stock_pricesの一意キー
+stock_prices_key = ['symbol', 'date']
+
 # non_financial_infoの取得開始期間の設定
 non_financial_period = 10
 
-def retry_with_timeout(func, max_retries=3, delay=5):
-    for attempt in range(max_retries):
-        try:
-            return func()
-        except Exception as e:
-            if attempt == max_retries - 1:
-                raise e
-            print(f"リトライ {attempt + 1}/{max_retries}: {e}")
-            time.sleep(delay * (attempt + 1)) # 遅延時間を徐々に増やす
-
-def main():
+def main(resume=False):
     # # 上場銘柄を取得して保存
     # listing_df = fetch_listing_stocks()
     # if not listing_df.empty:
@@ -81,90 +89,138 @@ def main():
         print('指定フォルダ内にファイルがあることを確認')
         exit()
 
-    # 企業情報の指標、財務状況を保存するデータフレームの作成
-    origin_df_all_stock_prices = pd.read_csv("input/finance_data/origin/stock_prices.csv", encoding="shift-jis")
-    origin_df_all_company_metrics = pd.read_csv("input/finance_data/origin/company_metrics.csv", encoding="shift-jis")
-    origin_df_all_company_financial_info = pd.read_csv("input/finance_data/origin/company_financial_info.csv")
+    # 取得データのスナップショット（過去データはsnapshot/origin、当日の取得分はsnapshot/tmpから読み込む）
+    store = SnapshotStore(snapshot_config['base_dir'])
+    export_csv = snapshot_config['export_csv']
 
     # # 株式分割・併合した際の株価調整時に使用
     # merge_df = pd.read_csv("input/finance_data/merge_split/merge_df.csv", encoding="shift-jis")
     # split_df = pd.read_csv("input/finance_data/merge_split/split_df.csv", encoding="shift-jis")
     
-    # 企業情報の指標、財務状況を保存するデータフレームの作成
-    df_all_stock_prices_tmp = pd.DataFrame()
-    missed_all_stock_prices_tmp = pd.DataFrame()
-
-    df_all_company_metrics_tmp = pd.DataFrame()
-    missed_all_company_metrics_tmp = pd.DataFrame()
-
-    df_all_company_financial_info_tmp = pd.DataFrame()
-    missed_all_company_financial_info_tmp = pd.DataFrame()
-
-    # 企業の銘柄名、市場・商品区分、33業種、17業種を保持
-    series_ticker_name = pd.Series()
-    series_market_product_category = pd.Series()
-    series_type_33 = pd.Series()
-    series_type_17 = pd.Series()
-    
     gfd = GetFinanceData()
     stock_lists = gfd.preprocess_stock_lists(raw_stock_lists)
     
-    # tickerの企業情報の指標、財務状況を取得
-    for ticker in stock_lists['コード']:
-        time.sleep(5)
-        # 証券コードに「.T」を追加
-        jpx_filter_df = stock_lists[stock_lists['コード'] == ticker]
-        ticker_num = str(ticker) + '.T'
-        
-        try:
-            ticker_data = Ticker(ticker_num)
-            print(f"{ticker_num}の処理開始")
-        except ChunkedEncodingError:
-            print(f"リトライ:{ticker_num}")
-            time.sleep(10)
-        except Exception as e:
-            print(f"Other error: {e}")
-
-        series_ticker_name = pd.concat([series_ticker_name, jpx_filter_df['銘柄名']])
-        series_market_product_category = pd.concat([series_market_product_category, jpx_filter_df['市場・商品区分']])
-        series_type_33 = pd.concat([series_type_33, jpx_filter_df['33業種区分']])
-        series_type_17 = pd.concat([series_type_17, jpx_filter_df['17業種区分']])
-
-        # 企業情報の取得
-        try:
-            df_stock_prices_tmp, missed_stock_prices_tmp = retry_with_timeout(lambda: gfd.get_stock_prices(ticker_num, ticker_data, stock_period))
-            df_all_stock_prices_tmp = pd.concat([df_all_stock_prices_tmp, df_stock_prices_tmp])
-            missed_all_stock_prices_tmp = pd.concat([missed_all_stock_prices_tmp, missed_stock_prices_tmp])
-        except Exception as e:
-            print(f"{ticker_num}の株価情報取得中にエラーが発生しました: {e}")
-            continue
-
-        try:
-            df_company_metrics_tmp, missed_company_metrics_tmp = retry_with_timeout(lambda: gfd.get_company_metrics(ticker_num, ticker_data))
-            df_all_company_metrics_tmp = pd.concat([df_all_company_metrics_tmp, df_company_metrics_tmp])
-            missed_all_company_metrics_tmp = pd.concat([missed_all_company_metrics_tmp, missed_company_metrics_tmp])
-        except Exception as e:
-            print(f"{ticker_num}の財務指標取得中にエラーが発生しました: {e}")
-            continue
-
-        try:
-            df_company_financial_info_tmp, missed_company_finacial_info_tmp = retry_with_timeout(lambda: gfd.get_company_finacial_info(ticker_num, ticker_data))
-            df_all_company_financial_info_tmp = pd.concat([df_all_company_financial_info_tmp, df_company_financial_info_tmp])
-            missed_all_company_financial_info_tmp = pd.concat([missed_all_company_financial_info_tmp, missed_company_finacial_info_tmp])
-        except Exception as e:
-            print(f"{ticker_num}の財務情報取得中にエラーが発生しました: {e}")
-            continue
-
-    # 不要な列の削除を行い、CSVファイルに保存
-    os.makedirs('./input/finance_data/tmp', exist_ok=True)
-    df_all_stock_prices_tmp['date'] = gfd.preprocess_date(df_all_stock_prices_tmp['date'])
-    df_all_stock_prices_tmp = df_all_stock_prices_tmp.drop('index', axis=1)
-    df_all_stock_prices_tmp.to_csv(f'./input/finance_data/tmp/{now}_stock_prices.csv', encoding='cp932', index=False, errors='ignore')
-    df_all_stock_prices_tmp.to_sql("stock_prices", engine, if_exists="append", index=False)  
-    
-    missed_all_stock_prices_tmp.to_csv(f'./input/finance_data/tmp/{now}_missed_stock_prices.csv', index=False, errors='ignore')
-    missed_all_company_metrics_tmp.to_csv(f'./input/finance_data/tmp/{now}_missed_company_metrics.csv', index=False, errors='ignore')
-    missed_all_company_financial_info_tmp.to_csv(f'./input/finance_data/tmp/{now}_missed_company_financial_info.csv', index=False, errors='ignore')
+    # 進捗ジャーナル（--resume時は前回の未完了の実行を引き継ぎ、取得開始期間も前回と揃える）
+    journal = IngestionJournal(resume=resume, stock_period=stock_period)
+
+    # 取得結果の前処理（flushのたびにチャンク単位で適用）
+    def preprocess_stock_prices(df):
+        df = df.reset_index(drop=True).drop('index', axis=1, errors='ignore')
+        df['date'] = gfd.preprocess_date(df['date'])
+        return df
+
+    def preprocess_company_metrics(df):
+        # 銘柄名、市場・商品区分、33業種、17業種はIngestionEngineで付与済み
+        df = df.reset_index(drop=True)
+        df['exDividendDate'] = gfd.preprocess_date(df['exDividendDate'])
+        return df
+
+    def preprocess_company_financial_info(df):
+        # チャンクごとに列・型がそろうよう、schema.pyの定義（info_listの列、category・float32・float64）を適用
+        # 主キー（銘柄、決算期、期間）が欠損した行（取得できなかった財務諸表の空の行）は除外
+        return apply_schema(df.reset_index(drop=True), financial_info_dtypes).dropna(subset=financial_info_key)
+
+    # 当日のスナップショット（新規実行時は同日のパーティションを作り直す）
+    # CSVはexport_csvが有効な場合のみ、従来と同じ一時ファイルにも追記する
+    tmp_names = ['stock_prices', 'company_metrics', 'company_financial_info',
+                 'missed_stock_prices', 'missed_company_metrics', 'missed_company_financial_info']
+    tmp_csv = {name: f'./input/finance_data/tmp/{now}_{name}.csv' if export_csv else None for name in tmp_names}
+    if export_csv:
+        os.makedirs('./input/finance_data/tmp', exist_ok=True)
+    if not resume:
+        for name in tmp_names:
+            store.clear('tmp', name, now)
+            if tmp_csv[name] is not None and os.path.exists(tmp_csv[name]):
+                os.remove(tmp_csv[name])
+
+    # 以前の実行で作成した実体テーブルのadjusted_stock_prices（修正済みの株価）が残っている場合は、1回だけ未修正の株価をstock_pricesに
+    # 復元してビューに置き換える（株価の取得、取得済み最終日、市場統計が未修正の株価を参照するよう取得前に実行。失敗した場合は中断）
+    if 'adjusted_stock_prices' in inspect(engine).get_table_names(schema='public'):
+        if inspect(engine).has_table('devide_union_data'):
+            all_devide_union_df = pd.read_sql("SELECT * FROM devide_union_data;", engine)
+        else:
+            all_devide_union_df = pd.DataFrame(columns=['symbol', 'company_name', 'ratio', 'last_date_with_rights'])
+        refresh_adjustment_factors(engine, all_devide_union_df, datetime.date.today())
+        create_adjusted_view(engine)
+
+    # テーブルの列の型・主キー・インデックスを定義（migration.py）に合わせる（stock_prices、financial_infoがなければ作成）
+    migrate(engine)
+
+    # 1回目のみ実行（adjusted_stock_pricesがない場合は、過去の株価データをstock_pricesに読み込む）
+    # 取得済み最終日（price_watermarks）をstock_pricesから作成するため、株価の取得前に読み込む
+    # main内で後からinspectorに代入するため、ここでは新しいInspectorを使う（migrate後のテーブル・ビューを参照）
+    current = inspect(engine)
+    if 'adjusted_stock_prices' not in current.get_table_names(schema='public') + current.get_view_names(schema='public'):
+        # スナップショットがなければ従来のCSVを1回だけ読み込んでスナップショットに変換
+        origin_df_all_stock_prices = store.load_baseline("stock_prices", "input/finance_data/origin/stock_prices.csv", "shift-jis",
+                                                         preprocess=preprocess_stock_prices)
+        bulk_load(origin_df_all_stock_prices, "stock_prices", engine, mode="upsert", key=stock_prices_key)
+        del origin_df_all_stock_prices
+
+    # 銘柄ごとの株価の取得済み最終日（最終日から取得し、最新まで取得済みの銘柄はリクエストしない）
+    watermarks = PriceWatermarks(engine)
+    watermarks.load()
+
+    # 最新のdocIDのデータを取得
+    end_date = datetime.date.today()
+    start_date = end_date - datetime.timedelta(days= non_financial_period)
+    # 取得に失敗した場合（EDINETコード一覧がない、ネットワークエラーなど）も株価・財務情報の取得は続け、
+    # 新たな提出はないものとして決算期末からの日数だけで財務諸表の更新を判定する（非財務情報の取得は行わない）
+    gd = GetDocid(start_date, end_date)
+    ID_dir_tmp = "./input/non-finance_data/docID"
+    try:
+        docid_dfs = gd.create_docid_df(ID_dir_tmp)
+    except Exception as e:
+        print(f"docIDの取得中にエラーが発生しました: {e}")
+        docid_dfs = None
+    if docid_dfs is None:
+        print("docIDを取得できなかったため、EDINETへの新たな提出はないものとして処理します")
+        df_report_tmp, edinet_df_tmp = pd.DataFrame(columns=['symbol']), None
+    else:
+        df_report_tmp, edinet_df_tmp = docid_dfs
+        os.makedirs(f'{ID_dir_tmp}/tmp/report', exist_ok=True)
+        os.makedirs(f'{ID_dir_tmp}/tmp/edinet_ID', exist_ok=True)
+        df_report_tmp.to_csv(f"{ID_dir_tmp}/tmp/report/{now}_EdinetReport.csv", encoding="cp932", index=False)
+        edinet_df_tmp.to_csv(f"{ID_dir_tmp}/tmp/edinet_ID/{now}_edinet_df.csv",index=False)
+
+    # 財務諸表の更新の検知（EDINETに新たに書類を提出した銘柄、決算期末から公開までの日数が経過した銘柄だけ財務諸表を取得し、
+    # それ以外の銘柄は企業価値評価だけを取得）
+    statement_tracker = StatementTracker(engine, lag_days=ingest_config['statement_lag_days'], recheck_days=ingest_config['statement_recheck_days'],
+                                         refresh_days=ingest_config['statement_refresh_days'])
+    statement_tracker.load()
+    statement_tracker.add_filings(df_report_tmp['symbol'])
+
+    # flush_tickers銘柄（またはflush_rows行）ごとに、バックグラウンドのスレッドでDBに書き込む
+    # financial_infoは企業価値評価だけを取得した行で財務諸表の値を消さないよう、欠損値では既存の値を上書きしない
+    sink = StreamingSink(engine, journal=journal)
+    # 取得期間が前回と重なるため、株価は(symbol, date)をキーにupsert
+    write_stock_prices = sink.table_writer("stock_prices", preprocess_stock_prices, tmp_csv['stock_prices'], 'cp932', key=stock_prices_key,
+                                           snapshot=store.writer('tmp', 'stock_prices', now))
+    flush_options = {'flush_frames': ingest_config['flush_tickers'], 'flush_rows': ingest_config['flush_rows']}
+    accumulators = {
+        'stock_prices': FrameAccumulator(on_flush=write_stock_prices, **flush_options),
+        'company_metrics': FrameAccumulator(on_flush=sink.table_writer("metrics", preprocess_company_metrics, tmp_csv['company_metrics'], 'cp932',
+                                                                       snapshot=store.writer('tmp', 'company_metrics', now)), **flush_options),
+        'company_financial_info': FrameAccumulator(on_flush=sink.table_writer("financial_info", preprocess_company_financial_info, tmp_csv['company_financial_info'], 'cp932',
+                                                                              key=financial_info_key, snapshot=store.writer('tmp', 'company_financial_info', now), dtype=financial_info_sql_types,
+                                                                              keep_existing=True), **flush_options),
+    }
+
+    # tickerの企業情報の指標、財務状況を並列に取得
+    ingestion = IngestionEngine(gfd, journal.stock_period, max_workers=ingest_config['max_workers'], requests_per_second=ingest_config['requests_per_second'], batch_size=ingest_config['batch_size'], burst=ingest_config['burst'], journal=journal, watermarks=watermarks, statements=statement_tracker)
+    frames = ingestion.run(stock_lists, accumulators)
+    sink.close()
+    # DBへの書き込みが完了した株価で取得済み最終日を更新
+    watermarks.update(store.read('tmp', 'stock_prices', columns=['symbol', 'date'], run_dates=[now]))
+    # 財務諸表を取得した銘柄の最新の決算期を更新
+    statement_tracker.update(store.read('tmp', 'company_financial_info', run_dates=[now]), ingestion.statement_symbols)
+    # 財務諸表を取得し直した銘柄の直近12か月（TTM）と指標を計算し直す（初回は全銘柄）
+    refresh_fundamental_ratios(engine, ingestion.statement_symbols)
+    # 取得できなかった銘柄を保存
+    for name in ['missed_stock_prices', 'missed_company_metrics', 'missed_company_financial_info']:
+        store.write('tmp', name, frames[name], now)
+        if tmp_csv[name] is not None:
+            frames[name].to_csv(tmp_csv[name], index=False, errors='ignore')
     
     # 株式分割・併合があれば株価データを調整
     # 修正値が反映される日（split_date）の銘柄をピックアップして、前日（last_date_with_rights）以前のデータを修正
@@ -172,117 +228,58 @@ def main():
     devide_df = fetch_split_data()
     union_df = fetch_merge_data()
     devide_union_df = pd.concat([devide_df, union_df])
-    devide_union_df.to_sql("devide_union_data", engine, if_exists="append", index=False)
+    bulk_load(devide_union_df, "devide_union_data", engine)
     devide_union_df.to_csv('./input/devide_union/devide_union_df.csv', index=False)
 
-    os.makedirs('./input/finance_data/merge', exist_ok=True)
     try:
         # Inspectorを使用してテーブルの存在確認
         inspector = inspect(engine)
-        # 1回目のみ実行（adjusted_stock_pricesにデータがない場合に実行）
-        if 'adjusted_stock_prices' not in inspector.get_table_names(schema='public'): 
-            df_all_stock_prices = pd.concat([origin_df_all_stock_prices, df_all_stock_prices_tmp]).drop_duplicates().reset_index() 
-            df_all_stock_prices['date'] = gfd.preprocess_date(df_all_stock_prices['date'])
-            df_all_stock_prices.to_sql("stock_prices", engine, if_exists="replace", index=False) # 修正後の株価をテーブルに保存
-            adjusted_df, filtered_df = adjust_stock_prices(df_all_stock_prices, devide_union_df) # 修正する関数の適用
-            # adjusted_df['date'] = gfd.preprocess_date(adjusted_df['date'])
-            adjusted_df.to_sql("adjusted_stock_prices", engine, if_exists="replace", index=False) # 修正後の株価をテーブルに保存
-            adjusted_df.to_csv('./input/finance_data/merge/stock_prices.csv', encoding='cp932', index=False, errors='ignore')
-            filtered_df.to_sql("applied_data", engine, if_exists="append", index=False) # 修正した銘柄を保存
-            filter_stock_query = "SELECT * FROM applied_data;" 
-            all_filtered_df = pd.read_sql(filter_stock_query, engine)
-            all_filtered_df = pd.concat([all_filtered_df, filtered_df])
-            all_filtered_df.to_csv('./input/finance_data/merge/missed_stock_prices.csv', encoding='cp932', index=False, errors='ignore')
-        # ２回目からは修正済みのデータ（adjusted_stock_prices）を修正
-        elif 'adjusted_stock_prices' in inspector.get_table_names(schema='public'):
-            stock_query = "SELECT * FROM adjusted_stock_prices;" 
-            adjusted_stock_prices = pd.read_sql(stock_query, engine)
-            df_all_stock_prices = pd.concat([adjusted_stock_prices, df_all_stock_prices_tmp]).drop_duplicates().reset_index() 
-            df_all_stock_prices['date'] = gfd.preprocess_date(df_all_stock_prices['date'])
-            df_all_stock_prices.to_sql("stock_prices", engine, if_exists="replace", index=False) # 修正後の株価をテーブルに保存
-            adjusted_df, filtered_df = adjust_stock_prices(df_all_stock_prices, devide_union_df) # 修正する関数の適用
-            # adjusted_df['date'] = gfd.preprocess_date(adjusted_df['date'])
-            adjusted_df.to_sql("adjusted_stock_prices", engine, if_exists="replace", index=False) # 修正後の株価をテーブルに保存
-            adjusted_df.to_csv('./input/finance_data/merge/stock_prices.csv', encoding='cp932', index=False, errors='ignore')
-            filtered_df.to_sql("applied_data", engine, if_exists="append", index=False) # 修正した銘柄を保存
-            filter_stock_query = "SELECT * FROM applied_data;" 
-            all_filtered_df = pd.read_sql(filter_stock_query, engine)
-            all_filtered_df = pd.concat([all_filtered_df, filtered_df])
-            all_filtered_df.to_csv('./input/finance_data/merge/missed_stock_prices.csv', encoding='cp932', index=False, errors='ignore')
+        # 株価のローカルデータセット（year=/symbol_prefix=のParquet）に反映（初回はDBの株価をすべて書き出す）
+        price_dataset = PriceDataset(snapshot_config['price_dataset_dir'])
+        if price_dataset.is_synced():
+            price_dataset.write(store.read('tmp', 'stock_prices', run_dates=[now]))
+        else:
+            price_dataset.sync_from_db(engine)
+        # DBに蓄積した株式分割・併合情報から、当日までのイベントの累積修正係数を計算してadjustment_factorsに保存
+        # 修正後の株価はビュー（adjusted_stock_prices）で読み出し時に計算するため、株価の書き直しは不要
+        today = datetime.date.today()
+        all_devide_union_df = pd.read_sql("SELECT * FROM devide_union_data;", engine)
+        factors = refresh_adjustment_factors(engine, all_devide_union_df, today)
+        price_dataset.write_factors(factors)
+        # 52週高値・安値、移動平均、平均出来高などを保存済みの株価から計算してmarket_statsに書き込む（Yahoo Financeへのリクエストなし）
+        MarketStats(snapshot_config['market_stats_dir']).refresh(store.read('tmp', 'stock_prices', run_dates=[now]), factors, engine)
+        create_adjusted_view(engine)
+        # 今回新たに反映されたイベント（実行しなかった日の分も含む）を記録
+        if 'applied_data' in inspector.get_table_names(schema='public'):
+            applied_df = pd.read_sql("SELECT symbol, last_date_with_rights FROM applied_data;", engine)
         else:
-            print('株価データが保存されているか確認してください')
+            applied_df = pd.DataFrame(columns=['symbol', 'last_date_with_rights'])
+        filtered_df = find_unapplied_events(all_devide_union_df, applied_df, today)
+        bulk_load(filtered_df, "applied_data", engine) # 修正した銘柄を保存
+        filter_stock_query = "SELECT * FROM applied_data;"
+        all_filtered_df = pd.read_sql(filter_stock_query, engine)
+        store.clear('tmp', 'applied_data', now)
+        store.write('tmp', 'applied_data', all_filtered_df, now)
+        if export_csv:
+            os.makedirs('./input/finance_data/merge', exist_ok=True)
+            all_filtered_df.to_csv('./input/finance_data/merge/missed_stock_prices.csv', encoding='cp932', index=False, errors='ignore')
     except Exception as e:
         print("株価データ取得中にエラーが発生しました:", e)
 
-    # 列の追加、削除を行いCSVファイルに保存
-    df_all_company_metrics_tmp['ticker_name'] = series_ticker_name.values
-    df_all_company_metrics_tmp['market_product_category'] = series_market_product_category.values
-    df_all_company_metrics_tmp['type_33'] = series_type_33.values
-    df_all_company_metrics_tmp['type_17'] = series_type_17.values
-    df_all_company_metrics_tmp['exDividendDate'] = gfd.preprocess_date(df_all_company_metrics_tmp['exDividendDate'] )
-    # df_all_company_metrics_tmp['exDividendDate'] = pd.to_datetime(df_all_company_metrics_tmp['exDividendDate'], errors='coerce').dt.date # datetime64に変換
-    # df_all_company_metrics_tmp['exDividendDate'] = pd.to_datetime(df_all_company_metrics_tmp['exDividendDate'], errors='coerce')
-    df_all_company_metrics_tmp.to_csv(f'./input/finance_data/tmp/{now}_company_metrics.csv', encoding='cp932', index=False, errors='ignore')
-    df_all_company_metrics_tmp.to_sql("metrics", engine, if_exists="append", index=False)    
-    df_all_company_metrics = pd.concat([origin_df_all_company_metrics, df_all_company_metrics_tmp])
-    df_all_company_metrics.to_csv('./input/finance_data/merge/company_metrics.csv', encoding='cp932', index=False, errors='ignore')
-
-    # 欠損率の計算と95%以上の欠損がある列を特定し削除した後にCSVファイルに保存
-    info_list = ['symbol','asOfDate','periodType','currencyCode','BasicAverageShares','BasicEPS','CostOfRevenue','DilutedAverageShares',
-            'DilutedEPS','DilutedNIAvailtoComStockholders','EBIT','EBITDA','GeneralAndAdministrativeExpense','GrossProfit',
-            'InterestExpense','InterestExpenseNonOperating','InterestIncome','InterestIncomeNonOperating','MinorityInterests',
-            'NetIncome','NetIncomeCommonStockholders','NetIncomeContinuousOperations','NetIncomeFromContinuingAndDiscontinuedOperation',
-            'NetIncomeFromContinuingOperationNetMinorityInterest','NetIncomeIncludingNoncontrollingInterests','NetInterestIncome',
-            'NetNonOperatingInterestIncomeExpense','NormalizedEBITDA','NormalizedIncome','OperatingExpense','OperatingIncome',
-            'OperatingRevenue','OtherNonOperatingIncomeExpenses','OtherSpecialCharges','OtherunderPreferredStockDividend',
-            'PretaxIncome','ReconciledCostOfRevenue','ReconciledDepreciation','SellingGeneralAndAdministration','SpecialIncomeCharges',
-            'TaxEffectOfUnusualItems','TaxProvision','TaxRateForCalcs','TotalExpenses','TotalOperatingIncomeAsReported','TotalRevenue',
-            'TotalUnusualItems','TotalUnusualItemsExcludingGoodwill','WriteOff','BeginningCashPosition','CashDividendsPaid',
-            'ChangeInCashSupplementalAsReported','ChangeInInventory','ChangeInOtherCurrentAssets','ChangeInOtherCurrentLiabilities',
-            'ChangeInPayable','ChangeInReceivables','ChangeInWorkingCapital','ChangesInCash','CommonStockDividendPaid','Depreciation',
-            'DepreciationAndAmortization','EffectOfExchangeRateChanges','EndCashPosition','FinancingCashFlow','FreeCashFlow',
-            'GainLossOnInvestmentSecurities','InterestPaidCFO','InterestReceivedCFO','InvestingCashFlow','IssuanceOfDebt',
-            'LongTermDebtIssuance','LongTermDebtPayments','NetBusinessPurchaseAndSale','NetCommonStockIssuance','NetIncomeFromContinuingOperations',
-            'NetInvestmentPurchaseAndSale','NetIssuancePaymentsOfDebt','NetLongTermDebtIssuance','NetOtherFinancingCharges','NetOtherInvestingChanges',
-            'NetShortTermDebtIssuance','OperatingCashFlow','OtherCashAdjustmentOutsideChangeinCash','OtherNonCashItems','PurchaseOfInvestment',
-            'RepaymentOfDebt','SaleOfBusiness','SaleOfInvestment','TaxesRefundPaid','AccountsPayable','AccountsReceivable',
-            'AdditionalPaidInCapital','AvailableForSaleSecurities','BuildingsAndImprovements','CapitalLeaseObligations','CapitalStock',
-            'CashAndCashEquivalents','CashCashEquivalentsAndShortTermInvestments','CommonStock','CommonStockEquity','ConstructionInProgress',
-            'CurrentAssets','CurrentCapitalLeaseObligation','CurrentDebt','CurrentDebtAndCapitalLeaseObligation','CurrentLiabilities','FinishedGoods',
-            'Goodwill','GoodwillAndOtherIntangibleAssets','GrossAccountsReceivable','GrossPPE','Inventory','InvestedCapital',
-            'InvestmentinFinancialAssets','LandAndImprovements','LongTermCapitalLeaseObligation','LongTermDebt','LongTermDebtAndCapitalLeaseObligation',
-            'LongTermProvisions','MachineryFurnitureEquipment','MinorityInterest','NetDebt','NetPPE','NetTangibleAssets','NonCurrentDeferredTaxesAssets',
-             'NonCurrentDeferredTaxesLiabilities','NonCurrentPensionAndOtherPostretirementBenefitPlans','OrdinarySharesNumber','OtherCurrentAssets',
-            'OtherCurrentLiabilities','OtherIntangibleAssets','OtherNonCurrentAssets','OtherNonCurrentLiabilities','OtherPayable','OtherProperties',
-            'Payables','PensionandOtherPostRetirementBenefitPlansCurrent','Properties','RawMaterials','RetainedEarnings','ShareIssued','StockholdersEquity',
-            'TangibleBookValue','TotalAssets','TotalCapitalization','TotalDebt','TotalEquityGrossMinorityInterest','TotalLiabilitiesNetMinorityInterest',
-            'TotalNonCurrentAssets','TotalNonCurrentLiabilitiesNetMinorityInterest','TotalTaxPayable','TradeandOtherPayablesNonCurrent','TreasurySharesNumber',
-            'TreasuryStock','WorkInProcess','WorkingCapital','CurrentProvisions','EnterpriseValue','EnterprisesValueEBITDARatio','EnterprisesValueRevenueRatio',
-            'MarketCap','PbRatio','PeRatio','PsRatio','capitalAdequacyRatio','ROE','CapitalExpenditure','ChangeInPrepaidAssets','CommonStockIssuance',
-            'GainLossOnSaleOfPPE','IssuanceOfCapitalStock','NetIntangiblesPurchaseAndSale','NetPPEPurchaseAndSale','PurchaseOfIntangibles','PurchaseOfPPE',
-            'PrepaidAssets','DepreciationAndAmortizationInIncomeStatement','DepreciationIncomeStatement','OtherOperatingExpenses','RestructuringAndMergernAcquisition',
-            'AmortizationCashFlow','PurchaseOfBusiness','SaleOfPPE','AccumulatedDepreciation','DefinedPensionBenefit','LongTermEquityInvestment','OtherShortTermInvestments',
-            'CommonStockPayments','RepurchaseOfCapitalStock','NonCurrentPrepaidAssets','OtherEquityInterest','TaxesReceivable','OtherReceivables',
-            'NetForeignCurrencyExchangeGainLoss','FixedAssetsRevaluationReserve']
-    df_all_company_financial_info_tmp = df_all_company_financial_info_tmp[info_list]
-    df_all_company_financial_info_tmp['asOfDate'] = gfd.preprocess_date(df_all_company_financial_info_tmp['asOfDate'])
-    df_all_company_financial_info_tmp.to_csv(f'./input/finance_data/tmp/{now}_company_financial_info.csv', encoding='cp932', index=False, errors='ignore')
-    df_all_company_financial_info_tmp.to_sql("financial_info", engine, if_exists="append", index=False)    
-    df_all_company_financial_info = pd.concat([origin_df_all_company_financial_info, df_all_company_financial_info_tmp])
-    df_all_company_financial_info.to_csv('./input/finance_data/merge/company_financial_info.csv', encoding='cp932', index=False, errors='ignore')
+    # 過去のデータと結合してCSVファイルに保存（metrics、financial_infoテーブルへは取得中に書き込み済み）
+    # スナップショットはorigin、tmpをそのまま1つのデータとして読めるため、CSVはexport_csvが有効な場合のみ出力
+    if export_csv:
+        for name, encoding in [('company_metrics', 'shift-jis'), ('company_financial_info', None)]:
+            if not store.files('tmp', name, [now]):
+                continue
+            os.makedirs('./input/finance_data/merge', exist_ok=True)
+            origin_df = store.load_baseline(name, f"input/finance_data/origin/{name}.csv", encoding)
+            df_tmp = store.read('tmp', name, run_dates=[now])
+            pd.concat([origin_df, df_tmp]).to_csv(f'./input/finance_data/merge/{name}.csv', encoding='cp932', index=False, errors='ignore')
 
 
     """非財務情報の取得"""
-    # 最新のdocIDのデータを取得
-    end_date = datetime.date.today()
-    start_date = end_date - datetime.timedelta(days= non_financial_period)
-    gd = GetDocid(start_date, end_date)
-    ID_dir_tmp = "./input/non-finance_data/docID"
-    df_report_tmp, edinet_df_tmp = gd.create_docid_df(ID_dir_tmp)
-    os.makedirs(f'{ID_dir_tmp}/tmp/report', exist_ok=True)
-    os.makedirs(f'{ID_dir_tmp}/tmp/edinet_ID', exist_ok=True)
-    df_report_tmp.to_csv(f"{ID_dir_tmp}/tmp/report/{now}_EdinetReport.csv", encoding="cp932", index=False)
-    edinet_df_tmp.to_csv(f"{ID_dir_tmp}/tmp/edinet_ID/{now}_edinet_df.csv",index=False)
+    # 最新のdocIDのデータは財務諸表の更新の検知に使うため、財務情報の取得前に取得済み
     # # 過去のデータと結合して保存
     # origin_df_report = pd.read_csv(f'{ID_dir_tmp}/origin/EdinetReport.csv')
     # merge_df_report = pd.concat([origin_df_report, df_report_tmp])
@@ -291,41 +288,49 @@ def main():
     # merge_edinet_df = pd.concat([origin_edinet_df, edinet_df_tmp])
     # merge_edinet_df.to_csv(f"{ID_dir_tmp}/merge/latest_edinet_df.csv",index=False)
 
-    # docIDをもとに非財務情報を取得
-    docid_list_tmp = edinet_df_tmp["docID"].tolist()
-    gcfe = GetCsvFromEdinet(keys, docid_list_tmp)
-    gcfe.get_csv_file()
-    os.makedirs('./input/non-finance_data/doc/tmp_2', exist_ok=True)
-    filename = f'./input/non-finance_data/doc/tmp_2/{now}_non-financial_data.csv'
-    text_data_tmp = gcfe.get_text_data()
-    text_data_tmp.to_csv(filename, index=False)
-    # edinet_dfと結合
-    non_financial_df_tmp = pd.merge(edinet_df_tmp, text_data_tmp, on='docID', how='outer')
-    non_financial_df_tmp = non_financial_df_tmp.drop_duplicates()
-    os.makedirs('./input/non-finance_data/text_data/tmp', exist_ok=True)
-    non_financial_df_tmp.to_csv(f'./input/non-finance_data/text_data/tmp/{now}_text_data.csv', index=False)
-
-    # ファイルが存在するか確認
-    # チェックするCSVファイルのパス
-    latest_csv_path = './input/non-finance_data/text_data/merge/latest_text_data.csv'
-    if not os.path.exists(latest_csv_path):
-        # 1回目
-        origin_non_financial_df = pd.read_csv('./input/non-finance_data/text_data/origin/20241007_text_data.csv', low_memory=False)
-        latest_non_financial_df = pd.concat([origin_non_financial_df, non_financial_df_tmp])
+    # docIDを取得できなかった場合は非財務情報の取得を行わない（次回の実行で取得）
+    if edinet_df_tmp is None:
+        print("docIDを取得できなかったため、非財務情報の取得をスキップします")
     else:
-        # ２回目以降
-        non_financial_df = pd.read_csv(latest_csv_path,  low_memory=False)
-        latest_non_financial_df = pd.concat([non_financial_df, non_financial_df_tmp])
-    
-    os.makedirs('./input/non-finance_data/text_data/merge', exist_ok=True)
-    latest_non_financial_df.to_csv('./input/non-finance_data/text_data/merge/latest_text_data.csv', index=False)
-    latest_non_financial_df.to_sql("non_financial_data", engine, if_exists="append", index=False)    
+        # docIDをもとに非財務情報を取得
+        docid_list_tmp = edinet_df_tmp["docID"].tolist()
+        gcfe = GetCsvFromEdinet(keys, docid_list_tmp)
+        os.makedirs('./input/non-finance_data/doc/tmp_2', exist_ok=True)
+        filename = f'./input/non-finance_data/doc/tmp_2/{now}_non-financial_data.csv'
+        # zipをディスクに展開せず、必要なCSVだけをメモリ上で読み込んでテキストデータを抽出
+        text_data_tmp = gcfe.get_text_data_streaming()
+        text_data_tmp.to_csv(filename, index=False)
+        # edinet_dfと結合
+        non_financial_df_tmp = pd.merge(edinet_df_tmp, text_data_tmp, on='docID', how='outer')
+        non_financial_df_tmp = non_financial_df_tmp.drop_duplicates()
+        os.makedirs('./input/non-finance_data/text_data/tmp', exist_ok=True)
+        non_financial_df_tmp.to_csv(f'./input/non-finance_data/text_data/tmp/{now}_text_data.csv', index=False)
+
+        # docIDをキーにした追記専用のストアに、まだ保存していない書類だけを書き込む（DBへも新しい書類だけを書き込む）
+        text_store = TextDataStore('./input/non-finance_data/text_data/snapshot')
+        latest_csv_path = './input/non-finance_data/text_data/merge/latest_text_data.csv'
+        # 1回目のみ、従来のCSV（2回目以降に出力していたlatest_text_data.csv、なければ初回取得分）を過去データとして取り込む
+        if os.path.exists(latest_csv_path):
+            text_store.load_baseline(latest_csv_path, engine, now)
+        else:
+            text_store.load_baseline('./input/non-finance_data/text_data/origin/20241007_text_data.csv', engine, now)
+        new_non_financial_df = text_store.append(non_financial_df_tmp, engine, now)
+        print(f"新たに保存した書類: {len(new_non_financial_df)}件")
+        if export_csv:
+            os.makedirs('./input/non-finance_data/text_data/merge', exist_ok=True)
+            text_store.read().to_csv(latest_csv_path, index=False)
 
     # 短期間のスクリプトや接続数制限が厳しい環境では推奨。Webアプリケーションのように長期間稼働するシステムでは、エンジンの管理がアプリケーション全体で行われるため、通常は不要
     engine.dispose()
+    # すべての保存が完了したため、ジャーナルの実行を完了にする
+    journal.finish()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', action='store_true', help='前回中断した実行を、完了済みの銘柄をスキップして再開する')
+    args = parser.parse_args()
+
     start = time.perf_counter() #計測開始
-    main()
+    main(resume=args.resume)
     end = time.perf_counter() #計測終了
     print('{:.2f}'.format((end-start)/60)) # 87.97(秒→分に直し、小数点以下の桁数を指定して出力)
\ No newline at end of file
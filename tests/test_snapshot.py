@@ -0,0 +1,48 @@
+"""
+snapshot.pyのテスト
+    - 全行欠損のcategory列を含むチャンクと、値のあるチャンクを1つのデータとして読み込めることを確認
+    - apply_schemaを通さずに保存された、辞書の値の型がdoubleのpartファイルも読み込めることを確認
+
+実行方法
+    python -m pytest tests
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from get_data.schema import apply_schema
+from get_data.snapshot import SnapshotStore
+
+dtypes = {'symbol': 'category', 'currencyCode': 'category', 'TotalRevenue': 'float64'}
+
+def test_read_all_nan_category_chunk(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    # 1つ目のチャンクはcurrencyCodeが全行欠損
+    store.write('tmp', 'company_financial_info',
+                apply_schema(pd.DataFrame({'symbol': ['1301.T'], 'currencyCode': [np.nan], 'TotalRevenue': [1.0]}), dtypes), '20241001')
+    store.write('tmp', 'company_financial_info',
+                apply_schema(pd.DataFrame({'symbol': ['1332.T'], 'currencyCode': ['JPY'], 'TotalRevenue': [2.0]}), dtypes), '20241001')
+
+    df = store.read('tmp', 'company_financial_info')
+    assert df['currencyCode'].dtype == 'category'
+    assert df['currencyCode'].isna().tolist() == [True, False]
+    assert df['currencyCode'].iloc[1] == 'JPY'
+    assert df['symbol'].tolist() == ['1301.T', '1332.T']
+
+def test_read_double_dictionary_chunk(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    partition = store.path('tmp', 'company_financial_info', '20241001')
+    os.makedirs(partition)
+    # 全行欠損の列をそのままcategoryに変換すると、辞書の値の型がdoubleになる
+    pq.write_table(pa.Table.from_pandas(pd.DataFrame({'currencyCode': pd.Series([np.nan]).astype('category')}), preserve_index=False),
+                   os.path.join(partition, 'part-00000.parquet'))
+    store.write('tmp', 'company_financial_info', pd.DataFrame({'currencyCode': pd.Series(['JPY']).astype('category')}), '20241001')
+
+    df = store.read('tmp', 'company_financial_info', columns=['currencyCode'])
+    assert df['currencyCode'].isna().tolist() == [True, False]
+    assert df['currencyCode'].iloc[1] == 'JPY'